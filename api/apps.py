@@ -5,4 +5,7 @@ class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
     def ready(self):
+        from django.contrib.auth.signals import user_logged_in
         import api.signals
+        # last_login is written behind by api.presence instead of on every login.
+        user_logged_in.disconnect(dispatch_uid='update_last_login')
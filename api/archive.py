@@ -0,0 +1,369 @@
+import bisect
+import gzip
+import json
+import mmap
+import os
+import struct
+import uuid
+import zlib
+from pathlib import Path
+
+from django.db import router, transaction
+from django.db.models import Case, Q, When
+from django.utils.dateparse import parse_datetime
+
+from . import deletions
+from .models import Hashtag, Tweet, UserProfile, reply_subtree, thread_place, tweets_removing
+
+MANIFEST_NAME = 'manifest.json'
+ID_INDEX_SUFFIX = '.idx'
+AUTHOR_INDEX_SUFFIX = '.aidx'
+# tweet_id, author_id, frame offset, frame length
+INDEX_ENTRY = struct.Struct('<qqQI')
+RECORD_FIELDS = (
+    'id', 'content', 'created_at', 'author_id', 'author__user__username', 'parent_tweet_id',
+    'is_deleted', 'delete_reason', 'like_count', 'retweet_count', 'reply_count',
+)
+
+
+def _fsync_directory(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_durably(path, data):
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'wb') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp, path)
+    _fsync_directory(path.parent)
+
+
+def _record(row, hashtags):
+    return {
+        'id': row['id'],
+        'content': row['content'],
+        'created_at': row['created_at'].isoformat(),
+        'author_id': row['author_id'],
+        'author': row['author__user__username'],
+        'parent_tweet_id': row['parent_tweet_id'],
+        'hashtags': hashtags.get(row['id'], []),
+        'is_deleted': row['is_deleted'],
+        'delete_reason': row['delete_reason'],
+        'like_count': row['like_count'],
+        'retweet_count': row['retweet_count'],
+        'reply_count': row['reply_count'],
+    }
+
+
+def encode_frame(records):
+    """One gzip member holding ``records`` as NDJSON. Concatenated frames still form a valid gzip file."""
+    lines = b''.join(json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n' for record in records)
+    return gzip.compress(lines, mtime=0)
+
+
+class TweetArchiver:
+    """Moves tweets older than a cutoff into gzip NDJSON segments under ``directory``.
+
+    Each chunk of old tweets is written with its reply subtree as one segment, which is
+    fsynced and recorded in the manifest before the rows are deleted. The manifest keeps
+    the run's cutoff and keyset position, so a crashed run resumes where it stopped.
+    """
+
+    def __init__(self, directory, chunk_size=500, frame_size=256):
+        self.directory = Path(directory)
+        self.chunk_size = chunk_size
+        self.frame_size = frame_size
+        self.manifest_path = self.directory / MANIFEST_NAME
+
+    def load_manifest(self):
+        if not self.manifest_path.exists():
+            return {'segments': [], 'run': None, 'pending': None}
+        with open(self.manifest_path, encoding='utf-8') as file:
+            return json.load(file)
+
+    def save_manifest(self, manifest):
+        _write_durably(self.manifest_path, json.dumps(manifest, indent=1).encode('utf-8'))
+
+    def _rows(self, queryset):
+        return queryset.order_by('id').values(*RECORD_FIELDS).iterator(chunk_size=self.chunk_size)
+
+    def _next_chunk(self, cutoff, last_id):
+        roots = Tweet.objects.filter(created_at__lt=cutoff, id__gt=last_id).order_by('id')
+        root_ids = list(roots.values_list('id', flat=True)[:self.chunk_size])
+        if not root_ids:
+            return [], []
+        tweets = Tweet.objects.filter(Q(pk__in=root_ids) | Q(pk__in=reply_subtree(root_ids)))
+        hashtags = {}
+        through = Tweet.hashtags.through.objects.filter(Q(tweet_id__in=root_ids) | Q(tweet_id__in=reply_subtree(root_ids)))
+        for tweet_id, tag in through.values_list('tweet_id', 'hashtag__tag').iterator():
+            hashtags.setdefault(tweet_id, []).append(tag)
+        return root_ids, [_record(row, hashtags) for row in self._rows(tweets)]
+
+    def write_segment(self, records):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Restored tweets can be archived again, so the id range alone does not make a name unique.
+        name = f"segment-{records[0]['id']:012d}-{records[-1]['id']:012d}-{uuid.uuid4().hex[:12]}.ndjson.gz"
+        frames, entries, offset = [], [], 0
+        for i in range(0, len(records), self.frame_size):
+            batch = records[i:i + self.frame_size]
+            frame = encode_frame(batch)
+            entries.extend((record['id'], record['author_id'], offset, len(frame)) for record in batch)
+            frames.append(frame)
+            offset += len(frame)
+        _write_durably(self.directory / name, b''.join(frames))
+        write_index(self.directory / name, entries)
+        return {'name': name, 'first_id': records[0]['id'], 'last_id': records[-1]['id'], 'count': len(records)}
+
+    def _delete(self, ids):
+        """Delete ``ids`` and the rows that depend on them, a batch per statement.
+
+        Rows go without per-row signals; ``tweets_removing`` is sent once per batch instead.
+        """
+        using = router.db_for_write(Tweet)
+        dependents = [
+            rel for rel in Tweet._meta.get_fields(include_hidden=True)
+            if rel.one_to_many and rel.auto_created and rel.related_model is not Tweet
+        ]
+        with transaction.atomic(using=using):
+            for i in range(0, len(ids), 900):
+                batch = ids[i:i + 900]
+                tweets_removing.send(sender=Tweet, tweet_ids=batch)
+                for rel in dependents:
+                    rel.related_model._base_manager.filter(**{f'{rel.field.name}__in': batch})._raw_delete(using)
+                Tweet._base_manager.filter(pk__in=batch)._raw_delete(using)
+
+    def run(self, cutoff):
+        """Archive and delete tweets created before ``cutoff``. Returns the number of tweets archived."""
+        manifest = self.load_manifest()
+        if manifest.get('pending'):
+            self._delete(manifest['pending'])
+            manifest['pending'] = None
+            self.save_manifest(manifest)
+        if not manifest.get('run'):
+            manifest['run'] = {'cutoff': cutoff.isoformat(), 'last_id': 0}
+        run = manifest['run']
+
+        archived = 0
+        while True:
+            root_ids, records = self._next_chunk(run['cutoff'], run['last_id'])
+            if not root_ids:
+                break
+            manifest['segments'].append(self.write_segment(records))
+            run['last_id'] = root_ids[-1]
+            manifest['pending'] = [record['id'] for record in records]
+            self.save_manifest(manifest)
+            self._delete(manifest['pending'])
+            manifest['pending'] = None
+            self.save_manifest(manifest)
+            archived += len(records)
+
+        manifest['run'] = None
+        self.save_manifest(manifest)
+        return archived
+
+
+def write_index(segment_path, entries):
+    """Write the id and author sidecar indexes for a segment from its ``INDEX_ENTRY`` tuples."""
+    for suffix, key in ((ID_INDEX_SUFFIX, lambda e: e[0]), (AUTHOR_INDEX_SUFFIX, lambda e: (e[1], e[0]))):
+        data = b''.join(INDEX_ENTRY.pack(*entry) for entry in sorted(entries, key=key))
+        _write_durably(segment_path.with_name(segment_path.name + suffix), data)
+
+
+def index_segment(segment_path):
+    """Rebuild the sidecar indexes of a segment by walking its gzip frames."""
+    entries = []
+    with open(segment_path, 'rb') as file:
+        data = file.read()
+    offset = 0
+    while offset < len(data):
+        decompressor = zlib.decompressobj(wbits=31)
+        payload = decompressor.decompress(data[offset:])
+        length = len(data) - offset - len(decompressor.unused_data)
+        for line in payload.splitlines():
+            record = json.loads(line)
+            entries.append((record['id'], record['author_id'], offset, length))
+        offset += length
+    write_index(segment_path, entries)
+
+
+class _IndexView:
+    """Read-only sequence of ``INDEX_ENTRY`` tuples over a memory-mapped index file."""
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.buffer) // INDEX_ENTRY.size
+
+    def __getitem__(self, position):
+        return INDEX_ENTRY.unpack_from(self.buffer, position * INDEX_ENTRY.size)
+
+    def close(self):
+        self.buffer.close()
+        self.file.close()
+
+
+class _Segment:
+    def __init__(self, path):
+        if not path.with_name(path.name + ID_INDEX_SUFFIX).exists():
+            index_segment(path)
+        self.ids = _IndexView(path.with_name(path.name + ID_INDEX_SUFFIX))
+        self.authors = _IndexView(path.with_name(path.name + AUTHOR_INDEX_SUFFIX))
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _records(self, entries):
+        frames = {}
+        for tweet_id, _, offset, length in entries:
+            if offset not in frames:
+                lines = gzip.decompress(self.data[offset:offset + length]).splitlines()
+                frames[offset] = {record['id']: record for record in map(json.loads, lines)}
+            yield frames[offset][tweet_id]
+
+    def get(self, tweet_id):
+        position = bisect.bisect_left(self.ids, tweet_id, key=lambda entry: entry[0])
+        if position < len(self.ids) and self.ids[position][0] == tweet_id:
+            return next(self._records([self.ids[position]]))
+        return None
+
+    def by_author(self, author_id):
+        start = bisect.bisect_left(self.authors, author_id, key=lambda entry: entry[1])
+        end = bisect.bisect_right(self.authors, author_id, lo=start, key=lambda entry: entry[1])
+        return list(self._records(self.authors[i] for i in range(start, end)))
+
+    def close(self):
+        self.ids.close()
+        self.authors.close()
+        self.data.close()
+        self.file.close()
+
+
+class ArchiveReader:
+    """Random access to archived tweets through the sidecar indexes.
+
+    A lookup bisects the memory-mapped index of each candidate segment and
+    decompresses only the frame holding the record.
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        manifest_path = self.directory / MANIFEST_NAME
+        segments = []
+        if manifest_path.exists():
+            with open(manifest_path, encoding='utf-8') as file:
+                segments = json.load(file)['segments']
+        self.segments = sorted(segments, key=lambda segment: segment['first_id'])
+        self.first_ids = [segment['first_id'] for segment in self.segments]
+        self.reach = []
+        for segment in self.segments:
+            self.reach.append(max(segment['last_id'], self.reach[-1] if self.reach else segment['last_id']))
+        self._open = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _segment(self, position):
+        name = self.segments[position]['name']
+        if name not in self._open:
+            self._open[name] = _Segment(self.directory / name)
+        return self._open[name]
+
+    def get(self, tweet_id):
+        position = bisect.bisect_right(self.first_ids, tweet_id) - 1
+        while position >= 0 and self.reach[position] >= tweet_id:
+            if self.segments[position]['last_id'] >= tweet_id:
+                record = self._segment(position).get(tweet_id)
+                if record is not None:
+                    return record
+            position -= 1
+        return None
+
+    def by_author(self, author_id):
+        records = []
+        for position in range(len(self.segments)):
+            records.extend(self._segment(position).by_author(author_id))
+        return sorted(records, key=lambda record: record['id'])
+
+    def close(self):
+        for segment in self._open.values():
+            segment.close()
+        self._open.clear()
+
+
+def restore(records, batch_size=500):
+    """Recreate archived tweets that are not in the database. Returns the restored ids.
+
+    Tweets whose author no longer exists are skipped, and replies whose parent is
+    gone are restored as top-level tweets. Counters start at zero because likes and
+    retweets are not archived.
+    """
+    records = sorted(records, key=lambda record: record['id'])
+    restored = []
+    for i in range(0, len(records), batch_size):
+        restored.extend(_restore_batch(records[i:i + batch_size]))
+    return restored
+
+
+def _restore_batch(records):
+    records = {record['id']: record for record in records}
+    existing = set(Tweet.objects.filter(pk__in=list(records)).values_list('pk', flat=True))
+    records = {tweet_id: record for tweet_id, record in records.items() if tweet_id not in existing}
+    authors = set(UserProfile.objects.filter(pk__in={record['author_id'] for record in records.values()}).values_list('pk', flat=True))
+    records = {tweet_id: record for tweet_id, record in records.items() if record['author_id'] in authors}
+    if not records:
+        return []
+    parents = {record['parent_tweet_id'] for record in records.values() if record['parent_tweet_id']}
+    parents = {pk: (pk, path, depth) for pk, path, depth in Tweet.objects.filter(pk__in=parents).values_list('pk', 'path', 'depth')}
+    tweets = []
+    for record in sorted(records.values(), key=lambda record: record['id']):
+        # Parents sort before their replies, so restored parents are placed first.
+        parent = parents.get(record['parent_tweet_id'])
+        path, depth = thread_place(parent)
+        parents[record['id']] = (record['id'], path, depth)
+        tweets.append(Tweet(
+            id=record['id'], content=record['content'], author_id=record['author_id'],
+            parent_tweet_id=parent[0] if parent else None, path=path, depth=depth,
+            is_deleted=record['is_deleted'], delete_reason=record['delete_reason'],
+        ))
+
+    tags = {tag for record in records.values() for tag in record['hashtags']}
+    with transaction.atomic():
+        Tweet.objects.bulk_create(tweets)
+        Tweet.objects.filter(pk__in=list(records)).update(created_at=Case(
+            *[When(pk=tweet_id, then=parse_datetime(record['created_at'])) for tweet_id, record in records.items()]
+        ))
+        deleted = [tweet_id for tweet_id, record in records.items() if record['is_deleted']]
+        if deleted:
+            deletions.record(Tweet.objects.filter(pk__in=deleted))
+        if tags:
+            Hashtag.objects.bulk_create([Hashtag(tag=tag) for tag in tags], ignore_conflicts=True)
+            tag_ids = dict(Hashtag.objects.filter(tag__in=tags).values_list('tag', 'id'))
+            Tweet.hashtags.through.objects.bulk_create([
+                Tweet.hashtags.through(tweet_id=tweet_id, hashtag_id=tag_ids[tag])
+                for tweet_id, record in records.items() for tag in record['hashtags']
+            ], ignore_conflicts=True)
+    return sorted(records)
+
+
+def iter_archive(directory):
+    """Yield every archived record, segment by segment."""
+    directory = Path(directory)
+    manifest_path = directory / MANIFEST_NAME
+    if not manifest_path.exists():
+        return
+    with open(manifest_path, encoding='utf-8') as file:
+        segments = json.load(file)['segments']
+    for segment in segments:
+        with gzip.open(directory / segment['name'], 'rt', encoding='utf-8') as file:
+            for line in file:
+                yield json.loads(line)
@@ -0,0 +1,96 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.utils.crypto import salted_hmac
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .lru import LRUCache
+from .models import UserProfile
+
+VERSION_CLAIM = 'ver'
+
+users = LRUCache(settings.AUTH_USER_CACHE_SIZE, settings.AUTH_USER_CACHE_TTL)
+
+_user_fields = [field.attname for field in User._meta.concrete_fields]
+_profile_fields = [field.attname for field in UserProfile._meta.concrete_fields]
+
+
+def token_version(user):
+    """Changes whenever the password or active flag does, revoking tokens issued before."""
+    return salted_hmac('api.authentication.token_version', f'{user.password}:{user.is_active}').hexdigest()[:16]
+
+
+def add_claims(token, user):
+    """Sign the claims ``CachedJWTAuthentication`` relies on into ``token``."""
+    token[VERSION_CLAIM] = token_version(user)
+    token['username'] = user.get_username()
+    profile_id = UserProfile.objects.filter(user=user).values_list('pk', flat=True).first()
+    if profile_id is not None:
+        token['profile_id'] = profile_id
+    if user.is_staff:
+        token['is_staff'] = True
+    return token
+
+
+def _build(row):
+    user_values, profile_values = row
+    user = User.from_db(User.objects.db, _user_fields, user_values)
+    if profile_values is not None:
+        user.userprofile = UserProfile.from_db(UserProfile.objects.db, _profile_fields, profile_values)
+    return user
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWT authentication that resolves the user and profile without a query on most requests.
+
+    Rows are kept in a bounded LRU for ``AUTH_USER_CACHE_TTL`` seconds and evicted when
+    the user or profile is saved or deleted in this process; every request gets fresh
+    instances built from them. Tokens carrying a ``ver`` claim are rejected once the
+    user's password or active flag changes.
+
+    With ``AUTH_TRUST_TOKEN_CLAIMS`` the user and profile are built from the signed
+    ``username`` and ``profile_id`` claims alone, without the database or the revocation
+    check, so changes take effect only when tokens expire. Their other fields are
+    deferred and load on first access.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+
+        if settings.AUTH_TRUST_TOKEN_CLAIMS and 'username' in validated_token and 'profile_id' in validated_token:
+            # Fields not in the claims are deferred, so reading one (a profile's bio, say)
+            # loads it from the database instead of returning an empty default.
+            user = User.from_db(
+                User.objects.db, ['id', 'username', 'is_staff'],
+                [user_id, validated_token['username'], validated_token.get('is_staff', False)],
+            )
+            user.userprofile = UserProfile.from_db(UserProfile.objects.db, ['id', 'user_id'], [validated_token['profile_id'], user_id])
+            return user
+
+        entry = users.get(user_id)
+        if entry is None:
+            user = User.objects.select_related('userprofile').filter(pk=user_id).first()
+            if user is None:
+                raise AuthenticationFailed('User not found', code='user_not_found')
+            profile = getattr(user, 'userprofile', None)
+            entry = (
+                token_version(user),
+                user.is_active,
+                (
+                    [getattr(user, name) for name in _user_fields],
+                    None if profile is None else [getattr(profile, name) for name in _profile_fields],
+                ),
+            )
+            users.set(user_id, entry)
+
+        version, is_active, row = entry
+        if not is_active:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        if VERSION_CLAIM in validated_token and validated_token[VERSION_CLAIM] != version:
+            raise AuthenticationFailed('Token has been revoked', code='token_revoked')
+        return _build(row)
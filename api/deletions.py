@@ -0,0 +1,121 @@
+from collections import Counter
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.db import transaction
+from django.db.models import Case, Count, F, Min, Q, Sum, Value, When
+from django.db.models.functions import TruncDate
+
+from .models import DeletionCount, Tweet
+
+
+def as_moment(value):
+    """``value`` as an aware datetime: a plain ``date`` is its UTC midnight, a naive datetime is taken as UTC."""
+    if not isinstance(value, datetime):
+        return midnight(value)
+    return value if value.tzinfo is not None else value.replace(tzinfo=dt_timezone.utc)
+
+
+def day_of(moment):
+    return as_moment(moment).astimezone(dt_timezone.utc).date()
+
+
+def midnight(day):
+    return datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+
+
+def adjust_counts(deltas, batch_size=200):
+    """Apply ``{(day, delete_reason): delta}`` to the daily rollup, like ``hashtags.adjust_counts``."""
+    deltas = [(key, delta) for key, delta in deltas.items() if delta]
+    for start in range(0, len(deltas), batch_size):
+        batch = deltas[start:start + batch_size]
+        DeletionCount.objects.bulk_create(
+            [DeletionCount(day=day, delete_reason=reason, count=0) for (day, reason), _ in batch],
+            ignore_conflicts=True,
+        )
+        match = Q()
+        whens = []
+        for (day, reason), delta in batch:
+            match |= Q(day=day, delete_reason=reason)
+            whens.append(When(day=day, delete_reason=reason, then=Value(delta)))
+        DeletionCount.objects.filter(match).update(count=F('count') + Case(*whens, default=Value(0)))
+
+
+def deleted_days(tweets):
+    """Count deleted ``(day, delete_reason)`` pairs over a queryset of tweets."""
+    rows = tweets.filter(is_deleted=True).annotate(day=TruncDate('created_at', tzinfo=dt_timezone.utc))
+    rows = rows.values('day', 'delete_reason').annotate(n=Count('pk'))
+    return Counter({(row['day'], row['delete_reason']): row['n'] for row in rows})
+
+
+def record(tweets, sign=1):
+    adjust_counts({key: sign * n for key, n in deleted_days(tweets).items()})
+
+
+def record_tweet(tweet, sign=1):
+    if tweet.is_deleted:
+        adjust_counts({(day_of(tweet.created_at), tweet.delete_reason): sign})
+
+
+def backfill(since=None, until=None, chunk_days=31):
+    """Rebuild the rollup for the days in ``[since, until)``, every day with tweets by default.
+
+    Each chunk of days is replaced in its own transaction. Returns the number of days rebuilt.
+    """
+    if since is None:
+        first = Tweet.objects.aggregate(first=Min('created_at'))['first']
+        if first is None:
+            DeletionCount.objects.all().delete()
+            return 0
+        since = day_of(first)
+    until = until or day_of(datetime.now(dt_timezone.utc)) + timedelta(days=1)
+    day = since
+    while day < until:
+        end = min(day + timedelta(days=chunk_days), until)
+        with transaction.atomic():
+            DeletionCount.objects.filter(day__gte=day, day__lt=end).delete()
+            counts = deleted_days(Tweet.objects.filter(created_at__gte=midnight(day), created_at__lt=midnight(end)))
+            DeletionCount.objects.bulk_create(
+                [DeletionCount(day=key[0], delete_reason=key[1], count=n) for key, n in counts.items()], batch_size=500,
+            )
+        day = end
+    return (until - since).days
+
+
+def reconcile(since):
+    """Rebuild the rollup from ``since`` on, and for every older day with a tweet deleted since then.
+
+    The rollup is keyed on when tweets were created, so a recent deletion of an old tweet
+    lands on an old day; ``deleted_at`` finds those. Returns the number of days rebuilt.
+    """
+    since = day_of(since)
+    old = Tweet.objects.filter(deleted_at__gte=midnight(since), created_at__lt=midnight(since))
+    days = old.annotate(day=TruncDate('created_at', tzinfo=dt_timezone.utc)).values_list('day', flat=True).distinct()
+    rebuilt = 0
+    for day in sorted(days):
+        rebuilt += backfill(day, day + timedelta(days=1))
+    return rebuilt + backfill(since)
+
+
+def _live(since, until, inclusive):
+    tweets = Tweet.objects.filter(is_deleted=True, created_at__gte=since)
+    tweets = tweets.filter(created_at__lte=until) if inclusive else tweets.filter(created_at__lt=until)
+    rows = tweets.values('delete_reason').annotate(n=Count('pk'))
+    return Counter({row['delete_reason']: row['n'] for row in rows})
+
+
+def statistics(since, until):
+    """``{delete_reason: count}`` of deleted tweets created in ``[since, until]``, most frequent first.
+
+    Whole UTC days are summed from the rollup; the partial days at either end are counted live.
+    """
+    since, until = as_moment(since), as_moment(until)
+    first_day = day_of(since) if midnight(day_of(since)) == since else day_of(since) + timedelta(days=1)
+    last_day = day_of(until)
+    if first_day >= last_day:
+        totals = _live(since, until, inclusive=True)
+    else:
+        rows = DeletionCount.objects.filter(day__gte=first_day, day__lt=last_day).values('delete_reason')
+        totals = Counter({row['delete_reason']: row['n'] for row in rows.annotate(n=Sum('count'))})
+        totals += _live(since, midnight(first_day), inclusive=False)
+        totals += _live(midnight(last_day), until, inclusive=True)
+    return {reason: n for reason, n in totals.most_common() if n > 0}
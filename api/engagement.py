@@ -0,0 +1,190 @@
+from django.contrib.auth.models import User
+from django.db import connections, router, transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+
+from . import response_cache
+from .models import Follow, Like, Retweet, Tweet, UserProfile
+
+# Likes and retweets: the model and the tweet counter it keeps.
+COUNTERS = {Like: 'like_count', Retweet: 'retweet_count'}
+
+
+def _fetch(using, sql, params):
+    with connections[using].cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def _names(model, *fields):
+    quote = connections[router.db_for_write(model)].ops.quote_name
+    return [quote(model._meta.db_table)] + [quote(model._meta.get_field(name).column) for name in fields]
+
+
+def _count(using, model, tweet_id, delta):
+    """Move the tweet's counter for ``model`` by ``delta``; returns the tweet's author id."""
+    tweet, pk, author, counter = _names(Tweet, 'id', 'author', COUNTERS[model])
+    rows = _fetch(
+        using,
+        f'UPDATE {tweet} SET {counter} = {counter} + %s WHERE {pk} = %s AND {counter} + %s >= 0 RETURNING {author}',
+        [delta, tweet_id, delta],
+    )
+    return rows[0][0] if rows else None
+
+
+def engage(model, profile_id, tweet_id):
+    """Add a ``Like`` or ``Retweet`` of ``tweet_id`` by ``profile_id``.
+
+    The row is written by one ``INSERT ... SELECT`` from the tweet that does nothing on
+    conflict, so concurrent duplicates cannot fail. Returns the tweet's author id when
+    the row was added and ``None`` when it already existed; raises
+    ``Tweet.DoesNotExist`` for a missing tweet. ``post_save`` is sent for the new row.
+    """
+    table, row_pk, user, tweet_column, created_at = _names(model, 'id', 'user', 'tweet', 'created_at')
+    tweets, pk = _names(Tweet, 'id')
+    using, now = router.db_for_write(model), timezone.now()
+    with transaction.atomic(using=using):
+        rows = _fetch(
+            using,
+            f'INSERT INTO {table} ({user}, {tweet_column}, {created_at}) '
+            f'SELECT %s, {pk}, %s FROM {tweets} WHERE {pk} = %s '
+            f'ON CONFLICT ({user}, {tweet_column}) DO NOTHING RETURNING {row_pk}',
+            [profile_id, connections[using].ops.adapt_datetimefield_value(now), tweet_id],
+        )
+        if not rows:
+            if not Tweet.objects.filter(pk=tweet_id).exists():
+                raise Tweet.DoesNotExist
+            return None
+        author_id = _count(using, model, tweet_id, 1)
+    instance = model(id=rows[0][0], user_id=profile_id, tweet_id=tweet_id, created_at=now)
+    post_save.send(sender=model, instance=instance, created=True, update_fields=None, raw=False, using=using)
+    return author_id
+
+
+def engage_many(model, profile_id, tweet_ids):
+    """Add ``Like`` or ``Retweet`` rows for many tweets, like ``engage`` with one multi-row insert.
+
+    Returns ``(added, missing)``: ``{tweet_id: author_id}`` for the rows this call added
+    and the ids of tweets that do not exist. Rows that already existed are left alone.
+    """
+    table, user, tweet_column, created_at = _names(model, 'user', 'tweet', 'created_at')
+    tweets, pk, author, counter = _names(Tweet, 'id', 'author', COUNTERS[model])
+    using, now = router.db_for_write(model), timezone.now()
+    placeholders = ', '.join(['%s'] * len(tweet_ids))
+    with transaction.atomic(using=using):
+        inserted = _fetch(
+            using,
+            f'INSERT INTO {table} ({user}, {tweet_column}, {created_at}) '
+            f'SELECT %s, {pk}, %s FROM {tweets} WHERE {pk} IN ({placeholders}) '
+            f'ON CONFLICT ({user}, {tweet_column}) DO NOTHING RETURNING {tweet_column}',
+            [profile_id, connections[using].ops.adapt_datetimefield_value(now), *tweet_ids],
+        )
+        added = {}
+        if inserted:
+            ids = [row[0] for row in inserted]
+            added = dict(_fetch(
+                using,
+                f'UPDATE {tweets} SET {counter} = {counter} + 1 WHERE {pk} IN ({", ".join(["%s"] * len(ids))}) RETURNING {pk}, {author}',
+                ids,
+            ))
+            response_cache.invalidate(*[f'tweet:{pk}' for pk in added])
+    rest = set(tweet_ids) - set(added)
+    missing = sorted(rest - set(Tweet.objects.filter(pk__in=rest).values_list('pk', flat=True))) if rest else []
+    return added, missing
+
+
+def relationships(profile_id, usernames=(), tweet_ids=()):
+    """The viewer's relationships, from at most four queries whatever the number asked about.
+
+    Returns ``(users, tweets)``: ``{username: {'following', 'followed_by'}}`` for the
+    ``usernames`` that exist and ``{tweet_id: {'liked', 'retweeted'}}`` for ``tweet_ids``.
+    """
+    users = {}
+    if usernames:
+        profiles = dict(UserProfile.objects.filter(user__username__in=usernames).values_list('pk', 'user__username'))
+        follows = Follow.objects.filter(
+            Q(follower_id=profile_id, followed_id__in=list(profiles)) | Q(followed_id=profile_id, follower_id__in=list(profiles))
+        ).values_list('follower_id', 'followed_id')
+        users = {name: {'following': False, 'followed_by': False} for name in profiles.values()}
+        for follower_id, followed_id in follows:
+            if follower_id == profile_id:
+                users[profiles[followed_id]]['following'] = True
+            if followed_id == profile_id:
+                users[profiles[follower_id]]['followed_by'] = True
+    tweets = {}
+    if tweet_ids:
+        liked = set(Like.objects.filter(user_id=profile_id, tweet_id__in=tweet_ids).values_list('tweet_id', flat=True))
+        retweeted = set(Retweet.objects.filter(user_id=profile_id, tweet_id__in=tweet_ids).values_list('tweet_id', flat=True))
+        tweets = {pk: {'liked': pk in liked, 'retweeted': pk in retweeted} for pk in tweet_ids}
+    return users, tweets
+
+
+def disengage(model, profile_id, tweet_id):
+    """Remove a ``Like`` or ``Retweet`` in one ``DELETE``; returns whether there was one.
+
+    Raises ``Tweet.DoesNotExist`` for a missing tweet. ``post_delete`` is sent for the removed row.
+    """
+    table, pk, user, tweet_column = _names(model, 'id', 'user', 'tweet')
+    using = router.db_for_write(model)
+    with transaction.atomic(using=using):
+        rows = _fetch(using, f'DELETE FROM {table} WHERE {user} = %s AND {tweet_column} = %s RETURNING {pk}', [profile_id, tweet_id])
+        if not rows:
+            if not Tweet.objects.filter(pk=tweet_id).exists():
+                raise Tweet.DoesNotExist
+            return False
+        _count(using, model, tweet_id, -1)
+    instance = model(id=rows[0][0], user_id=profile_id, tweet_id=tweet_id)
+    post_delete.send(sender=model, instance=instance, origin=instance, using=using)
+    return True
+
+
+def follow(profile_id, username):
+    """Make ``profile_id`` follow ``username`` with one ``INSERT ... SELECT``, like ``engage``.
+
+    Returns the followed profile's id when the follow was added and ``None`` when it
+    already existed; raises ``UserProfile.DoesNotExist`` for an unknown username.
+    """
+    table, pk, follower, followed, created_at = _names(Follow, 'id', 'follower', 'followed', 'created_at')
+    profiles, profile_pk, profile_user = _names(UserProfile, 'id', 'user')
+    users, user_pk, name = _names(User, 'id', 'username')
+    using, now = router.db_for_write(Follow), timezone.now()
+    rows = _fetch(
+        using,
+        f'INSERT INTO {table} ({follower}, {followed}, {created_at}) '
+        f'SELECT %s, p.{profile_pk}, %s FROM {profiles} p INNER JOIN {users} u ON u.{user_pk} = p.{profile_user} '
+        f'WHERE u.{name} = %s ON CONFLICT ({follower}, {followed}) DO NOTHING RETURNING {pk}, {followed}',
+        [profile_id, connections[using].ops.adapt_datetimefield_value(now), username],
+    )
+    if not rows:
+        if not UserProfile.objects.filter(user__username=username).exists():
+            raise UserProfile.DoesNotExist
+        return None
+    instance = Follow(id=rows[0][0], follower_id=profile_id, followed_id=rows[0][1], created_at=now)
+    post_save.send(sender=Follow, instance=instance, created=True, update_fields=None, raw=False, using=using)
+    return instance.followed_id
+
+
+def unfollow(profile_id, username):
+    """Remove a follow in one ``DELETE``; returns whether there was one.
+
+    Raises ``UserProfile.DoesNotExist`` for an unknown username.
+    """
+    table, pk, follower, followed = _names(Follow, 'id', 'follower', 'followed')
+    profiles, profile_pk, profile_user = _names(UserProfile, 'id', 'user')
+    users, user_pk, name = _names(User, 'id', 'username')
+    using = router.db_for_write(Follow)
+    rows = _fetch(
+        using,
+        f'DELETE FROM {table} WHERE {follower} = %s AND {followed} IN ('
+        f'SELECT p.{profile_pk} FROM {profiles} p INNER JOIN {users} u ON u.{user_pk} = p.{profile_user} WHERE u.{name} = %s'
+        f') RETURNING {pk}, {followed}',
+        [profile_id, username],
+    )
+    if not rows:
+        if not UserProfile.objects.filter(user__username=username).exists():
+            raise UserProfile.DoesNotExist
+        return False
+    instance = Follow(id=rows[0][0], follower_id=profile_id, followed_id=rows[0][1])
+    post_delete.send(sender=Follow, instance=instance, origin=instance, using=using)
+    return True
@@ -0,0 +1,93 @@
+import re
+
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models.signals import m2m_changed
+
+from .lru import LRUCache
+from . import notifications
+from .models import Hashtag, Tweet, UserProfile
+
+HASHTAG_RE = re.compile(r'(?<![\w#&])#(\w{1,100})(?!\w)')
+MENTION_RE = re.compile(r'(?<![\w@])@([\w.+-]{1,150})(?![\w.+-])')
+
+tag_ids = LRUCache(settings.HASHTAG_ID_CACHE_SIZE, settings.HASHTAG_ID_CACHE_TTL)
+
+
+def _unique(values):
+    return list(dict.fromkeys(values))
+
+
+def extract(content):
+    """Return the ``(hashtags, usernames)`` referenced in ``content``, in order of appearance.
+
+    Hashtags are lowercased so ``#Django`` and ``#django`` share a row.
+    """
+    tags = _unique(match.lower() for match in HASHTAG_RE.findall(content))
+    usernames = _unique(match.rstrip('.+-') for match in MENTION_RE.findall(content))
+    return tags, [username for username in usernames if username]
+
+
+def hashtag_ids(tags):
+    """Map ``tags`` to hashtag ids, creating missing ones.
+
+    Cache hits cost no queries; misses cost one ``INSERT ... ON CONFLICT DO NOTHING``
+    and one lookup, whatever their number. Ids are cached once the transaction that
+    may have created them commits.
+    """
+    found = tag_ids.get_many(tags)
+    missing = [tag for tag in tags if tag not in found]
+    if missing:
+        Hashtag.objects.bulk_create([Hashtag(tag=tag) for tag in missing], ignore_conflicts=True)
+        created = dict(Hashtag.objects.filter(tag__in=missing).values_list('tag', 'pk'))
+        transaction.on_commit(lambda: tag_ids.set_many(created))
+        found.update(created)
+    return found
+
+
+def link_hashtags(tweets, tags):
+    """Link each tweet to ``tags[tweet.pk]`` with a single insert into the through table.
+
+    ``m2m_changed`` is sent per tweet, like ``tweet.hashtags.add()`` would, so the
+    hourly counts and trending sketches see these links.
+    """
+    ids = hashtag_ids(_unique(tag for tweet in tweets for tag in tags[tweet.pk]))
+    pk_sets = {tweet.pk: {ids[tag] for tag in tags[tweet.pk] if tag in ids} for tweet in tweets}
+    through = Tweet.hashtags.through
+    rows = [through(tweet_id=tweet_pk, hashtag_id=hashtag_id) for tweet_pk, pk_set in pk_sets.items() for hashtag_id in pk_set]
+    if not rows:
+        return
+    using = router.db_for_write(through)
+    for tweet in tweets:
+        if pk_sets[tweet.pk]:
+            m2m_changed.send(sender=through, action='pre_add', instance=tweet, reverse=False, model=Hashtag, pk_set=pk_sets[tweet.pk], using=using)
+    through.objects.using(using).bulk_create(rows, ignore_conflicts=True)
+    for tweet in tweets:
+        if pk_sets[tweet.pk]:
+            m2m_changed.send(sender=through, action='post_add', instance=tweet, reverse=False, model=Hashtag, pk_set=pk_sets[tweet.pk], using=using)
+
+
+def notify_mentions(tweets, usernames):
+    """Queue a notification for each user mentioned in ``tweets`` once they commit. Costs one profile lookup."""
+    names = {name for tweet in tweets for name in usernames[tweet.pk]}
+    if not names:
+        return
+    author_ids = {tweet.author_id for tweet in tweets}
+    profiles = UserProfile.objects.filter(user__username__in=names) | UserProfile.objects.filter(pk__in=author_ids)
+    rows = list(profiles.values_list('pk', 'user__username'))
+    by_name = {username: pk for pk, username in rows}
+    by_pk = {pk: username for pk, username in rows}
+    events = [
+        notifications.event(recipient, 'mention', tweet.author_id, by_pk[tweet.author_id], tweet.pk)
+        for tweet in tweets
+        for recipient in _unique(by_name[name] for name in usernames[tweet.pk] if name in by_name)
+    ]
+    transaction.on_commit(lambda: notifications.notify(events))
+
+
+def process(tweets):
+    """Extract hashtags and mentions from newly created ``tweets``."""
+    tweets = [tweet for tweet in tweets if not tweet.is_deleted]
+    parsed = {tweet.pk: extract(tweet.content) for tweet in tweets}
+    link_hashtags(tweets, {pk: tags for pk, (tags, _) in parsed.items()})
+    notify_mentions(tweets, {pk: usernames for pk, (_, usernames) in parsed.items()})
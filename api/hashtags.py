@@ -0,0 +1,73 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.db.models import Case, Count, F, Q, Sum, Value, When
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from .models import HashtagCount, Tweet
+
+
+def hour_bucket(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def adjust_counts(deltas, batch_size=200):
+    """Apply ``{(hashtag_id, bucket): delta}`` to the hourly rollup.
+
+    Each batch is one ``INSERT ... ON CONFLICT DO NOTHING`` for missing rows and one
+    ``UPDATE`` adding every delta through a ``CASE``, however many hashtags it touches.
+    """
+    deltas = [(key, delta) for key, delta in deltas.items() if delta]
+    for start in range(0, len(deltas), batch_size):
+        batch = deltas[start:start + batch_size]
+        HashtagCount.objects.bulk_create(
+            [HashtagCount(hashtag_id=hashtag_id, bucket=bucket, count=0) for (hashtag_id, bucket), _ in batch],
+            ignore_conflicts=True,
+        )
+        match = Q()
+        whens = []
+        for (hashtag_id, bucket), delta in batch:
+            match |= Q(hashtag_id=hashtag_id, bucket=bucket)
+            whens.append(When(hashtag_id=hashtag_id, bucket=bucket, then=Value(delta)))
+        HashtagCount.objects.filter(match).update(count=F('count') + Case(*whens, default=Value(0)))
+
+
+def tagged_buckets(tweets):
+    """Count live ``(hashtag_id, hour)`` pairs over a queryset of tweets."""
+    through = Tweet.hashtags.through.objects.filter(tweet__in=tweets, tweet__is_deleted=False)
+    rows = through.annotate(bucket=TruncHour('tweet__created_at')).values('hashtag_id', 'bucket').annotate(n=Count('pk'))
+    return Counter({(row['hashtag_id'], row['bucket']): row['n'] for row in rows})
+
+
+def record_attached(tweet, hashtag_ids, sign=1):
+    if tweet.is_deleted:
+        return
+    bucket = hour_bucket(tweet.created_at)
+    adjust_counts({(hashtag_id, bucket): sign for hashtag_id in hashtag_ids})
+
+
+def record_tagged_tweets(hashtag_id, tweets, sign=1):
+    rows = tweets.filter(is_deleted=False).annotate(bucket=TruncHour('created_at')).values('bucket').annotate(n=Count('pk'))
+    adjust_counts({(hashtag_id, row['bucket']): sign * row['n'] for row in rows})
+
+
+def record_detached_tweets(tweets):
+    adjust_counts({key: -n for key, n in tagged_buckets(tweets).items()})
+
+
+def window_start(hours):
+    """The first of the last ``hours`` hourly buckets."""
+    return hour_bucket(timezone.now() - timedelta(hours=hours - 1))
+
+
+def popular(hours, limit):
+    """Top ``limit`` hashtags by tweet count over the last ``hours`` hourly buckets."""
+    rows = HashtagCount.objects.filter(bucket__gte=window_start(hours)).values('hashtag__tag')
+    rows = rows.annotate(total=Sum('count')).filter(total__gt=0).order_by('-total', 'hashtag__tag')[:limit]
+    return [{'hashtag': row['hashtag__tag'], 'count': row['total']} for row in rows]
+
+
+def prune(hours):
+    """Delete the buckets before the last ``hours``, which ``popular`` never reads. Returns how many went."""
+    return HashtagCount.objects.filter(bucket__lt=window_start(hours)).delete()[0]
@@ -0,0 +1,91 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.utils import timezone
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import entities, response_cache
+from .models import Tweet, UserProfile
+
+FEED_VALIDATORS_KEY = 'ingest:feed-validators:{url}'
+
+_session = None
+
+
+def get_session():
+    """Process-wide HTTP session, so keep-alive connections are reused between runs."""
+    global _session
+    if _session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=8,
+            max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=(502, 503, 504), allowed_methods=('GET',)),
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _session = session
+    return _session
+
+
+def fetch_feed(url):
+    """GET ``url`` conditionally. Returns ``(items, validators)``, or ``(None, None)`` when the feed is unchanged.
+
+    The validators are not stored here: pass them to ``save_validators`` once the items
+    are, or a failed ingest would be answered ``304`` until the feed changes.
+    """
+    validators = cache.get(FEED_VALIDATORS_KEY.format(url=url)) or {}
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+
+    response = get_session().get(url, headers=headers, timeout=settings.TWEET_FEED_TIMEOUT)
+    if response.status_code == 304:
+        return None, None
+    response.raise_for_status()
+    return response.json(), {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+    }
+
+
+def save_validators(url, validators):
+    cache.set(FEED_VALIDATORS_KEY.format(url=url), validators, None)
+
+
+def ingest(items):
+    """Upsert feed ``items`` (``userId``, ``id``, ``body``) with a fixed number of queries.
+
+    Returns the ids of tweets that did not exist before; their hashtags and mentions
+    are extracted in the same batch. Items whose user does not exist are skipped.
+    """
+    items = {item['id']: item for item in items}
+    user_ids = {item['userId'] for item in items.values()}
+    profiles = dict(UserProfile.objects.filter(user_id__in=user_ids).values_list('user_id', 'id'))
+    missing = user_ids - set(profiles)
+    if missing:
+        users = User.objects.filter(id__in=missing).values_list('id', flat=True)
+        UserProfile.objects.bulk_create([UserProfile(user_id=user_id) for user_id in users], ignore_conflicts=True)
+        profiles.update(UserProfile.objects.filter(user_id__in=missing).values_list('user_id', 'id'))
+
+    existing = set(Tweet.objects.filter(id__in=list(items)).values_list('id', flat=True))
+    now = timezone.now()
+    tweets = [
+        Tweet(id=tweet_id, content=item['body'], created_at=now, author_id=profiles[item['userId']])
+        for tweet_id, item in items.items() if item['userId'] in profiles
+    ]
+    Tweet.objects.bulk_create(
+        tweets,
+        update_conflicts=True,
+        unique_fields=['id'],
+        update_fields=['content', 'author'],
+    )
+    # The upsert sends no signals, so tweets it rewrote are invalidated here.
+    response_cache.invalidate(*[f'tweet:{tweet.id}' for tweet in tweets if tweet.id in existing])
+    created = [tweet for tweet in tweets if tweet.id not in existing]
+    entities.process(created)
+    return [tweet.id for tweet in created]
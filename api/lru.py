@@ -0,0 +1,71 @@
+import threading
+import time
+from collections import OrderedDict
+
+_missing = object()
+
+
+class LRUCache:
+    """Thread-safe in-process LRU cache. Entries older than ``ttl`` seconds are treated as missing."""
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key, now):
+        entry = self._data.get(key, _missing)
+        if entry is _missing:
+            return _missing
+        value, expires = entry
+        if expires is not None and expires <= now:
+            del self._data[key]
+            return _missing
+        self._data.move_to_end(key)
+        return value
+
+    def _set(self, key, value, now):
+        self._data[key] = (value, None if self.ttl is None else now + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._get(key, time.monotonic())
+        return default if value is _missing else value
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for key in keys:
+                value = self._get(key, now)
+                if value is not _missing:
+                    found[key] = value
+        return found
+
+    def set(self, key, value):
+        with self._lock:
+            self._set(key, value, time.monotonic())
+
+    def set_many(self, mapping):
+        now = time.monotonic()
+        with self._lock:
+            for key, value in mapping.items():
+                self._set(key, value, now)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
+
+    def __len__(self):
+        return len(self._data)
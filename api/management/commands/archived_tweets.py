@@ -0,0 +1,34 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.archive import ArchiveReader, restore
+
+
+class Command(BaseCommand):
+    help = 'Look up archived tweets by id or author, and optionally restore them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['get', 'restore'])
+        target = parser.add_mutually_exclusive_group(required=True)
+        target.add_argument('--id', type=int, dest='tweet_id', help='Archived tweet id.')
+        target.add_argument('--author', type=int, dest='author_id', help='UserProfile id of the author.')
+        parser.add_argument('--archive-dir', default=settings.TWEET_ARCHIVE_DIR)
+
+    def handle(self, *args, **options):
+        with ArchiveReader(options['archive_dir']) as reader:
+            if options['tweet_id'] is not None:
+                record = reader.get(options['tweet_id'])
+                records = [record] if record else []
+            else:
+                records = reader.by_author(options['author_id'])
+        if not records:
+            raise CommandError('No archived tweets found.')
+
+        if options['action'] == 'get':
+            for record in records:
+                self.stdout.write(json.dumps(record, ensure_ascii=False))
+            return
+        restored = restore(records)
+        self.stdout.write(self.style.SUCCESS(f'Restored {len(restored)} of {len(records)} archived tweets.'))
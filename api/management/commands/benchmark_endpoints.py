@@ -0,0 +1,203 @@
+import json
+import logging
+import platform
+import random
+import statistics
+import time
+from pathlib import Path
+
+from celery import current_app
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max, Min
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from api.models import Follow, Like, Notification, Tweet, UserProfile
+from api.serializers import ClaimsTokenObtainPairSerializer
+
+SCENARIOS = ('feed', 'notifications', 'popular_hashtags', 'like', 'follow', 'delete_cascade')
+
+
+class Rollback(Exception):
+    pass
+
+
+def _sample(queryset, size, rng, attempts=20):
+    """Up to ``size`` distinct rows of ``queryset`` drawn by random primary key, without ``ORDER BY RANDOM()``."""
+    bounds = queryset.aggregate(low=Min('pk'), high=Max('pk'))
+    if bounds['low'] is None:
+        return []
+    found = {}
+    for _ in range(attempts):
+        if len(found) >= size:
+            break
+        ids = {rng.randint(bounds['low'], bounds['high']) for _ in range(size * 4)}
+        found.update((row.pk, row) for row in queryset.filter(pk__in=ids - found.keys()))
+    return list(found.values())[:size]
+
+
+def _percentile(samples, percent):
+    if len(samples) == 1:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method='inclusive')[percent - 1]
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive the feed, notifications, popular_hashtags, like, follow and delete-cascade paths '
+        'in-process and report p50/p95/p99 latency, queries per request and throughput. Everything runs '
+        'in one transaction that is rolled back: tasks queued directly run eagerly and count towards the '
+        'request, work deferred to commit (timeline fan-out) is not measured.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Timed requests per scenario.')
+        parser.add_argument('--warmup', type=int, default=10, help='Untimed requests per scenario first.')
+        parser.add_argument('--actors', type=int, default=100, help='Users sampled to issue requests.')
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='Comma-separated subset of: ' + ', '.join(SCENARIOS))
+        parser.add_argument('--no-response-cache', action='store_true', help='Disable the HTTP response cache.')
+        parser.add_argument('--output', help='Write the results to this JSON file.')
+        parser.add_argument('--compare', help='A JSON file from an earlier run to print deltas against.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        scenarios = [name.strip() for name in options['scenarios'].split(',') if name.strip()]
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f'Unknown scenarios: {", ".join(sorted(unknown))}.')
+        self.rng = random.Random(options['seed'])
+        self.options = options
+
+        overrides = {'ALLOWED_HOSTS': ['testserver']}
+        if options['no_response_cache']:
+            overrides['RESPONSE_CACHE_TIMEOUT'] = 0
+        # Celery reads its options from settings under the CELERY_ namespace.
+        eager = current_app.conf.task_always_eager
+        current_app.conf['CELERY_TASK_ALWAYS_EAGER'] = True
+        # Expected client errors are counted, not logged.
+        request_logger = logging.getLogger('django.request')
+        level = request_logger.level
+        request_logger.setLevel(logging.ERROR)
+        try:
+            with override_settings(**overrides), transaction.atomic():
+                report = self._run(scenarios)
+                raise Rollback
+        except Rollback:
+            pass
+        finally:
+            current_app.conf['CELERY_TASK_ALWAYS_EAGER'] = eager
+            request_logger.setLevel(level)
+
+        if options['compare']:
+            self._compare(report, json.loads(Path(options['compare']).read_text()))
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(report, indent=2))
+            self.stdout.write(f'Results written to {options["output"]}.')
+
+    def _run(self, scenarios):
+        actors = _sample(UserProfile.objects.select_related('user'), self.options['actors'], self.rng)
+        if len(actors) < 2:
+            raise CommandError('Not enough users; load data with generate_social_graph first.')
+        self.clients = []
+        for profile in actors:
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=f'Bearer {ClaimsTokenObtainPairSerializer.get_token(profile.user).access_token}')
+            self.clients.append((profile, client))
+
+        report = {
+            'generated_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'rows': {
+                'users': UserProfile.objects.count(),
+                'tweets': Tweet.objects.count(),
+                'follows': Follow.objects.count(),
+                'likes': Like.objects.count(),
+                'notifications': Notification.objects.count(),
+            },
+            'options': {name: self.options[name] for name in ('requests', 'warmup', 'actors', 'no_response_cache', 'seed')},
+            'scenarios': {},
+        }
+        self.stdout.write(', '.join(f'{count:,} {name}' for name, count in report['rows'].items()))
+        self.stdout.write(f'{"scenario":<18} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"queries":>8} {"req/s":>9} {"errors":>7}')
+        for name in scenarios:
+            requests = getattr(self, f'_{name}')(self.options['warmup'] + self.options['requests'])
+            if len(requests) <= self.options['warmup']:
+                self.stdout.write(f'{name:<18} skipped: not enough data')
+                continue
+            result = self._measure(requests[self.options['warmup']:], requests[:self.options['warmup']])
+            report['scenarios'][name] = result
+            self.stdout.write(
+                f'{name:<18} {result["p50_ms"]:>9.2f} {result["p95_ms"]:>9.2f} {result["p99_ms"]:>9.2f} '
+                f'{result["queries_per_request"]:>8.1f} {result["throughput_rps"]:>9.1f} {result["errors"]:>7}'
+            )
+        return report
+
+    def _measure(self, requests, warmup):
+        for client, method, path, data in warmup:
+            client.generic(method, path, data=json.dumps(data) if data else '', content_type='application/json')
+        latencies, queries, errors = [], [], 0
+        started = time.perf_counter()
+        for client, method, path, data in requests:
+            with CaptureQueriesContext(connection) as captured:
+                begin = time.perf_counter()
+                response = client.generic(method, path, data=json.dumps(data) if data else '', content_type='application/json')
+                latencies.append((time.perf_counter() - begin) * 1000)
+            queries.append(len(captured))
+            errors += response.status_code >= 400
+        elapsed = time.perf_counter() - started
+        return {
+            'requests': len(latencies),
+            'p50_ms': round(_percentile(latencies, 50), 3),
+            'p95_ms': round(_percentile(latencies, 95), 3),
+            'p99_ms': round(_percentile(latencies, 99), 3),
+            'mean_ms': round(statistics.fmean(latencies), 3),
+            'queries_per_request': round(statistics.fmean(queries), 2),
+            'max_queries': max(queries),
+            'throughput_rps': round(len(latencies) / elapsed, 1),
+            'errors': errors,
+        }
+
+    def _actor(self):
+        return self.rng.choice(self.clients)
+
+    def _feed(self, count):
+        return [(self._actor()[1], 'GET', '/feed/', None) for _ in range(count)]
+
+    def _notifications(self, count):
+        return [(self._actor()[1], 'GET', '/notifications/', None) for _ in range(count)]
+
+    def _popular_hashtags(self, count):
+        return [(self._actor()[1], 'GET', '/tweets/popular_hashtags/', None) for _ in range(count)]
+
+    def _like(self, count):
+        tweets = _sample(Tweet.objects.filter(is_deleted=False).only('pk'), count, self.rng)
+        return [(self._actor()[1], 'POST', f'/like/{tweet.pk}/', None) for tweet in tweets]
+
+    def _follow(self, count):
+        targets = _sample(UserProfile.objects.select_related('user'), count, self.rng)
+        return [(self._actor()[1], 'POST', f'/follow/{target.user.username}/', None) for target in targets]
+
+    def _delete_cascade(self, count):
+        # Threads with replies exercise the recursive subtree update and the deletion signals.
+        tweets = _sample(Tweet.objects.filter(is_deleted=False, reply_count__gt=0).only('pk', 'author_id'), count, self.rng)
+        by_author = {profile.pk: client for profile, client in self.clients}
+        requests = []
+        for tweet in tweets:
+            client = by_author.get(tweet.author_id) or self._actor()[1]
+            requests.append((client, 'DELETE', f'/tweets/{tweet.pk}/', {'delete_reason': 'benchmark'}))
+        return requests
+
+    def _compare(self, report, baseline):
+        self.stdout.write(f'Against {baseline.get("generated_at", "baseline")}:')
+        for name, result in report['scenarios'].items():
+            before = baseline.get('scenarios', {}).get(name)
+            if not before:
+                continue
+            changes = [
+                f'{metric} {before[metric]:.2f} -> {result[metric]:.2f} ({(result[metric] - before[metric]) / before[metric] * 100 if before[metric] else 0:+.0f}%)'
+                for metric in ('p50_ms', 'p95_ms', 'queries_per_request', 'throughput_rps')
+            ]
+            self.stdout.write(f'{name:<18} ' + ', '.join(changes))
@@ -0,0 +1,88 @@
+import itertools
+import random
+import statistics
+import string
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api import search
+from api.models import Tweet, UserProfile
+
+BENCH_USERNAME = 'search-bench'
+
+
+def _vocabulary(size, rng):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 10))))
+    return sorted(words, key=lambda word: rng.random())
+
+
+def _timings(run, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+class Command(BaseCommand):
+    help = 'Load a synthetic corpus and time full-text search against a content__icontains scan.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tweets', type=int, default=1_000_000, help='Corpus size to reach before timing.')
+        parser.add_argument('--vocabulary', type=int, default=50_000, help='Distinct words, drawn with a Zipf distribution.')
+        parser.add_argument('--repeat', type=int, default=50, help='Timed runs per indexed query.')
+        parser.add_argument('--scan-repeat', type=int, default=3, help='Timed runs per icontains query.')
+        parser.add_argument('--batch-size', type=int, default=10_000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--cleanup', action='store_true', help='Delete the synthetic corpus afterwards.')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        vocabulary = _vocabulary(options['vocabulary'], rng)
+        cum_weights = list(itertools.accumulate(1 / rank for rank in range(1, len(vocabulary) + 1)))
+
+        user, _ = User.objects.get_or_create(username=BENCH_USERNAME)
+        profile, _ = UserProfile.objects.get_or_create(user=user)
+        missing = options['tweets'] - Tweet.objects.filter(author=profile).count()
+        loaded = time.perf_counter()
+        while missing > 0:
+            batch = min(missing, options['batch_size'])
+            with transaction.atomic():
+                Tweet.objects.bulk_create([
+                    Tweet(author=profile, content=' '.join(rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(6, 24))))
+                    for _ in range(batch)
+                ])
+            missing -= batch
+        if options['tweets'] > 0:
+            self.stdout.write(f'Corpus ready in {time.perf_counter() - loaded:.1f}s.')
+
+        backend = search.get_backend()
+        size = len(vocabulary)
+        queries = {
+            'common term': vocabulary[size // 10000],
+            'mid term': vocabulary[size // 100],
+            'rare term': vocabulary[size // 2],
+            'two terms': f'{vocabulary[size // 2500]} {vocabulary[size // 250]}',
+            'prefix': vocabulary[size // 1000][:3] + '*',
+        }
+        self.stdout.write(f'{"query":<12} {"engine":<10} {"p50 ms":>9} {"p95 ms":>9} {"mean ms":>9}')
+        for label, query in queries.items():
+            rows = [
+                ('index', _timings(lambda: backend.search(query, 20), options['repeat'])),
+                ('icontains', _timings(lambda: list(
+                    Tweet.objects.filter(is_deleted=False, content__icontains=query.split()[0].rstrip('*')).order_by('-created_at')[:20]
+                ), options['scan_repeat'])),
+            ]
+            for engine, samples in rows:
+                p95 = statistics.quantiles(samples, n=20)[-1] if len(samples) > 1 else samples[0]
+                self.stdout.write(f'{label:<12} {engine:<10} {statistics.median(samples):>9.2f} {p95:>9.2f} {statistics.fmean(samples):>9.2f}')
+
+        if options['cleanup']:
+            Tweet.objects.filter(author=profile).delete()
+            user.delete()
@@ -0,0 +1,79 @@
+import statistics
+import time
+
+import orjson
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from api.models import Hashtag, Tweet, UserProfile
+from api.renderers import ORJSONRenderer
+from api.serializers import TweetSerializer, tweet_reader
+
+BENCH_USERNAME = 'serializer-bench'
+
+
+class Rollback(Exception):
+    pass
+
+
+def _timings(run, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+class Command(BaseCommand):
+    help = 'Time serializing and rendering one page of tweets with DRF against the compiled read path.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tweets', type=int, default=500, help='Tweets on the page.')
+        parser.add_argument('--hashtags', type=int, default=3, help='Hashtags per tweet.')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per variant.')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def _run(self, options):
+        # Everything is created inside a transaction that is rolled back afterwards.
+        profile = UserProfile.objects.create(user=User.objects.create(username=BENCH_USERNAME), bio='')
+        tags = Hashtag.objects.bulk_create([Hashtag(tag=f'bench{index}') for index in range(max(options['hashtags'], 1) * 4)])
+        tweets = Tweet.objects.bulk_create([
+            Tweet(author=profile, content=f'Benchmark tweet number {index} with a little more text to render.')
+            for index in range(options['tweets'])
+        ])
+        Tweet.hashtags.through.objects.bulk_create([
+            Tweet.hashtags.through(tweet_id=tweet.pk, hashtag_id=tags[(index + offset) % len(tags)].pk)
+            for index, tweet in enumerate(tweets) for offset in range(options['hashtags'])
+        ])
+        page = Tweet.objects.filter(author=profile).order_by('-pk')
+        prefetched = list(page.prefetch_related('hashtags'))
+
+        drf, fast = JSONRenderer(), ORJSONRenderer()
+        variants = [
+            ('end to end', 'drf', lambda: drf.render(TweetSerializer(list(page), many=True).data)),
+            ('end to end', 'compiled', lambda: fast.render(tweet_reader(page))),
+            ('serialize', 'drf', lambda: drf.render(TweetSerializer(prefetched, many=True).data)),
+            ('serialize', 'compiled', lambda: fast.render(tweet_reader(prefetched))),
+        ]
+        outputs = {orjson.loads(run()) == orjson.loads(variants[0][2]()) for _, _, run in variants}
+        if outputs != {True}:
+            raise CommandError('The compiled read path does not match TweetSerializer.')
+
+        self.stdout.write(f'{options["tweets"]} tweets, {options["hashtags"]} hashtags each, {options["repeat"]} runs')
+        self.stdout.write(f'{"stage":<12} {"path":<10} {"p50 ms":>9} {"mean ms":>9} {"speedup":>8}')
+        baseline = {}
+        for stage, path, run in variants:
+            samples = _timings(run, options['repeat'])
+            median = statistics.median(samples)
+            baseline.setdefault(stage, median)
+            self.stdout.write(f'{stage:<12} {path:<10} {median:>9.2f} {statistics.fmean(samples):>9.2f} {baseline[stage] / median:>7.1f}x')
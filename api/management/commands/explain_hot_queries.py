@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import query_plans
+
+
+class Command(BaseCommand):
+    help = (
+        'Run the hot query paths against the current data in a rolled-back transaction, EXPLAIN every '
+        'SELECT they issue and fail if any of them reads a whole table. Load data with '
+        'generate_social_graph first; -v 2 prints every plan.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', help='Subset of: ' + ', '.join(query_plans.HOT_PATHS))
+
+    def handle(self, *args, **options):
+        unknown = set(options['paths']) - set(query_plans.HOT_PATHS)
+        if unknown:
+            raise CommandError(f'Unknown paths: {", ".join(sorted(unknown))}.')
+        try:
+            report = query_plans.check(options['paths'])
+        except ValueError as error:
+            raise CommandError(str(error))
+
+        offenders = []
+        for name, statements in report.items():
+            scans = sum(len(found) for _, _, found in statements)
+            self.stdout.write(f'{name}: {len(statements)} queries, {scans} full scans')
+            for sql, plan, found in statements:
+                if options['verbosity'] >= 2 or found:
+                    self.stdout.write(f'  {sql}')
+                    for line in plan:
+                        self.stdout.write(f'    {line}{"  <- full scan" if line in found else ""}')
+                if found:
+                    offenders.append(name)
+        if offenders:
+            raise CommandError(f'Full table scans in: {", ".join(sorted(set(offenders)))}.')
+        self.stdout.write(self.style.SUCCESS('Every hot query is served from an index.'))
@@ -0,0 +1,248 @@
+import itertools
+import random
+import string
+import time
+from collections import Counter, deque
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from api import entities, hashtags, notifications, response_cache
+from api.models import Follow, HashtagCount, Like, Notification, Retweet, TimelineState, Tweet, UserProfile, thread_place
+
+
+def _zipf_weights(size, exponent):
+    return list(itertools.accumulate(1 / rank ** exponent for rank in range(1, size + 1)))
+
+
+def _heavy_tail(rng, mean, cap):
+    """A Pareto(1.5) draw scaled to ``mean``: most values are small, a few are huge."""
+    return min(cap, int((rng.paretovariate(1.5) - 1) * mean / 2))
+
+
+def _words(size, rng):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))))
+    return sorted(words)
+
+
+def _insert(model, fields, rows):
+    """``executemany`` one ``INSERT`` for ``rows``, skipping the per-instance work of ``bulk_create``.
+
+    Rows are tuples in ``fields`` order with values already adapted for the database,
+    and no signals are sent.
+    """
+    if not rows:
+        return
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(model._meta.get_field(name).column) for name in fields)
+    sql = f'INSERT INTO {quote(model._meta.db_table)} ({columns}) VALUES ({", ".join(["%s"] * len(fields))})'
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def _add_replies(replies):
+    quote = connection.ops.quote_name
+    sql = f'UPDATE {quote(Tweet._meta.db_table)} SET {quote("reply_count")} = {quote("reply_count")} + %s WHERE {quote("id")} = %s'
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [(n, pk) for pk, n in sorted(replies.items())])
+
+
+def _add_hashtag_counts(buckets):
+    """Raw-SQL twin of ``hashtags.adjust_counts``, for batches with thousands of hourly buckets."""
+    quote = connection.ops.quote_name
+    table, count = quote(HashtagCount._meta.db_table), quote('count')
+    key = f'{quote("hashtag_id")}, {quote("bucket")}'
+    rows = [(hashtag_id, connection.ops.adapt_datetimefield_value(bucket), n) for (hashtag_id, bucket), n in sorted(buckets.items())]
+    with connection.cursor() as cursor:
+        cursor.executemany(f'INSERT INTO {table} ({key}, {count}) VALUES (%s, %s, 0) ON CONFLICT DO NOTHING', [row[:2] for row in rows])
+        cursor.executemany(
+            f'UPDATE {table} SET {count} = {count} + %s WHERE {quote("hashtag_id")} = %s AND {quote("bucket")} = %s',
+            [(n, hashtag_id, bucket) for hashtag_id, bucket, n in rows],
+        )
+
+
+class Command(BaseCommand):
+    help = (
+        'Bulk-load a synthetic social graph: power-law follows, tweets with reply trees and hashtags, '
+        'likes, retweets and their notifications. Engagement counters and hourly hashtag counts are '
+        'written consistently; timelines are built on first read. Run it without concurrent writers.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10_000)
+        parser.add_argument('--tweets', type=int, default=100_000, help='Scales to 10M; memory stays flat per batch.')
+        parser.add_argument('--follows', type=float, default=40, help='Mean accounts followed per user.')
+        parser.add_argument('--exponent', type=float, default=1.1, help='Zipf exponent of user popularity and activity.')
+        parser.add_argument('--hashtags', type=int, default=2_000, help='Distinct hashtags.')
+        parser.add_argument('--replies', type=float, default=0.3, help='Share of tweets that reply to an earlier one.')
+        parser.add_argument('--likes', type=float, default=4, help='Mean likes per tweet.')
+        parser.add_argument('--retweets', type=float, default=0.5, help='Mean retweets per tweet.')
+        parser.add_argument('--days', type=int, default=30, help='Tweets are spread over this many days up to now.')
+        parser.add_argument('--batch-size', type=int, default=10_000)
+        parser.add_argument('--prefix', default='synthetic', help='Username prefix; must not be in use yet.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options['users'] < 2:
+            raise CommandError('At least two users are needed.')
+        if User.objects.filter(username__startswith=options['prefix']).exists():
+            raise CommandError(f'Users named {options["prefix"]}* already exist; pick another --prefix.')
+        self.rng = random.Random(options['seed'])
+        self.options = options
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+        started = time.perf_counter()
+
+        self._users()
+        self._follows()
+        self._tweets()
+        # Ids were assigned here, so sequences (PostgreSQL) must catch up before the app inserts again.
+        statements = connection.ops.sequence_reset_sql(no_style(), [Tweet, Follow, Like, Retweet, Notification])
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+        response_cache.invalidate('hashtags')
+        self.stdout.write(self.style.SUCCESS(f'Generated in {time.perf_counter() - started:.1f}s.'))
+
+    def _report(self, label, count, since):
+        elapsed = time.perf_counter() - since
+        self.stdout.write(f'{label:<14} {count:>12,} rows  {elapsed:>8.1f}s  {count / max(elapsed, 1e-9):>12,.0f} rows/s')
+
+    def _moment(self, value):
+        return connection.ops.adapt_datetimefield_value(value)
+
+    def _users(self):
+        started = time.perf_counter()
+        prefix, password = self.options['prefix'], make_password(None)
+        self.profile_ids, self.usernames = [], []
+        for start in range(0, self.options['users'], self.batch_size):
+            with transaction.atomic():
+                users = User.objects.bulk_create([
+                    User(username=f'{prefix}{index}', password=password)
+                    for index in range(start, min(start + self.batch_size, self.options['users']))
+                ])
+                profiles = UserProfile.objects.bulk_create([UserProfile(user_id=user.pk, bio='') for user in users])
+            self.profile_ids.extend(profile.pk for profile in profiles)
+            self.usernames.extend(user.username for user in users)
+        # Index 0 is the most followed and the most active account.
+        self.popularity = _zipf_weights(len(self.profile_ids), self.options['exponent'])
+        self._report('users', len(self.profile_ids), started)
+
+    def _pick_users(self, k):
+        return set(self.rng.choices(range(len(self.profile_ids)), cum_weights=self.popularity, k=k)) if k else set()
+
+    def _follows(self):
+        started = time.perf_counter()
+        rng, ids, names = self.rng, self.profile_ids, self.usernames
+        since = self.now - timedelta(days=self.options['days'] * 2)
+        span = (self.now - since).total_seconds()
+        followers, total = Counter(), 0
+        rows, messages = [], []
+        for follower in range(len(ids)):
+            degree = max(1, _heavy_tail(rng, self.options['follows'], len(ids) - 1))
+            for followed in self._pick_users(degree) - {follower}:
+                moment = self._moment(since + timedelta(seconds=rng.random() * span))
+                rows.append((ids[follower], ids[followed], moment))
+                messages.append((ids[followed], ids[follower], 'follow', None, 1, notifications.message('follow', names[follower], 1), True, moment))
+                followers[followed] += 1
+            if len(rows) >= self.batch_size or follower == len(ids) - 1:
+                with transaction.atomic():
+                    _insert(Follow, ('follower', 'followed', 'created_at'), rows)
+                    self._notify(messages)
+                total += len(rows)
+                rows, messages = [], []
+
+        # Mirror timelines.fan_out: accounts past the threshold are merged in on read.
+        celebrities = [ids[index] for index, n in followers.items() if n > settings.TIMELINE_FANOUT_THRESHOLD]
+        TimelineState.objects.bulk_create(
+            [TimelineState(profile_id=pk, fanout_on_read=True) for pk in celebrities],
+            update_conflicts=True, unique_fields=['profile'], update_fields=['fanout_on_read'],
+        )
+        self._report('follows', total, started)
+
+    def _notify(self, rows):
+        _insert(Notification, ('recipient', 'sender', 'verb', 'target_id', 'actor_count', 'message', 'read', 'created_at'), rows)
+
+    def _engagement(self, tweet_id, author, created_at, mean, verb):
+        """``(user_id, tweet_id, created_at)`` rows for a tweet's likes or retweets, plus the coalesced notification."""
+        actors = self._pick_users(_heavy_tail(self.rng, mean, len(self.profile_ids))) - {author}
+        if not actors:
+            return [], []
+        moment = self._moment(created_at + timedelta(seconds=self.rng.randint(1, 3600)))
+        last = max(actors)
+        message = (
+            self.profile_ids[author], self.profile_ids[last], verb, tweet_id, len(actors),
+            notifications.message(verb, self.usernames[last], len(actors)), self.rng.random() < 0.8, moment,
+        )
+        return [(self.profile_ids[index], tweet_id, moment) for index in actors], [message]
+
+    def _tweets(self):
+        started = time.perf_counter()
+        rng, options = self.rng, self.options
+        vocabulary = _words(2_000, rng)
+        word_weights = _zipf_weights(len(vocabulary), 1.0)
+        tags = _words(options['hashtags'], rng) if options['hashtags'] else []
+        tag_weights = _zipf_weights(len(tags), 1.0)
+        tag_ids = entities.hashtag_ids(tags)
+        users = range(len(self.profile_ids))
+
+        since = self.now - timedelta(days=options['days'])
+        step = (self.now - since).total_seconds() / max(options['tweets'], 1)
+        next_id = (Tweet.objects.aggregate(top=Max('id'))['top'] or 0) + 1
+        recent = deque(maxlen=50_000)
+        totals = Counter()
+
+        for start in range(0, options['tweets'], self.batch_size):
+            count = min(self.batch_size, options['tweets'] - start)
+            authors = rng.choices(users, cum_weights=self.popularity, k=count)
+            tweets, tagged, likes, retweets, messages, buckets, replies = [], [], [], [], [], Counter(), Counter()
+            for offset, author in enumerate(authors):
+                tweet_id, next_id = next_id, next_id + 1
+                created_at = since + timedelta(seconds=(start + offset + rng.random()) * step)
+                picked = set(rng.choices(tags, cum_weights=tag_weights, k=rng.choices((0, 1, 2, 3), (50, 30, 15, 5))[0])) if tags else set()
+                words = rng.choices(vocabulary, cum_weights=word_weights, k=rng.randint(4, 20))
+                parent = None
+                if recent and rng.random() < options['replies']:
+                    # Replies favour recent tweets, which grows deep threads under popular ones.
+                    parent = recent[-min(len(recent), int(rng.expovariate(1 / 500)) + 1)]
+                    replies[parent[0]] += 1
+                path, depth = thread_place(parent)
+                tweet_likes, liked = self._engagement(tweet_id, author, created_at, options['likes'], 'like')
+                tweet_retweets, retweeted = self._engagement(tweet_id, author, created_at, options['retweets'], 'retweet')
+                tweets.append((
+                    tweet_id, self.profile_ids[author], parent and parent[0], ' '.join(words + [f'#{tag}' for tag in picked]),
+                    self._moment(created_at), False, '', len(tweet_likes), len(tweet_retweets), 0, path, depth,
+                ))
+                tagged.extend((tweet_id, tag_ids[tag]) for tag in picked)
+                buckets.update((tag_ids[tag], hashtags.hour_bucket(created_at)) for tag in picked)
+                likes.extend(tweet_likes)
+                retweets.extend(tweet_retweets)
+                messages.extend(liked + retweeted)
+
+            with transaction.atomic():
+                _insert(Tweet, (
+                    'id', 'author', 'parent_tweet', 'content', 'created_at', 'is_deleted', 'delete_reason',
+                    'like_count', 'retweet_count', 'reply_count', 'path', 'depth',
+                ), tweets)
+                _insert(Tweet.hashtags.through, ('tweet', 'hashtag'), tagged)
+                _insert(Like, ('user', 'tweet', 'created_at'), likes)
+                _insert(Retweet, ('user', 'tweet', 'created_at'), retweets)
+                self._notify(messages)
+                _add_hashtag_counts(buckets)
+                _add_replies(replies)
+
+            recent.extend((row[0], row[-2], row[-1]) for row in tweets)
+            totals.update(tweets=len(tweets), likes=len(likes), retweets=len(retweets), notifications=len(messages))
+            self.stdout.write(f'{start + count:>12,} / {options["tweets"]:,} tweets')
+
+        for label in ('tweets', 'likes', 'retweets', 'notifications'):
+            self._report(label, totals[label], started)
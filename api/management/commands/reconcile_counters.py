@@ -0,0 +1,46 @@
+import operator
+from functools import reduce
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, Max, Min, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from api.models import Like, Retweet, Tweet
+
+
+def _count(queryset, field):
+    counts = queryset.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(n=Count('pk')).values('n')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+class Command(BaseCommand):
+    help = 'Recompute the like, retweet and reply counters stored on tweets.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Number of tweet ids to repair per statement.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        counters = {
+            'like_count': _count(Like.objects.all(), 'tweet'),
+            'retweet_count': _count(Retweet.objects.all(), 'tweet'),
+            'reply_count': _count(Tweet.objects.filter(is_deleted=False), 'parent_tweet'),
+        }
+        bounds = Tweet.objects.aggregate(low=Min('id'), high=Max('id'))
+        if bounds['low'] is None:
+            self.stdout.write('No tweets to reconcile.')
+            return
+
+        repaired = 0
+        for start in range(bounds['low'], bounds['high'] + 1, batch_size):
+            batch = Tweet.objects.filter(id__gte=start, id__lt=start + batch_size)
+            drifted = batch.alias(**{f'actual_{name}': value for name, value in counters.items()}).filter(
+                reduce(operator.or_, [~Q(**{name: F(f'actual_{name}')}) for name in counters])
+            )
+            with transaction.atomic():
+                found = drifted.count()
+                if found:
+                    batch.update(**counters)
+            repaired += found
+        self.stdout.write(self.style.SUCCESS(f'Repaired counters on {repaired} tweets.'))
@@ -0,0 +1,36 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy the SQLite primary into every SQLite replica in DATABASE_REPLICAS, so local files can '
+        'stand in for streaming replicas. Run it again to bring them up to date.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('aliases', nargs='*', help='Replicas to refresh; all SQLite replicas by default.')
+
+    def handle(self, *args, **options):
+        primary = connections[DEFAULT_DB_ALIAS]
+        if primary.vendor != 'sqlite':
+            raise CommandError('The primary is not an SQLite database.')
+        aliases = options['aliases'] or [alias for alias in settings.DATABASE_REPLICAS if connections[alias].vendor == 'sqlite']
+        unknown = set(aliases) - set(settings.DATABASE_REPLICAS)
+        if unknown:
+            raise CommandError(f'Not replicas: {", ".join(sorted(unknown))}.')
+
+        primary.ensure_connection()
+        for alias in aliases:
+            replica = connections[alias]
+            replica.close()
+            target = sqlite3.connect(replica.settings_dict['NAME'])
+            try:
+                primary.connection.backup(target)
+            finally:
+                target.close()
+            self.stdout.write(f'{alias}: copied to {replica.settings_dict["NAME"]}')
+        self.stdout.write(self.style.SUCCESS(f'Refreshed {len(aliases)} replicas.'))
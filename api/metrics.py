@@ -0,0 +1,265 @@
+import contextvars
+import json
+import logging
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.dispatch import Signal
+from django.http import HttpResponse, HttpResponseForbidden
+
+logger = logging.getLogger(__name__)
+
+# Sent with ``metrics`` once a request has been measured; api.testing listens to it.
+request_measured = Signal()
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+_IN_LIST_RE = re.compile(r'\((?:\s*%s\s*,)+\s*%s\s*\)')
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SAVEPOINT_RE = re.compile(r'SAVEPOINT "[^"]*"')
+_SPACE_RE = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """``sql`` with literals and ``IN`` lists folded, so the same query with other values matches."""
+    sql = _SAVEPOINT_RE.sub('SAVEPOINT ?', _LITERAL_RE.sub('?', sql))
+    sql = _IN_LIST_RE.sub('(...)', sql)
+    return _SPACE_RE.sub(' ', sql).strip()
+
+
+class RequestMetrics:
+    __slots__ = ('started', 'queries', 'db_seconds', 'serialize_seconds', 'statements', 'total_seconds', 'view', 'status')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.serialize_seconds = 0.0
+        self.statements = defaultdict(lambda: [0, 0.0])
+        self.total_seconds = None
+        self.view = None
+        self.status = None
+
+    def repeated(self, limit):
+        """The ``limit`` most repeated SQL fingerprints as ``(fingerprint, count, seconds)``."""
+        merged = defaultdict(lambda: [0, 0.0])
+        for sql, (count, seconds) in self.statements.items():
+            entry = merged[fingerprint(sql)]
+            entry[0] += count
+            entry[1] += seconds
+        ranked = sorted(merged.items(), key=lambda item: (-item[1][0], -item[1][1]))[:limit]
+        return [(sql, count, seconds) for sql, (count, seconds) in ranked]
+
+    def server_timing(self):
+        return ', '.join([
+            f'db;dur={self.db_seconds * 1000:.1f};desc="{self.queries} queries"',
+            f'serialize;dur={self.serialize_seconds * 1000:.1f}',
+            f'total;dur={self.total_seconds * 1000:.1f}',
+        ])
+
+
+def record_query(execute, sql, params, many, context):
+    """A database ``execute_wrapper`` charging each statement to the request being measured, if any."""
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.queries += 1
+        metrics.db_seconds += elapsed
+        entry = metrics.statements[sql]
+        entry[0] += 1
+        entry[1] += elapsed
+
+
+def instrument(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def serializing():
+    """Charge the enclosed block to the current request's serialization time."""
+    metrics = _current.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if metrics is not None:
+            metrics.serialize_seconds += time.perf_counter() - started
+
+
+class Registry:
+    """Process-local request counters and latency histograms, rendered in Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.requests = Counter()
+        self.buckets = defaultdict(lambda: [0] * len(DURATION_BUCKETS))
+        self.durations = Counter()
+        self.counts = Counter()
+        self.queries = Counter()
+        self.db_seconds = Counter()
+        self.serialize_seconds = Counter()
+        self.slow = Counter()
+
+    def observe(self, method, metrics):
+        view = metrics.view
+        with self._lock:
+            self.requests[(method, view, metrics.status)] += 1
+            buckets = self.buckets[view]
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if metrics.total_seconds <= bound:
+                    buckets[index] += 1
+            self.durations[view] += metrics.total_seconds
+            self.counts[view] += 1
+            self.queries[view] += metrics.queries
+            self.db_seconds[view] += metrics.db_seconds
+            self.serialize_seconds[view] += metrics.serialize_seconds
+            if metrics.total_seconds * 1000 >= settings.REQUEST_SLOW_MS:
+                self.slow[view] += 1
+
+    def render(self):
+        lines = []
+
+        def family(name, kind, help_text, samples):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                rendered = ','.join(f'{key}="{_escape(label)}"' for key, label in labels)
+                lines.append(f'{name}{{{rendered}}} {value}')
+
+        with self._lock:
+            family('api_requests_total', 'counter', 'Requests served.', [
+                ((('method', method), ('view', view), ('status', status)), count)
+                for (method, view, status), count in sorted(self.requests.items())
+            ])
+            lines.append('# HELP api_request_duration_seconds Request latency.')
+            lines.append('# TYPE api_request_duration_seconds histogram')
+            for view in sorted(self.counts):
+                label = _escape(view)
+                for bound, count in zip(DURATION_BUCKETS, self.buckets[view]):
+                    lines.append(f'api_request_duration_seconds_bucket{{view="{label}",le="{bound}"}} {count}')
+                lines.append(f'api_request_duration_seconds_bucket{{view="{label}",le="+Inf"}} {self.counts[view]}')
+                lines.append(f'api_request_duration_seconds_sum{{view="{label}"}} {self.durations[view]:.6f}')
+                lines.append(f'api_request_duration_seconds_count{{view="{label}"}} {self.counts[view]}')
+            for name, help_text, values in (
+                ('api_db_queries_total', 'SQL statements issued while serving requests.', self.queries),
+                ('api_db_seconds_total', 'Time spent in SQL while serving requests.', self.db_seconds),
+                ('api_serialize_seconds_total', 'Time spent serializing and rendering responses.', self.serialize_seconds),
+                ('api_slow_requests_total', 'Requests slower than REQUEST_SLOW_MS.', self.slow),
+            ):
+                family(name, 'counter', help_text, [((('view', view),), _number(value)) for view, value in sorted(values.items())])
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return f'{value:.6f}' if isinstance(value, float) else str(value)
+
+
+registry = Registry()
+
+
+class RequestMetricsMiddleware:
+    """Measures queries, DB time, serialization time and total time of every request.
+
+    Adds a ``Server-Timing`` header, feeds the ``/metrics`` registry and logs requests
+    slower than ``REQUEST_SLOW_MS`` with their most repeated SQL fingerprints. Keep it
+    first in ``MIDDLEWARE`` so the total covers the rest of the stack.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not settings.REQUEST_METRICS_ENABLED:
+            return self.get_response(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        if not settings.REQUEST_METRICS_ENABLED:
+            return await self.get_response(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, metrics)
+
+    def process_template_response(self, request, response):
+        # DRF responses render after the view returns; time that as serialization.
+        metrics = _current.get()
+        if metrics is not None:
+            started = time.perf_counter()
+
+            def rendered(response):
+                metrics.serialize_seconds += time.perf_counter() - started
+            response.add_post_render_callback(rendered)
+        return response
+
+    def _finish(self, request, response, metrics):
+        metrics.total_seconds = time.perf_counter() - metrics.started
+        match = getattr(request, 'resolver_match', None)
+        metrics.view = match.view_name if match is not None else 'unmatched'
+        metrics.status = response.status_code
+        response['Server-Timing'] = metrics.server_timing()
+        registry.observe(request.method, metrics)
+        if metrics.total_seconds * 1000 >= settings.REQUEST_SLOW_MS:
+            logger.warning('slow_request %s', json.dumps(self.describe(request, metrics)))
+        request_measured.send(sender=type(self), request=request, metrics=metrics)
+        return response
+
+    @staticmethod
+    def describe(request, metrics):
+        return {
+            'method': request.method,
+            'path': request.path,
+            'view': metrics.view,
+            'status': metrics.status,
+            'total_ms': round(metrics.total_seconds * 1000, 2),
+            'db_ms': round(metrics.db_seconds * 1000, 2),
+            'serialize_ms': round(metrics.serialize_seconds * 1000, 2),
+            'queries': metrics.queries,
+            'repeated_sql': [
+                {'sql': sql, 'count': count, 'ms': round(seconds * 1000, 2)}
+                for sql, count, seconds in metrics.repeated(settings.REQUEST_SLOW_TOP_SQL)
+            ],
+        }
+
+
+def metrics_view(request):
+    """Prometheus text exposition of ``registry``, for addresses in ``METRICS_ALLOWED_IPS``."""
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,36 @@
+# Generated by Django 5.0.6 on 2026-10-18 03:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_like_retweet'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineState',
+            fields=[
+                ('profile', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='timeline_state', serialize=False, to='api.userprofile')),
+                ('materialized_at', models.DateTimeField(blank=True, null=True)),
+                ('fanout_on_read', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.userprofile')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='api.userprofile')),
+                ('tweet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='api.tweet')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', '-created_at', '-tweet'], name='timeline_owner_recent_idx'), models.Index(fields=['owner', 'author'], name='timeline_owner_author_idx')],
+                'unique_together': {('owner', 'tweet')},
+            },
+        ),
+    ]
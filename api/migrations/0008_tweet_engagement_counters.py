@@ -0,0 +1,45 @@
+# Generated by Django 5.0.6 on 2026-10-18 03:56
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_counters(apps, schema_editor):
+    Tweet = apps.get_model('api', 'Tweet')
+
+    def count(queryset, field):
+        counts = queryset.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(n=Count('pk')).values('n')
+        return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+    Tweet.objects.update(
+        like_count=count(apps.get_model('api', 'Like').objects.all(), 'tweet'),
+        retweet_count=count(apps.get_model('api', 'Retweet').objects.all(), 'tweet'),
+        reply_count=count(Tweet.objects.filter(is_deleted=False), 'parent_tweet'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_timelines'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tweet',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tweet',
+            name='reply_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tweet',
+            name='retweet_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.0.6 on 2026-10-18 04:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncHour
+
+
+def backfill_counts(apps, schema_editor):
+    Tweet = apps.get_model('api', 'Tweet')
+    HashtagCount = apps.get_model('api', 'HashtagCount')
+    rows = Tweet.hashtags.through.objects.filter(tweet__is_deleted=False)
+    rows = rows.annotate(bucket=TruncHour('tweet__created_at')).values('hashtag_id', 'bucket').annotate(n=Count('pk'))
+    HashtagCount.objects.bulk_create(
+        (HashtagCount(hashtag_id=row['hashtag_id'], bucket=row['bucket'], count=row['n']) for row in rows.iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_tweet_engagement_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HashtagCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('count', models.IntegerField(default=0)),
+                ('hashtag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='counts', to='api.hashtag')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bucket'], name='hashtagcount_bucket_idx')],
+                'unique_together': {('hashtag', 'bucket')},
+            },
+        ),
+        migrations.RunPython(backfill_counts, migrations.RunPython.noop),
+    ]
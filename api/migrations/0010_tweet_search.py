@@ -0,0 +1,65 @@
+from django.db import migrations
+
+# SQLite: an external-content FTS5 index over api_tweet.content kept in sync by
+# triggers, so bulk_create, upserts and queryset.update() reach it too. Only live
+# tweets are indexed.
+SQLITE_INSTALL = [
+    """
+    CREATE VIRTUAL TABLE api_tweet_fts USING fts5(
+        content, content='api_tweet', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER api_tweet_fts_insert AFTER INSERT ON api_tweet WHEN NOT new.is_deleted BEGIN
+        INSERT INTO api_tweet_fts (rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER api_tweet_fts_delete AFTER DELETE ON api_tweet WHEN NOT old.is_deleted BEGIN
+        INSERT INTO api_tweet_fts (api_tweet_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER api_tweet_fts_update AFTER UPDATE OF content, is_deleted ON api_tweet BEGIN
+        INSERT INTO api_tweet_fts (api_tweet_fts, rowid, content) SELECT 'delete', old.id, old.content WHERE NOT old.is_deleted;
+        INSERT INTO api_tweet_fts (rowid, content) SELECT new.id, new.content WHERE NOT new.is_deleted;
+    END
+    """,
+    "INSERT INTO api_tweet_fts (rowid, content) SELECT id, content FROM api_tweet WHERE NOT is_deleted",
+]
+SQLITE_UNINSTALL = [
+    'DROP TRIGGER IF EXISTS api_tweet_fts_insert',
+    'DROP TRIGGER IF EXISTS api_tweet_fts_delete',
+    'DROP TRIGGER IF EXISTS api_tweet_fts_update',
+    'DROP TABLE IF EXISTS api_tweet_fts',
+]
+
+# PostgreSQL: a partial GIN expression index; PostgresSearchBackend filters on the
+# same expression, so there is nothing to keep in sync.
+POSTGRESQL_INSTALL = [
+    "CREATE INDEX api_tweet_search_idx ON api_tweet USING GIN (to_tsvector('english', content)) WHERE NOT is_deleted",
+]
+POSTGRESQL_UNINSTALL = [
+    'DROP INDEX IF EXISTS api_tweet_search_idx',
+]
+
+
+def _run(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_hashtag_counts'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run({'sqlite': SQLITE_INSTALL, 'postgresql': POSTGRESQL_INSTALL}),
+            _run({'sqlite': SQLITE_UNINSTALL, 'postgresql': POSTGRESQL_UNINSTALL}),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.0.6 on 2026-10-18 05:15
+
+from django.db import migrations, models
+
+# auth_user belongs to django.contrib.auth, so its last_login index for the active-users
+# seed query is created here: partial and covering where the backend allows it.
+LAST_LOGIN_INSTALL = {
+    'sqlite': ['CREATE INDEX auth_user_last_login_idx ON auth_user (last_login DESC, username) WHERE last_login IS NOT NULL'],
+    'postgresql': ['CREATE INDEX auth_user_last_login_idx ON auth_user (last_login DESC) INCLUDE (username) WHERE last_login IS NOT NULL'],
+    'mysql': ['CREATE INDEX auth_user_last_login_idx ON auth_user (last_login DESC, username)'],
+}
+LAST_LOGIN_UNINSTALL = {
+    'sqlite': ['DROP INDEX IF EXISTS auth_user_last_login_idx'],
+    'postgresql': ['DROP INDEX IF EXISTS auth_user_last_login_idx'],
+    'mysql': ['DROP INDEX auth_user_last_login_idx ON auth_user'],
+}
+
+
+def _run(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_notification_coalescing'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['recipient', '-created_at', '-id'], name='notification_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tweet',
+            index=models.Index(fields=['author', 'is_deleted', '-created_at', '-id'], name='tweet_author_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tweet',
+            index=models.Index(fields=['parent_tweet', 'created_at', 'id'], name='tweet_thread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tweet',
+            index=models.Index(condition=models.Q(('is_deleted', True)), fields=['created_at', 'delete_reason'], name='tweet_deleted_idx'),
+        ),
+        migrations.RunPython(_run(LAST_LOGIN_INSTALL), _run(LAST_LOGIN_UNINSTALL)),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.0.6 on 2026-10-18 09:40
+
+from django.db import migrations, models
+
+STEP = 12
+
+
+def backfill(apps, schema_editor):
+    """Place existing tweets level by level, starting from the top-level ones."""
+    Tweet = apps.get_model('api', 'Tweet')
+    Tweet.objects.filter(parent_tweet__isnull=True).update(path='', depth=0)
+    while True:
+        rows = list(
+            Tweet.objects.filter(depth__isnull=True, parent_tweet__depth__isnull=False)
+            .values_list('pk', 'parent_tweet_id', 'parent_tweet__path', 'parent_tweet__depth')[:5000]
+        )
+        if not rows:
+            break
+        Tweet.objects.bulk_update(
+            [Tweet(pk=pk, path=f'{path}{parent:0{STEP}d}', depth=depth + 1) for pk, parent, path, depth in rows],
+            ['path', 'depth'], batch_size=500,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_deletion_counts'),
+    ]
+
+    operations = [
+        # The columns are added without a database default: SQLite can then append them
+        # in place instead of rebuilding api_tweet, which would drop the search triggers.
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.AddField(model_name='tweet', name='depth', field=models.PositiveIntegerField(null=True)),
+                migrations.AddField(model_name='tweet', name='path', field=models.TextField(null=True)),
+            ],
+            state_operations=[
+                migrations.AddField(
+                    model_name='tweet', name='depth', field=models.PositiveIntegerField(default=0, editable=False, null=True),
+                ),
+                migrations.AddField(
+                    model_name='tweet', name='path', field=models.TextField(blank=True, default='', editable=False, null=True),
+                ),
+            ],
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='tweet',
+            index=models.Index(fields=['path', 'id'], name='tweet_path_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.0.6 on 2026-10-18 11:20
+
+from django.db import migrations, models
+
+
+def backfill(apps, schema_editor):
+    """Record the latest actor of unread notifications; earlier ones were never stored."""
+    Notification = apps.get_model('api', 'Notification')
+    Actor = Notification.actors.through
+    rows = Notification.objects.filter(read=False, sender__isnull=False).values_list('pk', 'sender_id')
+    for start in range(0, rows.count(), 5000):
+        Actor.objects.bulk_create(
+            [Actor(notification_id=pk, userprofile_id=sender_id) for pk, sender_id in rows.order_by('pk')[start:start + 5000]],
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_tweet_thread_paths'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='actors',
+            field=models.ManyToManyField(blank=True, related_name='+', to='api.userprofile'),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.0.6 on 2026-10-18 11:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_notification_actors'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tweet',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='tweet',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', False)), fields=['deleted_at'], name='tweet_deleted_at_idx'),
+        ),
+    ]
@@ -1,5 +1,48 @@
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import F, Q
+from django.db.models.expressions import RawSQL
 from django.contrib.auth.models import User
+from django.utils import timezone
+from django.dispatch import Signal
+
+# Sent with ``tweet_ids`` (a flat ``values_list`` of pks) right before and right after
+# tweets are soft deleted. Some of them may already have been deleted before.
+tweets_deleting = Signal()
+tweets_deleted = Signal()
+# Sent with ``tweet_ids`` (a list) right before tweets are removed in bulk, without
+# per-row ``post_delete``, as the archiver does.
+tweets_removing = Signal()
+# Sent with ``tweet_ids`` (a flat ``values_list`` of pks) right before ``Tweet.delete``
+# removes a tweet and its replies. Their rows still get ``post_delete``.
+tweets_destroying = Signal()
+
+
+def reply_subtree(root_ids):
+    """Ids of every reply below ``root_ids``, as a recursive CTE usable with ``pk__in``."""
+    qn = connection.ops.quote_name
+    table, pk = qn(Tweet._meta.db_table), qn(Tweet._meta.pk.column)
+    parent = qn(Tweet._meta.get_field('parent_tweet').column)
+    placeholders = ', '.join(['%s'] * len(root_ids))
+    sql = (
+        f'WITH RECURSIVE subtree(id) AS ('
+        f'SELECT {pk} FROM {table} WHERE {parent} IN ({placeholders}) '
+        f'UNION SELECT t.{pk} FROM {table} t INNER JOIN subtree s ON t.{parent} = s.id'
+        f') SELECT id FROM subtree'
+    )
+    return RawSQL(sql, list(root_ids))
+
+
+# Width of one ancestor id in ``Tweet.path``; zero padding makes paths sort like id tuples.
+THREAD_PATH_STEP = 12
+
+
+def thread_place(parent):
+    """``(path, depth)`` of a reply to ``parent``, a ``(pk, path, depth)`` tuple, or of a top-level tweet."""
+    if parent is None:
+        return '', 0
+    pk, path, depth = parent
+    return f'{path}{pk:0{THREAD_PATH_STEP}d}', depth + 1
+
 
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -13,24 +56,91 @@ class Hashtag(models.Model):
     tag = models.CharField(max_length=100, unique=True)
 
 
+class HashtagCount(models.Model):
+    hashtag = models.ForeignKey(Hashtag, related_name='counts', on_delete=models.CASCADE)
+    bucket = models.DateTimeField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('hashtag', 'bucket')
+        indexes = [models.Index(fields=['bucket'], name='hashtagcount_bucket_idx')]
+
+
+class DeletionCount(models.Model):
+    """Deleted tweets per UTC day of ``Tweet.created_at`` and ``delete_reason``."""
+    day = models.DateField()
+    delete_reason = models.CharField(max_length=255, blank=True)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('day', 'delete_reason')
+
+
 class Tweet(models.Model):
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     author = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
     is_deleted = models.BooleanField(default=False)
     delete_reason = models.CharField(max_length=255, blank=True)
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)
     hashtags = models.ManyToManyField(Hashtag, related_name='tweets')
     parent_tweet = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='replies')
+    like_count = models.PositiveIntegerField(default=0)
+    retweet_count = models.PositiveIntegerField(default=0)
+    reply_count = models.PositiveIntegerField(default=0)
+    # Where the tweet sits in its conversation, fixed when it is created: ``path`` is the
+    # ids of its ancestors from the root down, so every subtree is one range of paths.
+    depth = models.PositiveIntegerField(default=0, null=True, editable=False)
+    path = models.TextField(default='', null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Feed rebuilds and on-read pulls: live tweets of some authors, newest first.
+            models.Index(fields=['author', 'is_deleted', '-created_at', '-id'], name='tweet_author_recent_idx'),
+            # Replies of a tweet in thread order.
+            models.Index(fields=['parent_tweet', 'created_at', 'id'], name='tweet_thread_idx'),
+            # Deletion statistics; deleted tweets are few, so the index stays small where partial indexes exist.
+            models.Index(fields=['created_at', 'delete_reason'], condition=Q(is_deleted=True), name='tweet_deleted_idx'),
+            # Reply trees: a subtree is a range of paths.
+            models.Index(fields=['path', 'id'], name='tweet_path_idx'),
+            # Reconciling the deletion rollup for recent deletions, whatever the tweets' age.
+            models.Index(fields=['deleted_at'], condition=Q(deleted_at__isnull=False), name='tweet_deleted_at_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.parent_tweet_id and not self.depth:
+            parent = self.parent_tweet
+            self.path, self.depth = thread_place((parent.pk, parent.path, parent.depth))
+        return super().save(*args, **kwargs)
+
+    def subtree_paths(self):
+        """Bounds of the ``path`` of every reply below this tweet."""
+        prefix = thread_place((self.pk, self.path, self.depth))[0]
+        return prefix, prefix + '9' * THREAD_PATH_STEP
+
     def delete(self, *args, **kwargs):
-        for reply in self.replies.all():
-            reply.delete()
-        super().delete(*args, **kwargs)
+        subtree = Tweet.objects.filter(Q(pk=self.pk) | Q(pk__in=reply_subtree([self.pk])))
+        with transaction.atomic():
+            if not self.is_deleted and self.parent_tweet_id:
+                Tweet.objects.filter(pk=self.parent_tweet_id, reply_count__gt=0).update(reply_count=F('reply_count') - 1)
+            tweets_destroying.send(sender=Tweet, tweet_ids=subtree.values_list('pk', flat=True))
+            Tweet.objects.filter(pk__in=reply_subtree([self.pk])).delete()
+            return super().delete(*args, **kwargs)
     def mark_as_deleted(self, delete_reason='No reason provided'):
-        self.is_deleted = True
-        self.delete_reason = delete_reason if delete_reason else 'No reason provided'
-        self.save()
-        for reply in self.replies.all():
-            reply.mark_as_deleted(delete_reason='Parent tweet deleted')
+        delete_reason = delete_reason if delete_reason else 'No reason provided'
+        subtree = Tweet.objects.filter(Q(pk=self.pk) | Q(pk__in=reply_subtree([self.pk])))
+        with transaction.atomic():
+            if not self.is_deleted and self.parent_tweet_id:
+                Tweet.objects.filter(pk=self.parent_tweet_id, reply_count__gt=0).update(reply_count=F('reply_count') - 1)
+            tweets_deleting.send(sender=Tweet, tweet_ids=subtree.values_list('pk', flat=True))
+            self.is_deleted = True
+            self.delete_reason = delete_reason
+            self.deleted_at = timezone.now()
+            self.save(update_fields=['is_deleted', 'delete_reason', 'deleted_at'])
+            Tweet.objects.filter(pk__in=reply_subtree([self.pk])).update(
+                is_deleted=True, delete_reason='Parent tweet deleted', deleted_at=self.deleted_at,
+            )
+            tweets_deleted.send(sender=Tweet, tweet_ids=subtree.values_list('pk', flat=True))
     def __str__(self):
         return f"{self.content[:140]}"
 
@@ -41,6 +151,9 @@ class Tweet(models.Model):
         if isinstance(other, Tweet):
             return self.content == other.content and self.author == other.author
         return False
+
+    # Overriding __eq__ drops the inherited hash, which the deletion collector needs.
+    __hash__ = models.Model.__hash__
             
 class Follow(models.Model):
     follower = models.ForeignKey(UserProfile, related_name="following", on_delete=models.CASCADE)
@@ -54,12 +167,31 @@ class Follow(models.Model):
         return f"{self.follower.user.username} follows {self.followed.user.username}"
 
 class Notification(models.Model):
+    VERB_CHOICES = [
+        ('follow', 'Follow'),
+        ('like', 'Like'),
+        ('retweet', 'Retweet'),
+        ('mention', 'Mention'),
+    ]
+
     recipient = models.ForeignKey(UserProfile, related_name='notifications', on_delete=models.CASCADE)
     sender = models.ForeignKey(UserProfile, related_name='sent_notifications', on_delete=models.CASCADE, null=True, blank=True)
+    # Everyone coalesced into the notification, so a repeated actor is counted once.
+    actors = models.ManyToManyField(UserProfile, related_name='+', blank=True)
+    verb = models.CharField(max_length=20, choices=VERB_CHOICES, blank=True, default='')
+    target_id = models.PositiveBigIntegerField(null=True, blank=True)
+    actor_count = models.PositiveIntegerField(default=1)
     message = models.CharField(max_length=255)
     read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['recipient', 'verb', 'target_id', 'created_at'], name='notification_coalesce_idx'),
+            models.Index(fields=['recipient', 'read'], name='notification_unread_idx'),
+            models.Index(fields=['recipient', '-created_at', '-id'], name='notification_recent_idx'),
+        ]
+
     def __str__(self):
         return f"Notification for {self.recipient.user.username}: {self.message}"
 
@@ -77,4 +209,23 @@ class Retweet(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
-        unique_together = ('user', 'tweet') 
\ No newline at end of file
+        unique_together = ('user', 'tweet')
+
+
+class TimelineEntry(models.Model):
+    owner = models.ForeignKey(UserProfile, related_name='timeline_entries', on_delete=models.CASCADE)
+    tweet = models.ForeignKey(Tweet, related_name='timeline_entries', on_delete=models.CASCADE)
+    author = models.ForeignKey(UserProfile, related_name='+', on_delete=models.CASCADE)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('owner', 'tweet')
+        indexes = [
+            models.Index(fields=['owner', '-created_at', '-tweet'], name='timeline_owner_recent_idx'),
+            models.Index(fields=['owner', 'author'], name='timeline_owner_author_idx'),
+        ]
+
+class TimelineState(models.Model):
+    profile = models.OneToOneField(UserProfile, primary_key=True, related_name='timeline_state', on_delete=models.CASCADE)
+    materialized_at = models.DateTimeField(null=True, blank=True)
+    fanout_on_read = models.BooleanField(default=False)
@@ -0,0 +1,164 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, router, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import streams
+from .models import Notification
+
+UNREAD_KEY = 'notifications:unread:{profile_id}'
+
+MESSAGES = {
+    'follow': ('{actor} has started following you.', '{actor} and {others} started following you.'),
+    'like': ('{actor} liked your tweet.', '{actor} and {others} liked your tweet.'),
+    'retweet': ('{actor} retweeted your tweet.', '{actor} and {others} retweeted your tweet.'),
+    'mention': ('{actor} mentioned you in a tweet.', '{actor} and {others} mentioned you in a tweet.'),
+}
+
+
+def event(recipient_id, verb, actor_id, actor_name, target_id=None):
+    return {'recipient': recipient_id, 'verb': verb, 'actor': actor_id, 'actor_name': actor_name, 'target': target_id}
+
+
+def notify(events):
+    """Queue ``events`` for delivery. Events addressed to their own actor are dropped."""
+    from .tasks import deliver_notifications
+
+    events = [event for event in events if event['recipient'] != event['actor']]
+    if events:
+        deliver_notifications.delay(events)
+
+
+def message(verb, actor_name, actor_count):
+    one, many = MESSAGES[verb]
+    if actor_count == 1:
+        return one.format(actor=actor_name)
+    others = actor_count - 1
+    return many.format(actor=actor_name, others=f'{others} other' if others == 1 else f'{others} others')
+
+
+def deliver(events, now=None):
+    """Write ``events``, coalescing them per ``(recipient, verb, target)``.
+
+    Events join the newest unread notification for their key created within
+    ``NOTIFICATION_WINDOW_SECONDS``; the rest become new rows. Actors are recorded per
+    notification, so one already counted does not count again. Either way this is one
+    lookup, one ``bulk_create``, one actor insert and one ``bulk_update`` per batch.
+    """
+    now = now or timezone.now()
+    groups = {}
+    for item in events:
+        actors = groups.setdefault((item['recipient'], item['verb'], item['target']), {})
+        actors.pop(item['actor'], None)
+        actors[item['actor']] = item['actor_name']
+    if not groups:
+        return 0
+
+    since = now - timedelta(seconds=settings.NOTIFICATION_WINDOW_SECONDS)
+    candidates = Notification.objects.filter(
+        recipient_id__in={key[0] for key in groups},
+        verb__in={key[1] for key in groups},
+        read=False,
+        created_at__gte=since,
+    ).order_by('created_at')
+    latest = {(row.recipient_id, row.verb, row.target_id): row for row in candidates}
+
+    created, matched, pairs = [], [], []
+    for (recipient_id, verb, target_id), actors in groups.items():
+        row = latest.get((recipient_id, verb, target_id))
+        if row is not None:
+            matched.append((row, actors))
+        else:
+            actor_id, actor_name = list(actors.items())[-1]
+            row = Notification(
+                recipient_id=recipient_id, sender_id=actor_id, verb=verb, target_id=target_id,
+                actor_count=len(actors), message=message(verb, actor_name, len(actors)),
+            )
+            created.append(row)
+        pairs.append((row, actors))
+
+    updated, counts = [], {}
+    with transaction.atomic(savepoint=False):
+        Notification.objects.bulk_create(created)
+        added = _add_actors([(row.pk, actor_id) for row, actors in pairs for actor_id in actors])
+        for row, actors in matched:
+            new = [(actor_id, name) for actor_id, name in actors.items() if (row.pk, actor_id) in added]
+            if not new:
+                continue
+            actor_id, actor_name = new[-1]
+            counts[id(row)] = row.actor_count + len(new)
+            row.message = message(row.verb, actor_name, counts[id(row)])
+            row.actor_count = F('actor_count') + len(new)
+            row.sender_id = actor_id
+            updated.append(row)
+        if updated:
+            Notification.objects.bulk_update(updated, ['message', 'actor_count', 'sender'])
+        fresh = {}
+        for row in created:
+            fresh[row.recipient_id] = fresh.get(row.recipient_id, 0) + 1
+        transaction.on_commit(lambda: _bump_unread(fresh))
+        transaction.on_commit(lambda: _publish(created + updated, counts))
+    return len(created) + len(updated)
+
+
+def _add_actors(pairs):
+    """Record ``(notification_id, actor_id)`` pairs in one insert; returns the pairs that were new."""
+    if not pairs:
+        return set()
+    through = Notification.actors.through
+    using = router.db_for_write(through)
+    quote = connections[using].ops.quote_name
+    table = quote(through._meta.db_table)
+    notification, actor = (quote(through._meta.get_field(name).column) for name in ('notification', 'userprofile'))
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ({notification}, {actor}) VALUES {", ".join(["(%s, %s)"] * len(pairs))} '
+            f'ON CONFLICT ({notification}, {actor}) DO NOTHING RETURNING {notification}, {actor}',
+            [value for pair in pairs for value in pair],
+        )
+        return set(cursor.fetchall())
+
+
+def _publish(rows, counts):
+    for row in rows:
+        streams.publish([row.recipient_id], 'notification', {
+            'id': row.pk,
+            'verb': row.verb,
+            'target_id': row.target_id,
+            'sender': row.sender_id,
+            'actor_count': counts.get(id(row), row.actor_count),
+            'message': row.message,
+        })
+
+
+def _bump_unread(counts):
+    for profile_id, count in counts.items():
+        try:
+            cache.incr(UNREAD_KEY.format(profile_id=profile_id), count)
+        except ValueError:
+            pass
+
+
+def unread_count(profile_id):
+    """Unread notifications for ``profile_id``, counted once and then kept in the cache."""
+    key = UNREAD_KEY.format(profile_id=profile_id)
+    count = cache.get(key)
+    if count is None:
+        count = Notification.objects.filter(recipient_id=profile_id, read=False).count()
+        cache.add(key, count, settings.NOTIFICATION_UNREAD_TTL)
+    return count
+
+
+def mark_read(profile_id, ids=None):
+    rows = Notification.objects.filter(recipient_id=profile_id, read=False)
+    if ids is not None:
+        rows = rows.filter(pk__in=ids)
+    marked = rows.update(read=True)
+    if ids is None:
+        cache.set(UNREAD_KEY.format(profile_id=profile_id), 0, settings.NOTIFICATION_UNREAD_TTL)
+    else:
+        cache.delete(UNREAD_KEY.format(profile_id=profile_id))
+    return marked
@@ -0,0 +1,131 @@
+import base64
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Cursor pagination keyed on ``(created_at, id)``, newest first.
+
+    Each page is a single range scan bounded by the cursor position, so deep
+    pages cost the same as the first one.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        page_size = settings.API_PAGE_SIZE
+        if self.page_size_query_param in request.query_params:
+            try:
+                page_size = int(request.query_params[self.page_size_query_param])
+            except ValueError:
+                pass
+        return max(1, min(page_size, settings.API_MAX_PAGE_SIZE))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            key, pk, reverse = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            position = (self.load_key(key), int(pk))
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if position[0] is None:
+            raise NotFound(self.invalid_cursor_message)
+        return position, bool(reverse)
+
+    def load_key(self, value):
+        return parse_datetime(value)
+
+    def dump_key(self, value):
+        return value.isoformat()
+
+    def encode_cursor(self, position, reverse):
+        key, pk = position
+        payload = json.dumps([self.dump_key(key), pk, int(reverse)], separators=(',', ':'))
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, base64.urlsafe_b64encode(payload.encode('ascii')).decode('ascii'))
+
+    def paginate(self, fetch, request, key):
+        """Page through ``fetch(position, reverse, limit)``.
+
+        ``fetch`` returns rows past ``position`` nearest first: newest first going
+        forward, oldest first when ``reverse`` is set. ``key`` maps a row to its
+        ``(created_at, id)`` position.
+        """
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request)
+        rows = list(fetch(position, reverse, self.page_size + 1))
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.first_position = key(rows[0]) if rows else position
+        self.last_position = key(rows[-1]) if rows else position
+        return rows
+
+    def paginate_queryset(self, queryset, request, view=None):
+        def fetch(position, reverse, limit):
+            rows = queryset
+            if position is not None:
+                created_at, pk = position
+                if reverse:
+                    rows = rows.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, pk__gt=pk))
+                else:
+                    rows = rows.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk))
+            ordering = ('created_at', 'pk') if reverse else ('-created_at', '-pk')
+            return rows.order_by(*ordering)[:limit]
+
+        return self.paginate(fetch, request, key=lambda row: (row.created_at, row.pk))
+
+    def get_next_link(self):
+        if not self.has_next or self.last_position is None:
+            return None
+        return self.encode_cursor(self.last_position, reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or self.first_position is None:
+            return None
+        return self.encode_cursor(self.first_position, reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class SearchPagination(KeysetPagination):
+    """Keyset pagination over ``(score, id)`` search results, best match first."""
+
+    def load_key(self, value):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(value)
+        return float(value)
+
+    def dump_key(self, value):
+        return value
@@ -0,0 +1,279 @@
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DatabaseError, connection
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class BasePresenceStore:
+    """Recent activity per user, newest first, plus the ``last_login`` values not yet flushed.
+
+    ``top`` returns up to ``limit`` ``(user_id, username, moment)`` entries at or after
+    ``since``, newest first. ``seed`` loads ``(user_id, username, moment)`` rows from the
+    database without overriding fresher entries.
+    """
+
+    def touch(self, user_id, username, moment):
+        raise NotImplementedError
+
+    def top(self, limit, since):
+        raise NotImplementedError
+
+    def seed(self, rows):
+        raise NotImplementedError
+
+    def is_seeded(self):
+        raise NotImplementedError
+
+    def seed_since(self):
+        """Oldest ``last_login`` the next ``seed`` needs; ``None`` loads the ``PRESENCE_MAX_USERS`` most recent."""
+        return None
+
+    def drain(self):
+        """Return and forget the ``{user_id: moment}`` touches not yet written to the database."""
+        raise NotImplementedError
+
+    def requeue(self, dirty):
+        """Put back drained ``{user_id: moment}`` touches that could not be written, keeping newer touches."""
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class LocalPresenceStore(BasePresenceStore):
+    """An ``OrderedDict`` kept in activity order, so ``top`` walks only the entries it returns.
+
+    It lives in one process. Each process flushes its own touches on a timer and reloads
+    the logins other processes flushed every ``PRESENCE_FLUSH_SECONDS``, so with several
+    workers activity shows up across them within about two flush intervals. Use
+    ``RedisPresenceStore`` to share it immediately.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._dirty = {}
+        self._seeded_at = None
+
+    def touch(self, user_id, username, moment):
+        with self._lock:
+            self._entries[user_id] = (username, moment)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > settings.PRESENCE_MAX_USERS:
+                self._entries.popitem(last=False)
+            self._dirty[user_id] = moment
+
+    def top(self, limit, since):
+        found = []
+        with self._lock:
+            for user_id in reversed(self._entries):
+                username, moment = self._entries[user_id]
+                if len(found) >= limit or moment < since:
+                    break
+                found.append((user_id, username, moment))
+        return found
+
+    def seed(self, rows):
+        with self._lock:
+            merged = dict(self._entries)
+            for user_id, username, moment in rows:
+                if user_id not in merged or merged[user_id][1] < moment:
+                    merged[user_id] = (username, moment)
+            ordered = sorted(merged.items(), key=lambda item: item[1][1])[-settings.PRESENCE_MAX_USERS:]
+            self._entries = OrderedDict(ordered)
+            self._seeded_at = (time.monotonic(), timezone.now())
+
+    def is_seeded(self):
+        return self._seeded_at is not None and time.monotonic() - self._seeded_at[0] < settings.PRESENCE_FLUSH_SECONDS
+
+    def seed_since(self):
+        if self._seeded_at is None:
+            return None
+        # Another process writes a login up to one flush interval after it happened.
+        return self._seeded_at[1] - timedelta(seconds=2 * settings.PRESENCE_FLUSH_SECONDS)
+
+    def drain(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        return dirty
+
+    def requeue(self, dirty):
+        with self._lock:
+            # Anything touched since the drain is newer.
+            self._dirty = {**dirty, **self._dirty}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._dirty.clear()
+            self._seeded_at = None
+
+
+class RedisPresenceStore(BasePresenceStore):
+    """A Redis sorted set scored by timestamp, shared by every process. Requires ``redis``."""
+    activity_key = 'presence:activity'
+    names_key = 'presence:usernames'
+    dirty_key = 'presence:dirty'
+    seeded_key = 'presence:seeded'
+
+    def __init__(self):
+        import redis
+
+        self.redis = redis.Redis.from_url(settings.PRESENCE_REDIS_URL, decode_responses=True)
+
+    def touch(self, user_id, username, moment):
+        score = moment.timestamp()
+        pipeline = self.redis.pipeline()
+        pipeline.zadd(self.activity_key, {user_id: score})
+        pipeline.hset(self.names_key, user_id, username)
+        pipeline.hset(self.dirty_key, user_id, score)
+        pipeline.zremrangebyrank(self.activity_key, 0, -settings.PRESENCE_MAX_USERS - 1)
+        pipeline.execute()
+
+    def top(self, limit, since):
+        rows = self.redis.zrevrangebyscore(self.activity_key, '+inf', since.timestamp(), start=0, num=limit, withscores=True)
+        names = self.redis.hmget(self.names_key, [user_id for user_id, _ in rows]) if rows else []
+        return [
+            (int(user_id), username, datetime.fromtimestamp(score, dt_timezone.utc))
+            for (user_id, score), username in zip(rows, names)
+        ]
+
+    def seed(self, rows):
+        rows = list(rows)
+        if rows:
+            pipeline = self.redis.pipeline()
+            pipeline.zadd(self.activity_key, {user_id: moment.timestamp() for user_id, _, moment in rows}, gt=True)
+            pipeline.hset(self.names_key, mapping={user_id: username for user_id, username, _ in rows})
+            pipeline.execute()
+        self.redis.set(self.seeded_key, 1)
+
+    def is_seeded(self):
+        return bool(self.redis.exists(self.seeded_key))
+
+    def drain(self):
+        pipeline = self.redis.pipeline()
+        pipeline.hgetall(self.dirty_key)
+        pipeline.delete(self.dirty_key)
+        dirty, _ = pipeline.execute()
+        return {int(user_id): datetime.fromtimestamp(float(score), dt_timezone.utc) for user_id, score in dirty.items()}
+
+    def requeue(self, dirty):
+        pipeline = self.redis.pipeline()
+        for user_id, moment in dirty.items():
+            pipeline.hsetnx(self.dirty_key, user_id, moment.timestamp())
+        pipeline.execute()
+
+    def clear(self):
+        self.redis.delete(self.activity_key, self.names_key, self.dirty_key, self.seeded_key)
+
+
+_store = None
+_lock = threading.Lock()
+_last_flush = time.monotonic()
+_flusher = None
+
+
+def get_store():
+    global _store
+    with _lock:
+        if _store is None:
+            _store = import_string(settings.PRESENCE_STORE)()
+            if isinstance(_store, LocalPresenceStore) and settings.PRESENCE_FLUSH_THREAD:
+                _start_flusher()
+        return _store
+
+
+def _start_flusher():
+    """Flush this process's store on a timer; the beat task runs elsewhere and cannot reach it."""
+    global _flusher
+    if _flusher is None:
+        _flusher = threading.Thread(target=_flush_periodically, name='presence-flush', daemon=True)
+        _flusher.start()
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(settings.PRESENCE_FLUSH_SECONDS)
+        try:
+            flush()
+        except Exception:
+            logger.exception('Flushing last_login values failed')
+        finally:
+            connection.close()
+
+
+def flush(batch_size=500):
+    """Write pending ``last_login`` values with one ``UPDATE`` per batch. Returns the number written.
+
+    When a batch fails, it and the batches after it go back to the store for the next flush.
+    """
+    global _last_flush
+    _last_flush = time.monotonic()
+    store = get_store()
+    dirty = sorted(store.drain().items())
+    for start in range(0, len(dirty), batch_size):
+        batch = dirty[start:start + batch_size]
+        try:
+            User.objects.filter(pk__in=[user_id for user_id, _ in batch]).update(last_login=Case(
+                *[When(pk=user_id, then=Value(moment)) for user_id, moment in batch],
+                output_field=DateTimeField(),
+            ))
+        except DatabaseError:
+            store.requeue(dict(dirty[start:]))
+            raise
+    return len(dirty)
+
+
+@atexit.register
+def _flush_at_exit():
+    # Only a process flushing its own store on a timer has touches nobody else writes.
+    if _flusher is not None:
+        try:
+            flush()
+        except Exception:
+            logger.exception('Flushing last_login values at exit failed')
+
+
+def record(user, moment=None):
+    """Note that ``user`` is active, flushing pending ``last_login`` values every ``PRESENCE_FLUSH_SECONDS``."""
+    get_store().touch(user.pk, user.get_username(), moment or timezone.now())
+    if time.monotonic() - _last_flush >= settings.PRESENCE_FLUSH_SECONDS:
+        flush()
+
+
+def active_users(limit, since):
+    """Up to ``limit`` ``(user_id, username, moment)`` active since ``since``, newest first.
+
+    A cold store is seeded from the ``PRESENCE_MAX_USERS`` most recent ``last_login``
+    values; a stale local one reloads the logins flushed since it was last seeded.
+    """
+    store = get_store()
+    if not store.is_seeded():
+        store.seed(recent_logins(store.seed_since()))
+    return store.top(limit, since)
+
+
+def recent_logins(since=None):
+    users = User.objects.filter(last_login__isnull=False).order_by('-last_login')
+    if since is not None:
+        users = users.filter(last_login__gte=since)
+    return users.values_list('pk', 'username', 'last_login')[:settings.PRESENCE_MAX_USERS]
+
+
+def reset():
+    global _store
+    with _lock:
+        if _store is not None:
+            _store.clear()
+        _store = None
@@ -0,0 +1,141 @@
+import re
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from . import presence
+from .models import Tweet, UserProfile, reply_subtree
+
+# Hot paths whose SELECTs must be answered from an index. Each takes a ``Sample`` and
+# runs the real code path; the statements it issues are captured and explained.
+HOT_PATHS = {}
+
+
+def hot_path(function):
+    HOT_PATHS[function.__name__] = function
+    return function
+
+
+class Rollback(Exception):
+    pass
+
+
+class Sample:
+    """Rows of the current dataset the hot paths are run against."""
+
+    def __init__(self):
+        self.profile = (
+            UserProfile.objects.select_related('user').filter(following__isnull=False, notifications__isnull=False)
+            .order_by('pk').first()
+        )
+        self.thread_id = Tweet.objects.filter(reply_count__gt=0).order_by('pk').values_list('pk', flat=True).first()
+        if self.profile is None or self.thread_id is None:
+            raise ValueError('The dataset needs a user with follows and notifications and a tweet with replies.')
+
+
+def _get(view, user, **kwargs):
+    request = APIRequestFactory().get('/')
+    force_authenticate(request, user=user)
+    with override_settings(ALLOWED_HOSTS=['testserver']):
+        response = view(request, **kwargs)
+        response.render()
+    return response
+
+
+@hot_path
+def feed(sample):
+    from .views import FeedAPIView
+    # Nothing is materialized in a fresh transaction, so this includes the rebuild.
+    _get(FeedAPIView.as_view(), sample.profile.user)
+
+
+@hot_path
+def notifications(sample):
+    from .views import NotificationAPIView
+    _get(NotificationAPIView.as_view(), sample.profile.user)
+
+
+@hot_path
+def deletion_statistics(sample):
+    from .views import calculate_deletion_statistics
+    now = timezone.now()
+    calculate_deletion_statistics(now - timedelta(days=30), now)
+
+
+@hot_path
+def thread(sample):
+    from .views import TweetViewSet
+    _get(TweetViewSet.as_view({'get': 'thread'}), sample.profile.user, pk=sample.thread_id)
+    list(Tweet.objects.filter(pk__in=reply_subtree([sample.thread_id])).values_list('pk', flat=True))
+
+
+@hot_path
+def active_users(sample):
+    list(presence.recent_logins())
+
+
+_CTE_RE = re.compile(r'(?:\bWITH(?:\s+RECURSIVE)?|,)\s+"?(\w+)"?\s*(?:\([^)]*\))?\s+AS\s*\(', re.IGNORECASE)
+
+
+def full_scans(sql, plan):
+    """Lines of ``plan`` that read a whole table rather than searching an index."""
+    if connection.vendor == 'postgresql':
+        return [line for line in plan if 'Seq Scan on ' in line]
+    ctes = set(_CTE_RE.findall(sql))
+    for name in list(ctes):
+        ctes.update(re.findall(rf'\b(?:FROM|JOIN)\s+"?{name}"?\s+(?:AS\s+)?"?(\w+)"?', sql, re.IGNORECASE))
+    # Derived tables, such as the one wrapping a query filtered on a window function.
+    ctes.update(re.findall(r'\)\s+(?:AS\s+)?"?(\w+)"?', sql, re.IGNORECASE))
+    found = []
+    for line in plan:
+        match = re.search(r'\bSCAN (\S+)(.*)', line)
+        if match and 'USING' not in match.group(2) and 'VIRTUAL TABLE' not in match.group(2):
+            if match.group(1) not in ctes and match.group(1) != 'CONSTANT' and not match.group(1).startswith('(subquery-'):
+                found.append(line)
+    return found
+
+
+def explain(sql, params):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+        if connection.vendor == 'postgresql':
+            # Ask whether an index can serve the query, not whether the planner prefers one on a small table.
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        cursor.execute('EXPLAIN ' + sql, params)
+        return [' '.join(str(column) for column in row) for row in cursor.fetchall()]
+
+
+def check(names=None):
+    """Run the hot paths in a rolled-back transaction.
+
+    Returns ``{name: [(sql, plan, full_scans), ...]}`` with one entry per ``SELECT``.
+    """
+    names = names or list(HOT_PATHS)
+    statements = []
+
+    def capture(execute, sql, params, many, context):
+        statements.append((sql, params))
+        return execute(sql, params, many, context)
+
+    report = {}
+    try:
+        with transaction.atomic():
+            sample = Sample()
+            for name in names:
+                statements.clear()
+                with connection.execute_wrapper(capture):
+                    HOT_PATHS[name](sample)
+                selects = [(sql, params) for sql, params in statements if sql.lstrip().upper().startswith(('SELECT', 'WITH'))]
+                report[name] = []
+                for sql, params in selects:
+                    plan = explain(sql, params)
+                    report[name].append((sql, plan, full_scans(sql, plan)))
+            raise Rollback
+    except Rollback:
+        pass
+    return report
@@ -0,0 +1,28 @@
+import orjson
+from django.utils.encoding import force_str
+from django.utils.functional import Promise
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+_encoder = JSONEncoder()
+
+
+def _default(obj):
+    if isinstance(obj, Promise):
+        return force_str(obj)
+    return _encoder.default(obj)
+
+
+class ORJSONRenderer(BaseRenderer):
+    """``JSONRenderer`` output from orjson: compact UTF-8, ``Z`` for UTC, DRF's encoder for anything else."""
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        options = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+        if accepted_media_type and 'indent=' in accepted_media_type:
+            options |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=_default, option=options)
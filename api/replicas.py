@@ -0,0 +1,182 @@
+import contextvars
+import itertools
+import logging
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, InterfaceError, OperationalError, connections
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_routing = contextvars.ContextVar('replica_routing', default=None)
+
+
+class Routing:
+    """How the current request reads: from replicas until it writes, then from the primary."""
+    __slots__ = ('replicas', 'wrote')
+
+    def __init__(self, replicas):
+        self.replicas = replicas
+        self.wrote = False
+
+
+class ReplicaPool:
+    """Picks replicas round-robin among those that answered their last health check.
+
+    A replica is probed with ``SELECT 1`` at most every ``REPLICA_HEALTH_INTERVAL``
+    seconds; one that fails a probe or a query is skipped until a later probe succeeds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._status = {}
+        self._turn = itertools.count()
+
+    def choose(self):
+        healthy = [alias for alias in settings.DATABASE_REPLICAS if self.is_healthy(alias)]
+        if not healthy:
+            return None
+        return healthy[next(self._turn) % len(healthy)]
+
+    def is_healthy(self, alias):
+        with self._lock:
+            status = self._status.get(alias)
+        if status is not None and time.monotonic() - status[1] < settings.REPLICA_HEALTH_INTERVAL:
+            return status[0]
+        return self.check(alias)
+
+    def check(self, alias):
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute('SELECT 1')
+            healthy = True
+        except DatabaseError:
+            logger.warning('Replica %s failed its health check', alias, exc_info=True)
+            connections[alias].close()
+            healthy = False
+        self._set(alias, healthy)
+        return healthy
+
+    def mark_down(self, alias):
+        self._set(alias, False)
+
+    def _set(self, alias, healthy):
+        with self._lock:
+            self._status[alias] = (healthy, time.monotonic())
+
+    def clear(self):
+        with self._lock:
+            self._status.clear()
+
+
+pool = ReplicaPool()
+
+
+def _in_transaction():
+    return connections[DEFAULT_DB_ALIAS].in_atomic_block
+
+
+class PrimaryReplicaRouter:
+    """Sends reads of safe requests to ``DATABASE_REPLICAS`` and everything else to the primary.
+
+    Reads stay on the primary once the request writes, inside a transaction on the
+    primary, outside requests (tasks, commands) and while the client holds the pin
+    cookie set by ``ReplicaRoutingMiddleware`` after its last write.
+    """
+
+    def db_for_read(self, model, **hints):
+        routing = _routing.get()
+        if routing is None or not routing.replicas or routing.wrote or _in_transaction():
+            return DEFAULT_DB_ALIAS
+        return pool.choose() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        routing = _routing.get()
+        if routing is not None:
+            routing.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary.
+        return db not in settings.DATABASE_REPLICAS
+
+
+class ReplicaRoutingMiddleware:
+    """Lets ``GET``, ``HEAD`` and ``OPTIONS`` requests read from replicas.
+
+    A request that writes pins its client to the primary for ``REPLICA_PIN_SECONDS``
+    through the ``REPLICA_PIN_COOKIE`` cookie, so users read their own writes even
+    while the replicas lag behind.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        routing = self._routing(request)
+        token = _routing.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            _routing.reset(token)
+        return self._finish(response, routing)
+
+    async def __acall__(self, request):
+        routing = self._routing(request)
+        token = _routing.set(routing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _routing.reset(token)
+        return self._finish(response, routing)
+
+    def _routing(self, request):
+        return Routing(
+            bool(settings.DATABASE_REPLICAS)
+            and request.method in SAFE_METHODS
+            and settings.REPLICA_PIN_COOKIE not in request.COOKIES
+        )
+
+    def _finish(self, response, routing):
+        if routing.wrote and settings.DATABASE_REPLICAS and settings.REPLICA_PIN_SECONDS:
+            response.set_cookie(
+                settings.REPLICA_PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax',
+            )
+        return response
+
+
+def fail_over(execute, sql, params, many, context):
+    """A replica ``execute_wrapper`` retrying on the primary a query the replica cannot answer.
+
+    The replica is taken out of rotation and the statement runs again on the primary;
+    its cursor replaces the replica's, so the caller fetches the rows from the primary.
+    """
+    try:
+        return execute(sql, params, many, context)
+    except (InterfaceError, OperationalError):
+        alias = context['connection'].alias
+        pool.mark_down(alias)
+        logger.warning('Replica %s failed a query, retrying it on the primary', alias, exc_info=True)
+    primary = connections[DEFAULT_DB_ALIAS].cursor()
+    result = primary.executemany(sql, params) if many else primary.execute(sql, params)
+    context['cursor'].cursor = primary.cursor
+    return result
+
+
+def instrument(connection):
+    if connection.alias in settings.DATABASE_REPLICAS and fail_over not in connection.execute_wrappers:
+        connection.execute_wrappers.append(fail_over)
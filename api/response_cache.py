@@ -0,0 +1,110 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+from rest_framework.response import Response
+
+from . import metrics
+
+VERSION_KEY = 'responses:version:{namespace}'
+ENTRY_KEY = 'responses:{view}:{digest}'
+
+
+def get_cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def versions(namespaces):
+    """Current version token of each namespace. Missing ones start from the clock, so they never repeat."""
+    store = get_cache()
+    keys = [VERSION_KEY.format(namespace=namespace) for namespace in namespaces]
+    found = store.get_many(keys)
+    for key in keys:
+        if key not in found:
+            store.add(key, time.time_ns(), None)
+            found[key] = store.get(key)
+    return [found[key] for key in keys]
+
+
+def _bump(namespaces):
+    store = get_cache()
+    for namespace in namespaces:
+        key = VERSION_KEY.format(namespace=namespace)
+        try:
+            store.incr(key)
+        except ValueError:
+            store.set(key, time.time_ns(), None)
+
+
+def invalidate(*namespaces):
+    """Retire the cached responses of ``namespaces`` now and again once the transaction commits.
+
+    The second bump stops a request that read the old rows before the commit from
+    caching them under the version set by the first one.
+    """
+    if namespaces:
+        _bump(namespaces)
+        transaction.on_commit(lambda: _bump(namespaces))
+
+
+def etag(content):
+    return '"%s"' % hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+def _not_modified(request, tag):
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    return bool(header) and (header.strip() == '*' or tag in parse_etags(header))
+
+
+def _finish(request, response, tag):
+    if _not_modified(request, tag):
+        response = HttpResponseNotModified()
+    response['ETag'] = tag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def cache_response(*namespaces, per_user=False):
+    """Cache a DRF handler's successful JSON responses until one of ``namespaces`` is invalidated.
+
+    Namespaces are format strings filled from the view's URL kwargs and ``user``, the
+    requesting user's id, e.g. ``'tweet:{pk}'``.
+    Entries are keyed by the current namespace versions, the full path and, with
+    ``per_user``, the requesting user. Responses carry a strong ``ETag``; a matching
+    ``If-None-Match`` is answered with 304 from the cached tag alone.
+    """
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(view, request, *args, **kwargs):
+            if not settings.RESPONSE_CACHE_TIMEOUT or request.accepted_renderer.format != 'json':
+                return handler(view, request, *args, **kwargs)
+            parts = versions([namespace.format(user=request.user.pk, **kwargs) for namespace in namespaces])
+            parts += [request.get_full_path(), request.accepted_media_type, request.user.pk if per_user else '']
+            digest = hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+            key = ENTRY_KEY.format(view=f'{type(view).__name__}.{handler.__name__}', digest=digest)
+            store = get_cache()
+
+            entry = store.get(key)
+            if entry is not None:
+                tag, content, content_type = entry
+                return _finish(request, HttpResponse(content, content_type=content_type), tag)
+
+            response = handler(view, request, *args, **kwargs)
+            if not isinstance(response, Response) or response.status_code != 200:
+                return response
+            response.accepted_renderer = request.accepted_renderer
+            response.accepted_media_type = request.accepted_media_type
+            response.renderer_context = view.get_renderer_context()
+            with metrics.serializing():
+                response.render()
+            tag = etag(response.content)
+            store.set(key, (tag, response.content, response['Content-Type']), settings.RESPONSE_CACHE_TIMEOUT)
+            return _finish(request, response, tag)
+        return wrapper
+    return decorator
@@ -0,0 +1,126 @@
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.utils.module_loading import import_string
+
+from .models import Hashtag, Tweet
+
+TERM_RE = re.compile(r'\w+\*?')
+
+
+def terms(query):
+    """Split user input into terms; a trailing ``*`` makes a term a prefix match."""
+    return [(term.rstrip('*').lower(), term.endswith('*')) for term in TERM_RE.findall(query)]
+
+
+class BaseSearchBackend:
+    """Ranks live tweets against a query.
+
+    ``search`` returns ``(score, tweet_id)`` pairs past the ``(score, tweet_id)``
+    ``position`` nearest first: best match first, or worst first when ``reverse``
+    is set. Lower scores rank higher. All terms must match.
+    """
+
+    def search(self, query, limit, position=None, reverse=False, author_id=None, hashtag=None, since=None, until=None):
+        raise NotImplementedError
+
+    def rebuild(self):
+        raise NotImplementedError
+
+
+def _filters(author_id, hashtag, since, until):
+    clauses, params = [], []
+    if author_id is not None:
+        clauses.append('t.author_id = %s')
+        params.append(author_id)
+    if since is not None:
+        clauses.append('t.created_at >= %s')
+        params.append(connection.ops.adapt_datetimefield_value(since))
+    if until is not None:
+        clauses.append('t.created_at < %s')
+        params.append(connection.ops.adapt_datetimefield_value(until))
+    if hashtag is not None:
+        through = Tweet.hashtags.through._meta.db_table
+        clauses.append(
+            f'EXISTS (SELECT 1 FROM {through} th JOIN {Hashtag._meta.db_table} h ON h.id = th.hashtag_id'
+            ' WHERE th.tweet_id = t.id AND h.tag = %s)'
+        )
+        params.append(hashtag.lower())
+    return clauses, params
+
+
+def _page(score, position, reverse):
+    if position is None:
+        return [], [], f'{score} DESC, t.id DESC' if reverse else f'{score}, t.id'
+    op = '<' if reverse else '>'
+    clause = f'({score} {op} %s OR ({score} = %s AND t.id {op} %s))'
+    return [clause], [position[0], position[0], position[1]], f'{score} DESC, t.id DESC' if reverse else f'{score}, t.id'
+
+
+class SqliteSearchBackend(BaseSearchBackend):
+    """FTS5 index from migration 0010, ranked by ``bm25()``."""
+    table = 'api_tweet_fts'
+
+    def match_expression(self, query):
+        return ' '.join('"%s"%s' % (term, '*' if prefix else '') for term, prefix in terms(query))
+
+    def search(self, query, limit, position=None, reverse=False, author_id=None, hashtag=None, since=None, until=None):
+        expression = self.match_expression(query)
+        if not expression:
+            return []
+        clauses, params = _filters(author_id, hashtag, since, until)
+        paging, paging_params, ordering = _page(f'bm25({self.table})', position, reverse)
+        where = ' AND '.join([f'{self.table} MATCH %s'] + clauses + paging)
+        sql = (
+            f'SELECT bm25({self.table}), t.id FROM {self.table} JOIN {Tweet._meta.db_table} t ON t.id = {self.table}.rowid'
+            f' WHERE {where} ORDER BY {ordering} LIMIT %s'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [expression] + params + paging_params + [limit])
+            return cursor.fetchall()
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {self.table} ({self.table}) VALUES ('delete-all')")
+            cursor.execute(f'INSERT INTO {self.table} (rowid, content) SELECT id, content FROM {Tweet._meta.db_table} WHERE NOT is_deleted')
+            cursor.execute(f"INSERT INTO {self.table} ({self.table}) VALUES ('optimize')")
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """``tsvector`` search over the partial GIN index from migration 0010, ranked by ``ts_rank``."""
+    config = 'english'
+
+    def search(self, query, limit, position=None, reverse=False, author_id=None, hashtag=None, since=None, until=None):
+        expression = ' & '.join(term + (':*' if prefix else '') for term, prefix in terms(query))
+        if not expression:
+            return []
+        vector = f"to_tsvector('{self.config}', t.content)"
+        tsquery = f"to_tsquery('{self.config}', %s)"
+        clauses, params = _filters(author_id, hashtag, since, until)
+        paging, paging_params, ordering = _page('score', position, reverse)
+        where = ' AND '.join([f'{vector} @@ {tsquery}', 'NOT t.is_deleted'] + clauses)
+        sql = (
+            f'SELECT score, id FROM (SELECT -ts_rank({vector}, {tsquery}) AS score, t.id FROM {Tweet._meta.db_table} t'
+            f' WHERE {where}) t'
+        )
+        if paging:
+            sql += ' WHERE ' + paging[0]
+        sql += f' ORDER BY {ordering} LIMIT %s'
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [expression, expression] + params + paging_params + [limit])
+            return cursor.fetchall()
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute('REINDEX INDEX api_tweet_search_idx')
+
+
+_backends = {}
+
+
+def get_backend():
+    path = settings.SEARCH_BACKEND
+    if path not in _backends:
+        _backends[path] = import_string(path)()
+    return _backends[path]
@@ -1,4 +1,11 @@
-from rest_framework import serializers
+from operator import attrgetter
+
+from django.db.models.fields.related_descriptors import ManyToManyDescriptor
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from . import metrics
+from .authentication import add_claims
 from .models import UserProfile, Tweet, Notification
 
 class UserProfileSerializer(serializers.ModelSerializer):
@@ -9,9 +16,111 @@ class UserProfileSerializer(serializers.ModelSerializer):
 class TweetSerializer(serializers.ModelSerializer):
     class Meta:
         model = Tweet
-        fields = '__all__'
+        exclude = ('path', 'deleted_at')
+        read_only_fields = ('hashtags', 'like_count', 'retweet_count', 'reply_count')
 
 class NotificationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Notification
-        fields = '__all__'
\ No newline at end of file
+        exclude = ('actors',)
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        return add_claims(super().get_token(user), user)
+
+
+_PASSTHROUGH = (serializers.BooleanField, serializers.CharField, serializers.ChoiceField, serializers.FloatField, serializers.IntegerField)
+
+
+class CompiledSerializer:
+    """A read-only ``many=True`` fast path with the same output as ``serializer_class``.
+
+    The serializer's fields are resolved once into plain accessors: columns are read
+    straight off the instance, foreign keys from their ``*_id`` attribute, ISO datetimes
+    are converted with the timezone looked up once per call, and anything else goes
+    through the field's ``to_representation``. Many-to-many keys come from
+    ``prefetch_related`` when it was applied, otherwise from one ``values_list`` query on
+    the through table per call.
+    """
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        self.model = serializer_class.Meta.model
+        self._compiled = None
+
+    def _binder(self, field):
+        """Return ``bind(instances)``, which gives the accessor for one call."""
+        source = field.source
+        descriptor = getattr(self.model, source, None)
+        if (
+            isinstance(field, serializers.ManyRelatedField)
+            and isinstance(field.child_relation, serializers.PrimaryKeyRelatedField)
+            and field.child_relation.pk_field is None
+            and isinstance(descriptor, ManyToManyDescriptor) and not descriptor.reverse
+        ):
+            def bind(instances):
+                keys = self._related_keys(instances, source)
+                return lambda instance: keys[instance.pk]
+            return bind
+        if '.' in source:
+            get = field.get_attribute
+        elif type(field) in _PASSTHROUGH:
+            get = attrgetter(source)
+            return lambda instances: get
+        elif isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None:
+            get = attrgetter(self.model._meta.get_field(source).attname)
+            return lambda instances: get
+        else:
+            get = attrgetter(source)
+        if type(field) is serializers.DateTimeField and getattr(field, 'format', api_settings.DATETIME_FORMAT) == ISO_8601:
+            return lambda instances: self._datetime_accessor(get, field)
+        convert = field.to_representation
+        return lambda instances: lambda instance: None if (value := get(instance)) is None else convert(value)
+
+    @staticmethod
+    def _datetime_accessor(get, field):
+        tz = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+        if tz is None:
+            return lambda instance: None if (value := get(instance)) is None else field.to_representation(value)
+
+        def accessor(instance):
+            value = get(instance)
+            if value is None:
+                return None
+            if value.tzinfo is None:
+                return field.to_representation(value)
+            value = value.astimezone(tz).isoformat()
+            return value[:-6] + 'Z' if value.endswith('+00:00') else value
+        return accessor
+
+    def _related_keys(self, instances, source):
+        if all(source in getattr(instance, '_prefetched_objects_cache', ()) for instance in instances):
+            return {instance.pk: [related.pk for related in instance._prefetched_objects_cache[source]] for instance in instances}
+        field = self.model._meta.get_field(source)
+        through = field.remote_field.through
+        own = through._meta.get_field(field.m2m_field_name()).attname
+        other = through._meta.get_field(field.m2m_reverse_field_name()).attname
+        keys = {instance.pk: [] for instance in instances}
+        rows = through.objects.filter(**{f'{own}__in': list(keys)}).order_by(own, other).values_list(own, other)
+        for instance_pk, related_pk in rows:
+            keys[instance_pk].append(related_pk)
+        return keys
+
+    def __call__(self, instances):
+        instances = list(instances)
+        if not instances:
+            return []
+        if self._compiled is None:
+            self._compiled = [
+                (name, self._binder(field))
+                for name, field in self.serializer_class().fields.items() if not field.write_only
+            ]
+        with metrics.serializing():
+            columns = [(name, bind(instances)) for name, bind in self._compiled]
+            return [{name: get(instance) for name, get in columns} for instance in instances]
+
+
+profile_reader = CompiledSerializer(UserProfileSerializer)
+tweet_reader = CompiledSerializer(TweetSerializer)
+notification_reader = CompiledSerializer(NotificationSerializer)
@@ -1,8 +1,145 @@
 from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch import receiver
-from django.utils import timezone
+from django.contrib.auth.models import User
+from .models import Tweet, Follow, Hashtag, UserProfile, Like, Retweet, tweets_deleting, tweets_deleted, tweets_destroying, tweets_removing
+from . import authentication, deletions, entities, metrics, hashtags, presence, replicas, response_cache, timelines, trending
+from .tasks import fan_out_tweet, backfill_timeline, prune_timeline
 
 @receiver(user_logged_in)
 def update_last_login(sender, request, user, **kwargs):
-    user.last_login = timezone.now()
-    user.save()
\ No newline at end of file
+    presence.record(user)
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    metrics.instrument(connection)
+    replicas.instrument(connection)
+
+@receiver(post_save, sender=Tweet)
+def fan_out_new_tweet(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and not instance.is_deleted:
+        transaction.on_commit(lambda: fan_out_tweet.delay(instance.pk))
+
+@receiver(post_save, sender=Tweet)
+def count_reply(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and instance.parent_tweet_id and not instance.is_deleted:
+        Tweet.objects.filter(pk=instance.parent_tweet_id).update(reply_count=F('reply_count') + 1)
+
+@receiver(post_save, sender=Follow)
+def backfill_on_follow(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        transaction.on_commit(lambda: backfill_timeline.delay(instance.follower_id, instance.followed_id))
+
+@receiver(post_delete, sender=Follow)
+def prune_on_unfollow(sender, instance, **kwargs):
+    transaction.on_commit(lambda: prune_timeline.delay(instance.follower_id, instance.followed_id))
+
+@receiver(tweets_deleted)
+@receiver(tweets_removing)
+def remove_deleted_from_timelines(sender, tweet_ids, **kwargs):
+    timelines.get_backend().remove_tweets(tweet_ids)
+
+@receiver(m2m_changed, sender=Tweet.hashtags.through)
+def count_hashtags(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    sign = 1 if action == 'post_add' else -1
+    if reverse:
+        tweets = instance.tweets.all() if action == 'pre_clear' else Tweet.objects.filter(pk__in=pk_set)
+        hashtags.record_tagged_tweets(instance.pk, tweets, sign)
+        if action == 'post_add':
+            trending.record([instance.pk] * tweets.filter(is_deleted=False).count())
+    else:
+        if action == 'pre_clear':
+            pk_set = instance.hashtags.values_list('pk', flat=True)
+        hashtags.record_attached(instance, pk_set, sign)
+        if action == 'post_add' and not instance.is_deleted:
+            trending.record(pk_set)
+
+@receiver(tweets_deleting)
+@receiver(tweets_destroying)
+@receiver(tweets_removing)
+def uncount_deleted_hashtags(sender, tweet_ids, **kwargs):
+    hashtags.record_detached_tweets(Tweet.objects.filter(pk__in=tweet_ids))
+
+# Replies already deleted get their reason overwritten, so the subtree is uncounted
+# before the deletion and counted again after it.
+@receiver(tweets_deleting)
+def uncount_deletions(sender, tweet_ids, **kwargs):
+    deletions.record(Tweet.objects.filter(pk__in=tweet_ids), -1)
+
+@receiver(tweets_deleted)
+def count_deletions(sender, tweet_ids, **kwargs):
+    deletions.record(Tweet.objects.filter(pk__in=tweet_ids))
+
+@receiver(post_save, sender=Tweet)
+def count_created_deleted(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        deletions.record_tweet(instance)
+
+@receiver(post_delete, sender=Tweet)
+def uncount_removed_deleted(sender, instance, **kwargs):
+    deletions.record_tweet(instance, -1)
+
+@receiver(tweets_removing)
+def uncount_removed_tweets(sender, tweet_ids, **kwargs):
+    deletions.record(Tweet.objects.filter(pk__in=tweet_ids), -1)
+
+@receiver(post_delete, sender=Hashtag)
+def evict_hashtag_id(sender, instance, **kwargs):
+    entities.tag_ids.delete(instance.tag)
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def evict_cached_user(sender, instance, **kwargs):
+    authentication.users.delete(instance.pk)
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def evict_cached_profile(sender, instance, **kwargs):
+    authentication.users.delete(instance.user_id)
+
+@receiver(post_save, sender=Tweet)
+@receiver(post_delete, sender=Tweet)
+def invalidate_tweet_responses(sender, instance, **kwargs):
+    # Hashtag counts change only with a tweet's hashtags or its deletion, whose own
+    # receivers invalidate ``hashtags``.
+    namespaces = [f'tweet:{instance.pk}']
+    if instance.parent_tweet_id:
+        namespaces.append(f'tweet:{instance.parent_tweet_id}')
+    response_cache.invalidate(*namespaces)
+
+@receiver(m2m_changed, sender=Tweet.hashtags.through)
+def invalidate_tagged_responses(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        tweet_ids = (pk_set or ()) if reverse else [instance.pk]
+        response_cache.invalidate('hashtags', *[f'tweet:{pk}' for pk in tweet_ids])
+
+@receiver(tweets_deleted)
+def invalidate_deleted_responses(sender, tweet_ids, **kwargs):
+    response_cache.invalidate('hashtags', *[f'tweet:{pk}' for pk in tweet_ids])
+
+@receiver(tweets_destroying)
+@receiver(tweets_removing)
+def invalidate_removed_responses(sender, tweet_ids, **kwargs):
+    response_cache.invalidate('hashtags', *[f'tweet:{pk}' for pk in tweet_ids])
+
+@receiver(post_save, sender=Like)
+@receiver(post_delete, sender=Like)
+@receiver(post_save, sender=Retweet)
+@receiver(post_delete, sender=Retweet)
+def invalidate_engagement_responses(sender, instance, **kwargs):
+    response_cache.invalidate(f'tweet:{instance.tweet_id}')
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def invalidate_profile_responses(sender, instance, **kwargs):
+    response_cache.invalidate('profiles', f'profile:{instance.pk}', f'user:{instance.user_id}')
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_responses(sender, instance, **kwargs):
+    response_cache.invalidate(f'user:{instance.pk}')
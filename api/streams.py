@@ -0,0 +1,243 @@
+import asyncio
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.module_loading import import_string
+
+from .lru import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class Event:
+    __slots__ = ('id', 'type', 'data')
+
+    def __init__(self, id, type, data):
+        self.id = id
+        self.type = type
+        self.data = data
+
+    def encode(self):
+        return f'id: {self.id}\nevent: {self.type}\ndata: {json.dumps(self.data, cls=DjangoJSONEncoder)}\n\n'
+
+
+class Subscription:
+    def __init__(self, channel, maxsize):
+        self.channel = channel
+        self.maxsize = maxsize
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self.closed = False
+
+    def offer(self, event):
+        if self.closed:
+            return
+        if self.queue.qsize() >= self.maxsize:
+            # A client this far behind is cut off; it reconnects and resumes from its Last-Event-ID.
+            self.closed = True
+            self.queue.put_nowait(None)
+            return
+        self.queue.put_nowait(event)
+
+
+class Hub:
+    """Fans events out to the streams connected to this process, keyed by profile id."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+
+    def subscribe(self, channel):
+        subscription = Subscription(channel, settings.STREAM_QUEUE_SIZE)
+        with self._lock:
+            self._subscriptions.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.channel, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(subscription.channel, None)
+
+    def dispatch(self, channels, event):
+        """Hand ``event`` to every subscriber of ``channels``. Safe to call from any thread."""
+        with self._lock:
+            targets = [subscription for channel in channels for subscription in self._subscriptions.get(channel, ())]
+        for subscription in targets:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, event)
+            except RuntimeError:
+                self.unsubscribe(subscription)
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+
+class BaseBroker:
+    """Carries published events to the hub of every process serving streams.
+
+    Brokers also keep a short per-channel backlog so reconnecting clients can resume
+    from their ``Last-Event-ID``. Event ids only ever increase.
+    """
+
+    def publish(self, channels, event_type, data):
+        raise NotImplementedError
+
+    def replay(self, channel, after_id):
+        raise NotImplementedError
+
+    def start(self, hub):
+        pass
+
+
+class LocalBroker(BaseBroker):
+    """Delivers within this process only: enough for one ASGI worker with eager Celery tasks."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Ids start from the clock so they keep increasing across restarts.
+        self._ids = itertools.count(time.time_ns() // 1000)
+        self._backlogs = LRUCache(settings.STREAM_BACKLOG_CHANNELS, settings.STREAM_BACKLOG_SECONDS)
+
+    def publish(self, channels, event_type, data):
+        with self._lock:
+            event = Event(next(self._ids), event_type, data)
+            for channel in channels:
+                backlog = self._backlogs.get(channel)
+                if backlog is None:
+                    backlog = deque(maxlen=settings.STREAM_BACKLOG)
+                backlog.append(event)
+                self._backlogs.set(channel, backlog)
+        get_hub().dispatch(channels, event)
+        return event
+
+    def replay(self, channel, after_id):
+        with self._lock:
+            return [event for event in self._backlogs.get(channel, ()) if event.id > after_id]
+
+
+class RedisBroker(BaseBroker):
+    """Publishes through Redis pub/sub so Celery workers reach every ASGI process. Requires ``redis``."""
+    topic = 'stream:events'
+    sequence_key = 'stream:sequence'
+    backlog_key = 'stream:backlog:{channel}'
+
+    def __init__(self):
+        import redis
+
+        self.redis = redis.Redis.from_url(settings.STREAM_REDIS_URL)
+        self._listener = None
+        self._lock = threading.Lock()
+
+    def publish(self, channels, event_type, data):
+        channels = list(channels)
+        event = Event(self.redis.incr(self.sequence_key), event_type, data)
+        payload = json.dumps({'id': event.id, 'type': event.type, 'data': data, 'channels': channels}, cls=DjangoJSONEncoder)
+        pipeline = self.redis.pipeline(transaction=False)
+        for channel in channels:
+            key = self.backlog_key.format(channel=channel)
+            pipeline.rpush(key, payload)
+            pipeline.ltrim(key, -settings.STREAM_BACKLOG, -1)
+            pipeline.expire(key, settings.STREAM_BACKLOG_SECONDS)
+        pipeline.publish(self.topic, payload)
+        pipeline.execute()
+        return event
+
+    def replay(self, channel, after_id):
+        rows = [json.loads(row) for row in self.redis.lrange(self.backlog_key.format(channel=channel), 0, -1)]
+        return [Event(row['id'], row['type'], row['data']) for row in rows if row['id'] > after_id]
+
+    def start(self, hub):
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, args=(hub,), name='stream-listener', daemon=True)
+                self._listener.start()
+
+    def _listen(self, hub):
+        while True:
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.topic)
+                for message in pubsub.listen():
+                    row = json.loads(message['data'])
+                    hub.dispatch(row['channels'], Event(row['id'], row['type'], row['data']))
+            except Exception:
+                logger.exception('Stream listener lost its Redis subscription; retrying.')
+                time.sleep(1)
+
+
+_hub = None
+_broker = None
+_lock = threading.Lock()
+
+
+def get_hub():
+    global _hub
+    with _lock:
+        if _hub is None:
+            _hub = Hub()
+        return _hub
+
+
+def get_broker():
+    global _broker
+    with _lock:
+        if _broker is None:
+            _broker = import_string(settings.STREAM_BROKER)()
+        return _broker
+
+
+def publish(channels, event_type, data):
+    """Push an event to the streams of ``channels`` (profile ids). Failures are logged, never raised."""
+    channels = list(channels)
+    if not channels:
+        return None
+    try:
+        return get_broker().publish(channels, event_type, data)
+    except Exception:
+        logger.exception('Could not publish %s event.', event_type)
+        return None
+
+
+async def stream(channel, last_event_id=None):
+    """Yield SSE frames for ``channel``: the backlog after ``last_event_id``, then live events."""
+    hub = get_hub()
+    broker = get_broker()
+    broker.start(hub)
+    subscription = hub.subscribe(channel)
+    try:
+        yield f'retry: {settings.STREAM_RETRY_MS}\n\n'
+        last = last_event_id
+        if last_event_id is not None:
+            for event in await sync_to_async(broker.replay)(channel, last_event_id):
+                last = event.id
+                yield event.encode()
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), settings.STREAM_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            if event is None:
+                return
+            if last is not None and event.id <= last:
+                continue
+            last = event.id
+            yield event.encode()
+    finally:
+        hub.unsubscribe(subscription)
+
+
+def reset():
+    global _hub, _broker
+    with _lock:
+        _hub, _broker = None, None
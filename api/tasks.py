@@ -1,32 +1,80 @@
 from celery import shared_task
+from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
-import requests
-from .models import Tweet, UserProfile
+from .models import Tweet
 from datetime import timedelta
+from . import ingest, timelines
 
 @shared_task
 def fetch_and_update_tweets():
-    response = requests.get('https://jsonplaceholder.typicode.com/posts')
-    data = response.json()
-    for item in data:
-        user_profile, _ = UserProfile.objects.get_or_create(user_id=item['userId'])
-        Tweet.objects.update_or_create(
-            id=item['id'],
-            defaults={
-                'content': item['body'],
-                'created_at': timezone.now(),
-                'author': user_profile
-            }
-        )
-
-import os
-from django.conf import settings
+    url = settings.TWEET_FEED_URL
+    items, validators = ingest.fetch_feed(url)
+    if items is None:
+        return 0
+    with transaction.atomic():
+        created = ingest.ingest(items)
+        # Remembered only once the items are stored, so a failed run fetches them again.
+        transaction.on_commit(lambda: ingest.save_validators(url, validators))
+        for tweet_id in created:
+            transaction.on_commit(lambda tweet_id=tweet_id: fan_out_tweet.delay(tweet_id))
+    return len(created)
+
+from .archive import TweetArchiver
 
 @shared_task
 def backup_and_delete_old_tweets():
-    backup_period_days = settings.BACKUP_PERIOD_DAYS
-    old_tweets = Tweet.objects.filter(created_at__lt=timezone.now() - timedelta(days=backup_period_days))
-    with open('backup_tweets.txt', 'a') as file:
-        for tweet in old_tweets:
-            file.write(f"{tweet.id}, {tweet.content}\n")
-            tweet.delete()
\ No newline at end of file
+    cutoff = timezone.now() - timedelta(days=settings.BACKUP_PERIOD_DAYS)
+    archiver = TweetArchiver(
+        settings.TWEET_ARCHIVE_DIR,
+        chunk_size=settings.TWEET_ARCHIVE_CHUNK_SIZE,
+        frame_size=settings.TWEET_ARCHIVE_FRAME_SIZE,
+    )
+    return archiver.run(cutoff)
+
+@shared_task
+def fan_out_tweet(tweet_id):
+    tweet = Tweet.objects.filter(pk=tweet_id, is_deleted=False).first()
+    if tweet is None:
+        return 0
+    return timelines.fan_out(tweet)
+
+@shared_task
+def backfill_timeline(follower_id, followed_id):
+    timelines.backfill(follower_id, followed_id)
+
+@shared_task
+def prune_timeline(follower_id, followed_id):
+    timelines.prune(follower_id, followed_id)
+
+@shared_task
+def trim_timelines():
+    return timelines.trim()
+
+from . import notifications
+
+@shared_task
+def deliver_notifications(events):
+    return notifications.deliver(events)
+
+from . import presence
+
+@shared_task
+def flush_presence():
+    """Drain a shared store such as ``RedisPresenceStore``; a local store is flushed by its own process."""
+    return presence.flush()
+
+from . import deletions
+
+@shared_task
+def backfill_deletion_counts(days=None):
+    """Rebuild the daily deletion rollup: all of history, or the last ``days`` days and the days of tweets deleted in them."""
+    if days is None:
+        return deletions.backfill()
+    return deletions.reconcile(deletions.day_of(timezone.now()) - timedelta(days=days - 1))
+
+from . import hashtags
+
+@shared_task
+def prune_hashtag_counts():
+    return hashtags.prune(settings.POPULAR_HASHTAGS_WINDOW_HOURS)
@@ -0,0 +1,37 @@
+from functools import wraps
+
+from .metrics import request_measured
+
+
+def assertMaxQueries(limit):
+    """Fail the decorated test if any request it makes issues more than ``limit`` queries.
+
+    Unlike ``assertNumQueries`` this budgets each request through the test client on its
+    own and ignores the setup around them; the failure names the request and its most
+    repeated SQL, which is usually the N+1.
+    """
+    def decorator(test):
+        @wraps(test)
+        def wrapper(self, *args, **kwargs):
+            measured = []
+
+            def collect(sender, request, metrics, **kw):
+                measured.append((request.method, request.get_full_path(), metrics))
+
+            request_measured.connect(collect, weak=False)
+            try:
+                result = test(self, *args, **kwargs)
+            finally:
+                request_measured.disconnect(collect)
+            over = [
+                f'{method} {path}: {metrics.queries} queries\n' + ''.join(
+                    f'    {count}x {sql}\n' for sql, count, seconds in metrics.repeated(3)
+                )
+                for method, path, metrics in measured if metrics.queries > limit
+            ]
+            if over:
+                self.fail(f'{len(over)} request(s) over the budget of {limit} queries:\n' + ''.join(over))
+            return result
+        wrapper.query_budget = limit
+        return wrapper
+    return decorator
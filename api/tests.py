@@ -1,15 +1,43 @@
-from django.test import TestCase
+from django.db import OperationalError, connection, connections, router
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
 from django.utils import timezone
-from datetime import timedelta
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from django.db.models import Count
 from .views import calculate_deletion_statistics
 from rest_framework.test import APIClient
 from rest_framework import status
 from rest_framework_simplejwt.tokens import RefreshToken
-from .models import UserProfile, Tweet, Hashtag, Follow, Notification, Like, Retweet
+from .models import UserProfile, Tweet, Hashtag, Follow, Notification, Like, Retweet, TimelineEntry, HashtagCount, DeletionCount, thread_place
 from unittest.mock import patch
-from .tasks import fetch_and_update_tweets, backup_and_delete_old_tweets
+from .tasks import fetch_and_update_tweets, backup_and_delete_old_tweets, backfill_deletion_counts, trim_timelines, prune_hashtag_counts
+from .archive import ArchiveReader, TweetArchiver, iter_archive, restore
+from .trending import CountMinSketch, SpaceSaving, TrendingEngine
+from .hashtags import tagged_buckets
+from .renderers import ORJSONRenderer
+from .serializers import NotificationSerializer, TweetSerializer, notification_reader, tweet_reader
+from rest_framework.renderers import JSONRenderer
+from django.utils.translation import gettext_lazy
+from . import authentication, deletions, engagement, entities, ingest, metrics, notifications, presence, query_plans, replicas, streams, threads, trending
+from .testing import assertMaxQueries
+from asgiref.sync import sync_to_async
+import asyncio
+from pathlib import Path
+from tempfile import TemporaryDirectory
 from django.conf import settings
+from django.core.cache import cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import sqlite3
+import threading
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from io import StringIO
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
 class UserAuthenticationTestCase(TestCase):
     def setUp(self):
@@ -18,6 +46,7 @@ class UserAuthenticationTestCase(TestCase):
         refresh = RefreshToken.for_user(self.user)
         self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {refresh.access_token}')
 
+    @assertMaxQueries(2)
     def test_registration(self):
         response = self.client.post('/auth/register/', {
             'username': 'newuser',  
@@ -26,6 +55,7 @@ class UserAuthenticationTestCase(TestCase):
         })
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
+    @assertMaxQueries(3)
     def test_login(self):
         response = self.client.post('/auth/token/', {
             'username': 'testuser',  
@@ -37,6 +67,8 @@ class UserAuthenticationTestCase(TestCase):
 class ActiveUsersTestCase(UserAuthenticationTestCase):
     def setUp(self):
         super().setUp()
+        presence.reset()
+        self.addCleanup(presence.reset)
         self.user1 = User.objects.create_user('user1', 'user1@example.com', 'password123')
         self.user1.last_login = timezone.now() - timedelta(days=1)
         self.user1.save()
@@ -49,6 +81,7 @@ class ActiveUsersTestCase(UserAuthenticationTestCase):
         self.user3.last_login = timezone.now() - timedelta(hours=1)
         self.user3.save()
 
+    @assertMaxQueries(2)
     def test_active_users_endpoint(self):
         response = self.client.get('/api/active-users/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -56,6 +89,106 @@ class ActiveUsersTestCase(UserAuthenticationTestCase):
         actual_usernames = [user['username'] for user in response.data]
         self.assertEqual(actual_usernames, expected_usernames)
 
+    @assertMaxQueries(2)
+    def test_limit_and_window(self):
+        self.assertEqual([user['username'] for user in self.client.get('/active-users/?limit=2').data], ['user3', 'user1'])
+        self.assertEqual([user['username'] for user in self.client.get('/active-users/?hours=30').data], ['user3', 'user1'])
+
+    @assertMaxQueries(2)
+    def test_login_is_tracked_in_memory_and_flushed_in_batches(self):
+        self.client.get('/active-users/')
+        response = self.client.post('/auth/token/', {'username': 'user2', 'password': 'password123'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(0):
+            usernames = [user['username'] for user in self.client.get('/active-users/').data]
+        self.assertEqual(usernames, ['user2', 'user3', 'user1'])
+        self.user2.refresh_from_db()
+        self.assertLess(self.user2.last_login, timezone.now() - timedelta(days=1))
+
+        presence.record(self.user1)
+        with self.assertNumQueries(1):
+            self.assertEqual(presence.flush(), 2)
+        self.user2.refresh_from_db()
+        self.assertGreater(self.user2.last_login, timezone.now() - timedelta(minutes=1))
+        self.assertEqual(presence.flush(), 0)
+
+    def test_failed_flush_keeps_the_unwritten_logins(self):
+        presence.record(self.user1)
+        presence.record(self.user2)
+        with patch('django.db.models.query.QuerySet.update', side_effect=[1, OperationalError('database is locked')]):
+            with self.assertRaises(OperationalError):
+                presence.flush(batch_size=1)
+        self.assertEqual(presence.flush(), 1)
+        self.user2.refresh_from_db()
+        self.assertGreater(self.user2.last_login, timezone.now() - timedelta(minutes=1))
+
+    def test_local_store_reloads_logins_flushed_by_other_processes(self):
+        self.assertEqual(presence.active_users(10, timezone.now() - timedelta(days=3))[0][1], 'user3')
+        # Another worker flushes a login this process never saw.
+        User.objects.filter(pk=self.user2.pk).update(last_login=timezone.now())
+        self.assertEqual(presence.active_users(10, timezone.now() - timedelta(days=3))[0][1], 'user3')
+        with override_settings(PRESENCE_FLUSH_SECONDS=0), self.assertNumQueries(1):
+            users = presence.active_users(10, timezone.now() - timedelta(days=3))
+        self.assertEqual([row[1] for row in users], ['user2', 'user3', 'user1'])
+
+    def test_local_store_is_flushed_by_its_own_process(self):
+        with override_settings(PRESENCE_FLUSH_THREAD=True), patch.object(presence, '_start_flusher') as start:
+            presence.get_store()
+        start.assert_called_once_with()
+
+@override_settings(AUTH_TRUST_TOKEN_CLAIMS=False)
+class CachedAuthenticationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='cached', password='secret')
+        self.profile = UserProfile.objects.create(user=self.user, bio='bio')
+        response = self.client.post('/auth/token/', {'username': 'cached', 'password': 'secret'})
+        self.token = response.data['access']
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+    @assertMaxQueries(2)
+    def test_user_and_profile_are_served_from_cache(self):
+        self.client.get('/notifications/unread/')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/notifications/unread/').status_code, status.HTTP_200_OK)
+
+    @assertMaxQueries(1)
+    def test_changes_invalidate_the_cache(self):
+        self.client.get('/auth/profile/')
+        self.profile.bio = 'updated'
+        self.profile.save()
+        self.assertEqual(self.client.get('/auth/profile/').data['bio'], 'updated')
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/auth/profile/').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @assertMaxQueries(1)
+    def test_password_change_revokes_issued_tokens(self):
+        self.client.get('/auth/profile/')
+        self.user.set_password('changed')
+        self.user.save()
+        self.assertEqual(self.client.get('/auth/profile/').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_revoked_tokens_cannot_open_the_stream(self):
+        self.user.set_password('changed')
+        self.user.save()
+        self.assertEqual(self.client.get('/stream/', {'access_token': self.token}).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_trusted_claims_load_profile_fields_on_access(self):
+        cache.clear()
+        authentication.users.clear()
+        with override_settings(AUTH_TRUST_TOKEN_CLAIMS=True):
+            self.assertEqual(self.client.get('/auth/profile/').data, {'username': 'cached', 'bio': 'bio'})
+
+    @assertMaxQueries(2)
+    def test_trusted_claims_skip_the_database(self):
+        self.client.get('/notifications/unread/')
+        authentication.users.clear()
+        with override_settings(AUTH_TRUST_TOKEN_CLAIMS=True), self.assertNumQueries(0):
+            response = self.client.get('/notifications/unread/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
 class TweetTestCase(UserAuthenticationTestCase):
     def setUp(self):
         super().setUp()
@@ -76,6 +209,688 @@ class TweetTestCase(UserAuthenticationTestCase):
         expected_stats = {'Spam': 2, 'Inappropriate': 1}
         self.assertEqual(stats, expected_stats)
 
+class PopularHashtagsTestCase(UserAuthenticationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user_profile = UserProfile.objects.create(user=self.user, bio="Test bio")
+        self.python = Hashtag.objects.create(tag="python")
+        self.django = Hashtag.objects.create(tag="django")
+        self.tweets = [Tweet.objects.create(content=f"Tweet {i}", author=self.user_profile) for i in range(3)]
+        for tweet in self.tweets:
+            tweet.hashtags.add(self.python)
+        self.django.tweets.add(self.tweets[0])
+
+    @assertMaxQueries(2)
+    def test_popular_hashtags_reads_hourly_rollup(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/tweets/popular_hashtags/')
+        self.assertEqual(response.data, [{'hashtag': 'python', 'count': 3}, {'hashtag': 'django', 'count': 1}])
+
+    @assertMaxQueries(2)
+    def test_soft_delete_and_removal_decrement_counts(self):
+        self.tweets[0].mark_as_deleted("Spam")
+        self.tweets[1].hashtags.remove(self.python)
+        response = self.client.get('/tweets/popular_hashtags/')
+        self.assertEqual(response.data, [{'hashtag': 'python', 'count': 1}])
+
+    @assertMaxQueries(2)
+    def test_hard_delete_and_archive_decrement_counts(self):
+        reply = Tweet.objects.create(content="Reply", author=self.user_profile, parent_tweet=self.tweets[1])
+        reply.hashtags.add(self.python)
+        self.assertEqual(self.client.get('/tweets/popular_hashtags/').json()[0], {'hashtag': 'python', 'count': 4})
+        self.tweets[1].delete()
+        response = self.client.get('/tweets/popular_hashtags/')
+        self.assertEqual(response.json(), [{'hashtag': 'python', 'count': 2}, {'hashtag': 'django', 'count': 1}])
+
+        old = Tweet.objects.create(content="Old", author=self.user_profile)
+        Tweet.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=60))
+        old.refresh_from_db()
+        old.hashtags.add(self.python)
+        rollup = HashtagCount.objects.get(hashtag=self.python, bucket__lt=timezone.now() - timedelta(days=59))
+        self.assertEqual(rollup.count, 1)
+        with TemporaryDirectory() as directory:
+            TweetArchiver(directory).run(timezone.now() - timedelta(days=30))
+        rollup.refresh_from_db()
+        self.assertEqual(rollup.count, 0)
+
+    def test_old_buckets_are_pruned(self):
+        HashtagCount.objects.create(hashtag=self.django, bucket=timezone.now() - timedelta(hours=settings.POPULAR_HASHTAGS_WINDOW_HOURS + 1), count=10)
+        HashtagCount.objects.create(hashtag=self.django, bucket=timezone.now() - timedelta(hours=settings.POPULAR_HASHTAGS_WINDOW_HOURS - 2), count=10)
+        self.assertEqual(prune_hashtag_counts.apply().get(), 1)
+        self.assertEqual(self.client.get('/tweets/popular_hashtags/').json()[0], {'hashtag': 'django', 'count': 11})
+
+    @assertMaxQueries(2)
+    def test_window_and_limit(self):
+        HashtagCount.objects.create(hashtag=self.django, bucket=timezone.now() - timedelta(days=3), count=10)
+        self.assertEqual(self.client.get('/tweets/popular_hashtags/?limit=1').data, [{'hashtag': 'django', 'count': 11}])
+        self.assertEqual(self.client.get('/tweets/popular_hashtags/?hours=24&limit=1').data, [{'hashtag': 'python', 'count': 3}])
+
+class TrendingTestCase(UserAuthenticationTestCase):
+    def setUp(self):
+        super().setUp()
+        trending.reset()
+        self.addCleanup(trending.reset)
+        self.engine = TrendingEngine(bucket_seconds=60, window_buckets=5, half_life_buckets=10, width=1024, depth=4, capacity=16)
+
+    def test_count_min_sketch_never_undercounts(self):
+        sketch = CountMinSketch(width=256, depth=4)
+        keys = list(range(1, 2001)) + [7] * 500
+        sketch.add(keys)
+        estimates = sketch.query([7, 1999])
+        self.assertGreaterEqual(estimates[0], 501)
+        self.assertGreaterEqual(estimates[1], 1)
+        self.assertLess(estimates[0], 501 + 2 * 2000 / 256 * 4)
+
+    def test_space_saving_keeps_heavy_hitters(self):
+        summary = SpaceSaving(capacity=8)
+        for key in list(range(100, 200)) + [1] * 50 + [2] * 30:
+            summary.add(key)
+        top = sorted(summary.items(), key=lambda item: item[1], reverse=True)
+        self.assertEqual([key for key, _, _ in top[:2]], [1, 2])
+
+    def test_velocity_ranks_spikes_over_steady_volume(self):
+        for minute in range(30):
+            self.engine.record([1] * 20 + ([2] if minute < 29 else [2] * 15), now=minute * 60)
+        ranked = self.engine.top(limit=2, now=29 * 60)
+        self.assertEqual([row[0] for row in ranked], [2, 1])
+        self.assertGreater(ranked[0][3], ranked[1][3])
+
+    def test_merge_and_checkpoint_round_trip(self):
+        other = TrendingEngine(bucket_seconds=60, window_buckets=5, half_life_buckets=10, width=1024, depth=4, capacity=16)
+        self.engine.record([1, 1, 2], now=0)
+        other.record([1, 3], now=30)
+        self.engine.merge(other, now=30)
+        self.assertEqual({row[0]: row[1] for row in self.engine.top(now=30)}, {1: 3, 2: 1, 3: 1})
+        with TemporaryDirectory() as directory:
+            path = Path(directory) / 'engine.npz'
+            self.engine.save(path)
+            loaded = TrendingEngine.load(path)
+        self.assertEqual(loaded.top(now=30), self.engine.top(now=30))
+
+    def test_restarted_processes_adopt_stale_checkpoints(self):
+        with TemporaryDirectory() as directory, override_settings(TRENDING_CHECKPOINT_DIR=directory):
+            directory = Path(directory)
+            for name, key in (('exited.npz', 1), (trending.checkpoint_path().name, 2), ('live.npz', 3)):
+                worker = trending._new_engine()
+                worker.record([key] * 2)
+                worker.save(directory / name)
+            os.utime(directory / 'exited.npz', (0, 0))
+            trending.record([4])
+            self.assertEqual(sorted(path.name for path in directory.iterdir()), sorted([trending.checkpoint_path().name, 'live.npz']))
+            adopted = TrendingEngine.load(trending.checkpoint_path())
+            self.assertEqual({row[0]: row[1] for row in adopted.top()}, {1: 2, 2: 2})
+            self.assertEqual({row[0]: row[1] for row in trending.get_engine().top()}, {1: 2, 2: 2, 4: 1})
+
+    @assertMaxQueries(2)
+    def test_trending_endpoint_merges_checkpoints(self):
+        profile = UserProfile.objects.create(user=self.user)
+        python = Hashtag.objects.create(tag='python')
+        django = Hashtag.objects.create(tag='django')
+        for _ in range(3):
+            Tweet.objects.create(content='Tweet', author=profile).hashtags.add(python)
+        Tweet.objects.create(content='Tweet', author=profile, is_deleted=True).hashtags.add(python)
+        with TemporaryDirectory() as directory, override_settings(TRENDING_CHECKPOINT_DIR=directory):
+            worker = trending._new_engine()
+            worker.record([django.pk] * 5)
+            worker.save(Path(directory) / 'worker-1.npz')
+            response = self.client.get('/tweets/trending_hashtags/')
+        self.assertEqual([(row['hashtag'], row['count']) for row in response.data], [('django', 5), ('python', 3)])
+
+class EntityExtractionTestCase(UserAuthenticationTestCase):
+    def setUp(self):
+        super().setUp()
+        entities.tag_ids.clear()
+        self.addCleanup(entities.tag_ids.clear)
+        self.profile = UserProfile.objects.create(user=self.user)
+        self.others = [UserProfile.objects.create(user=User.objects.create_user(username=f'user{i}', password='pass')) for i in range(5)]
+
+    def post(self, content):
+        return self.client.post('/tweets/', {'content': content, 'author': self.profile.pk})
+
+    def test_extract(self):
+        self.assertEqual(
+            entities.extract('#Django and #django, not a#b or &#39; but #new_tag. cc @user1 @user2. mail@user3.com'),
+            (['django', 'new_tag'], ['user1', 'user2']),
+        )
+
+    @assertMaxQueries(11)
+    def test_hashtags_and_mentions_use_constant_queries(self):
+        def queries(content):
+            with CaptureQueriesContext(connection) as context, self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(self.post(content).status_code, status.HTTP_201_CREATED)
+            return len(context)
+
+        self.post('warm up the authentication cache')
+        one = queries('#a0 @user0')
+        many = queries(' '.join(f'#b{i} @user{i}' for i in range(5)))
+        self.assertEqual(one, many)
+        self.assertLess(queries(' '.join(f'#b{i} @user{i}' for i in range(5))), many)
+
+        tweet = Tweet.objects.latest('id')
+        self.assertEqual(sorted(tweet.hashtags.values_list('tag', flat=True)), [f'b{i}' for i in range(5)])
+        self.assertEqual(Notification.objects.filter(recipient=self.others[3]).count(), 2)
+        self.assertEqual(Notification.objects.filter(recipient=self.others[3]).first().message, 'testuser mentioned you in a tweet.')
+        self.assertEqual(HashtagCount.objects.get(hashtag__tag='b0').count, 2)
+
+    @assertMaxQueries(12)
+    def test_self_mentions_and_unknown_users_are_ignored(self):
+        self.post('@testuser @nobody #solo')
+        self.assertFalse(Notification.objects.exists())
+        self.assertEqual(HashtagCount.objects.get(hashtag__tag='solo').count, 1)
+
+    @assertMaxQueries(6)
+    def test_client_cannot_link_hashtags(self):
+        hashtag = Hashtag.objects.create(tag='forged')
+        self.client.post('/tweets/', {'content': 'plain', 'author': self.profile.pk, 'hashtags': [hashtag.pk]})
+        self.assertFalse(Tweet.objects.get(content='plain').hashtags.exists())
+
+    @assertMaxQueries(11)
+    def test_deleted_hashtag_is_evicted_from_cache(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post('#gone')
+        self.assertIn('gone', entities.tag_ids)
+        Hashtag.objects.get(tag='gone').delete()
+        self.assertNotIn('gone', entities.tag_ids)
+        self.post('#gone')
+        self.assertTrue(Hashtag.objects.filter(tag='gone').exists())
+
+class SearchTestCase(UserAuthenticationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.profile = UserProfile.objects.create(user=self.user)
+        self.other = UserProfile.objects.create(user=User.objects.create_user(username='other', password='pass'))
+
+    def tweet(self, content, author=None, **kwargs):
+        return Tweet.objects.create(content=content, author=author or self.profile, **kwargs)
+
+    def ids(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [tweet['id'] for tweet in response.data['results']]
+
+    @assertMaxQueries(4)
+    def test_results_are_ranked_by_bm25(self):
+        weak = self.tweet('a long tweet that mentions django once among many other words here')
+        strong = self.tweet('django django django')
+        self.tweet('nothing relevant')
+        self.assertEqual(self.ids('/search/?q=Django'), [strong.id, weak.id])
+        self.assertEqual(self.ids('/search/?q=djan*'), [strong.id, weak.id])
+
+    @assertMaxQueries(3)
+    def test_index_follows_edits_deletes_and_bulk_writes(self):
+        tweet = self.tweet('original words')
+        tweet.content = 'edited words'
+        tweet.save()
+        self.assertEqual(self.ids('/search/?q=original'), [])
+        self.assertEqual(self.ids('/search/?q=edited'), [tweet.id])
+        reply = self.tweet('edited reply', parent_tweet=tweet)
+        tweet.mark_as_deleted('Spam')
+        self.assertEqual(self.ids('/search/?q=edited'), [])
+        Tweet.objects.filter(pk__in=[tweet.pk, reply.pk]).update(is_deleted=False)
+        self.assertEqual(sorted(self.ids('/search/?q=edited')), [tweet.id, reply.id])
+        bulk = Tweet.objects.bulk_create([Tweet(content='bulk insert', author=self.profile)])
+        self.assertEqual(self.ids('/search/?q=bulk'), [bulk[0].id])
+        Tweet.objects.filter(pk=reply.pk).delete()
+        self.assertEqual(self.ids('/search/?q=reply'), [])
+
+    @assertMaxQueries(5)
+    def test_filters(self):
+        mine = self.tweet('#python tips')
+        mine.hashtags.add(Hashtag.objects.create(tag='python'))
+        theirs = self.tweet('python tips', author=self.other)
+        old = self.tweet('python tips')
+        Tweet.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=10))
+        self.assertEqual(self.ids('/search/?q=python&author=other'), [theirs.id])
+        self.assertEqual(self.ids('/search/?q=python&hashtag=%23Python'), [mine.id])
+        since = (timezone.now() - timedelta(days=1)).date().isoformat()
+        self.assertEqual(sorted(self.ids(f'/search/?q=python&since={since}')), [mine.id, theirs.id])
+        self.assertEqual(self.ids(f'/search/?q=python&until={since}'), [old.id])
+        self.assertEqual(self.client.get('/search/?q=python&since=yesterday').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get('/search/?q=%22%28').status_code, status.HTTP_400_BAD_REQUEST)
+
+    @assertMaxQueries(4)
+    def test_cursor_pagination(self):
+        tweets = [self.tweet(' '.join(['match'] * (i + 1) + ['filler'] * 5)) for i in range(5)]
+        expected = [tweet.id for tweet in reversed(tweets)]
+        response = self.client.get('/search/?q=match&page_size=2')
+        seen = [tweet['id'] for tweet in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            seen += [tweet['id'] for tweet in response.data['results']]
+        self.assertEqual(seen, expected)
+        previous = self.client.get(response.data['previous'])
+        self.assertEqual([tweet['id'] for tweet in previous.data['results']], expected[2:4])
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('benchmark_search', tweets=200, vocabulary=100, repeat=2, scan_repeat=2, cleanup=True, stdout=out)
+        self.assertIn('common term', out.getvalue())
+        self.assertFalse(User.objects.filter(username='search-bench').exists())
+
+class ReadSerializerTestCase(UserAuthenticationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.profile = UserProfile.objects.create(user=self.user, bio='Test bio')
+        tags = [Hashtag.objects.create(tag=f'tag{index}') for index in range(3)]
+        self.tweets = [Tweet.objects.create(content=f'Tweet {index}', author=self.profile) for index in range(5)]
+        for index, tweet in enumerate(self.tweets):
+            tweet.hashtags.add(*tags[:index % 4])
+        Notification.objects.create(recipient=self.profile, sender=self.profile, verb='follow', message='Hi')
+
+    def test_matches_model_serializers(self):
+        tweets = list(Tweet.objects.order_by('pk'))
+        with self.assertNumQueries(1):
+            rows = tweet_reader(tweets)
+        expected = TweetSerializer(tweets, many=True).data
+        self.assertEqual(json.loads(ORJSONRenderer().render(rows)), json.loads(JSONRenderer().render(expected)))
+        self.assertEqual([list(row) for row in rows], [list(row) for row in expected])
+        prefetched = list(Tweet.objects.prefetch_related('hashtags').order_by('pk'))
+        with self.assertNumQueries(0):
+            self.assertEqual(tweet_reader(prefetched), rows)
+        notifications_ = list(Notification.objects.all())
+        self.assertEqual(notification_reader(notifications_), NotificationSerializer(notifications_, many=True).data)
+        self.assertEqual(tweet_reader([]), [])
+
+    def test_renderer_matches_json_renderer(self):
+        data = {'at': timezone.now(), 'text': 'caf\u00e9', 'lazy': gettext_lazy('Not found.'), 'nested': [1, 2.5, None, True]}
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+
+    @assertMaxQueries(3)
+    def test_tweet_list_avoids_a_query_per_tweet(self):
+        self.client.get('/tweets/')
+        with CaptureQueriesContext(connection) as few:
+            response = self.client.get('/tweets/')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(sorted(len(row['hashtags']) for row in response.json()['results']), [0, 0, 1, 2, 3])
+        for index in range(20):
+            Tweet.objects.create(content=f'More {index}', author=self.profile).hashtags.add(Hashtag.objects.get(tag='tag0'))
+        with CaptureQueriesContext(connection) as many:
+            self.client.get('/tweets/')
+        self.assertEqual(len(few), len(many))
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('benchmark_serializers', tweets=20, repeat=1, stdout=out)
+        self.assertIn('compiled', out.getvalue())
+        self.assertFalse(User.objects.filter(username='serializer-bench').exists())
+
+class ResponseCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='reader', password='secret')
+        self.profile = UserProfile.objects.create(user=self.user, bio='bio')
+        self.tweet = Tweet.objects.create(content='Cached #news', author=self.profile)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    @assertMaxQueries(2)
+    def test_detail_is_served_from_cache_with_etag(self):
+        url = f'/tweets/{self.tweet.id}/'
+        first = self.client.get(url)
+        with self.assertNumQueries(0):
+            second = self.client.get(url)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='"stale"').status_code, status.HTTP_200_OK)
+
+    @assertMaxQueries(6)
+    def test_engagement_invalidates_tweet(self):
+        url = f'/tweets/{self.tweet.id}/'
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/like/{self.tweet.id}/')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['like_count'], 1)
+
+    @assertMaxQueries(1)
+    def test_profiles_are_per_user_and_invalidated(self):
+        other = User.objects.create_user(username='other', password='secret')
+        UserProfile.objects.create(user=other, bio='other bio')
+        self.assertEqual(self.client.get('/auth/profile/').json()['bio'], 'bio')
+        self.client.force_authenticate(user=other)
+        self.assertEqual(self.client.get('/auth/profile/').json()['bio'], 'other bio')
+        self.client.get(f'/users/{self.profile.id}/')
+        self.profile.bio = 'changed'
+        self.profile.save()
+        self.assertEqual(self.client.get(f'/users/{self.profile.id}/').json()['bio'], 'changed')
+        self.client.force_authenticate(user=self.user)
+        self.assertEqual(self.client.get('/auth/profile/').json()['bio'], 'changed')
+
+    @assertMaxQueries(1)
+    def test_popular_hashtags_follow_new_tweets(self):
+        self.assertEqual(self.client.get('/tweets/popular_hashtags/').json(), [])
+        tweet = Tweet.objects.create(content='More #news', author=self.profile)
+        tweet.hashtags.add(Hashtag.objects.create(tag='news'))
+        self.assertEqual(self.client.get('/tweets/popular_hashtags/').json(), [{'hashtag': 'news', 'count': 1}])
+
+    @assertMaxQueries(1)
+    def test_tweet_edits_keep_popular_hashtags_cached(self):
+        self.client.get('/tweets/popular_hashtags/')
+        self.tweet.content = 'Edited'
+        self.tweet.save()
+        Tweet.objects.create(content='Untagged', author=self.profile)
+        with self.assertNumQueries(0):
+            self.client.get('/tweets/popular_hashtags/')
+
+    def test_ingested_updates_invalidate_tweet(self):
+        url = f'/tweets/{self.tweet.id}/'
+        self.client.get(url)
+        ingest.ingest([{'userId': self.user.id, 'id': self.tweet.id, 'body': 'Rewritten'}])
+        self.assertEqual(self.client.get(url).json()['content'], 'Rewritten')
+
+    @override_settings(RESPONSE_CACHE_TIMEOUT=0)
+    @assertMaxQueries(2)
+    def test_disabled(self):
+        response = self.client.get(f'/tweets/{self.tweet.id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.has_header('ETag'))
+
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.registry.clear()
+        self.user = User.objects.create_user(username='measured', password='secret')
+        self.profile = UserProfile.objects.create(user=self.user, bio='bio')
+        self.tweets = [Tweet.objects.create(content=f'Tweet {index}', author=self.profile) for index in range(3)]
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_server_timing_header(self):
+        response = self.client.get('/tweets/')
+        timings = dict(part.strip().split(';', 1) for part in response['Server-Timing'].split(','))
+        self.assertEqual(set(timings), {'db', 'serialize', 'total'})
+        self.assertRegex(timings['db'], r'^dur=[\d.]+;desc="[1-9]\d* queries"$')
+        with override_settings(REQUEST_METRICS_ENABLED=False):
+            self.assertNotIn('Server-Timing', self.client.get('/tweets/'))
+
+    def test_fingerprint_folds_literals_and_in_lists(self):
+        self.assertEqual(
+            metrics.fingerprint("SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = 'x''y' LIMIT 21"),
+            metrics.fingerprint('SELECT *  FROM t WHERE id IN (%s, %s) AND name = \'z\' LIMIT 1'),
+        )
+        self.assertEqual(metrics.fingerprint('SAVEPOINT "s1_x2"'), 'SAVEPOINT ?')
+
+    def test_slow_requests_are_logged_with_repeated_sql(self):
+        def per_tweet(request):
+            for tweet in self.tweets:
+                Tweet.objects.filter(pk=tweet.pk).exists()
+            return HttpResponse()
+        request = RequestFactory().get('/slow/')
+        with override_settings(REQUEST_SLOW_MS=0), self.assertLogs('api.metrics', 'WARNING') as logs:
+            metrics.RequestMetricsMiddleware(per_tweet)(request)
+        entry = json.loads(logs.records[0].getMessage().split(' ', 1)[1])
+        self.assertEqual((entry['path'], entry['queries']), ('/slow/', 3))
+        self.assertEqual(entry['repeated_sql'][0]['count'], 3)
+
+    def test_prometheus_endpoint(self):
+        self.client.get('/tweets/')
+        self.client.get('/tweets/')
+        body = self.client.get('/metrics').content.decode()
+        self.assertIn('api_requests_total{method="GET",view="tweet-list",status="200"} 2', body)
+        self.assertIn('api_request_duration_seconds_count{view="tweet-list"} 2', body)
+        self.assertIn('# TYPE api_request_duration_seconds histogram', body)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_query_budget(self):
+        @assertMaxQueries(0)
+        def over(case):
+            case.client.get('/tweets/')
+        with self.assertRaisesRegex(AssertionError, r'GET /tweets/: \d+ queries'):
+            over(self)
+
+class ReplicaRoutingTestCase(TestCase):
+    def setUp(self):
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name)
+        for alias, name in (('replica_a', self.path / 'a.sqlite3'), ('replica_b', self.path / 'b.sqlite3'), ('replica_down', self.path / 'missing' / 'c.sqlite3')):
+            connections.settings[alias] = connections.configure_settings({**connections.settings, alias: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': str(name)}})[alias]
+            self.addCleanup(self._remove_database, alias)
+        replicas.pool.clear()
+        self.addCleanup(replicas.pool.clear)
+        # Tests run inside a transaction, which keeps reads on the primary.
+        patcher = patch.object(replicas, '_in_transaction', return_value=False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _remove_database(self, alias):
+        connections[alias].close()
+        del connections[alias]
+        del connections.settings[alias]
+
+    def _request(self, view, method='GET', cookies=None):
+        request = RequestFactory().generic(method, '/')
+        request.COOKIES.update(cookies or {})
+        return replicas.ReplicaRoutingMiddleware(view)(request)
+
+    def _reads(self, count, **kwargs):
+        seen = []
+
+        def view(request):
+            seen.extend(router.db_for_read(Hashtag) for _ in range(count))
+            return HttpResponse()
+        self._request(view, **kwargs)
+        return seen
+
+    def test_reads_rotate_over_healthy_replicas(self):
+        with override_settings(DATABASE_REPLICAS=['replica_a', 'replica_down', 'replica_b']), self.assertLogs('api.replicas', 'WARNING'):
+            self.assertEqual(sorted(self._reads(4)), ['replica_a', 'replica_a', 'replica_b', 'replica_b'])
+        with override_settings(DATABASE_REPLICAS=['replica_down']):
+            self.assertEqual(self._reads(1), ['default'])
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.assertEqual(self._reads(1), ['default'])
+        self.assertEqual(router.db_for_read(Hashtag), 'default')
+
+    def test_queries_run_on_the_replica_and_fail_over(self):
+        schema = connection.cursor().execute("SELECT sql FROM sqlite_master WHERE name = 'api_hashtag'").fetchone()[0]
+        with sqlite3.connect(self.path / 'a.sqlite3') as replica:
+            replica.execute(schema)
+            replica.execute("INSERT INTO api_hashtag (tag) VALUES ('replica-only')")
+        found = []
+
+        def view(request):
+            found.append(Hashtag.objects.filter(tag='replica-only').exists())
+            found.append(Tweet.objects.exists())
+            found.append(Hashtag.objects.filter(tag='replica-only').exists())
+            return HttpResponse()
+        with override_settings(DATABASE_REPLICAS=['replica_a']), self.assertLogs('api.replicas', 'WARNING'):
+            self._request(view)
+        self.assertEqual(found, [True, False, False])
+
+    def test_failed_replica_reads_are_retried_on_the_primary(self):
+        # Nothing is written: a write held by the test transaction blocks the backup in test_sync_sqlite_replicas.
+        client = APIClient()
+        client.force_authenticate(User(pk=1, username='reader'))
+        # replica_a has no tables, so every query sent to it fails.
+        with override_settings(DATABASE_REPLICAS=['replica_a']), self.assertLogs('api.replicas', 'WARNING') as logs:
+            response = client.get('/tweets/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['results'], [])
+        self.assertIn('retrying it on the primary', logs.output[0])
+        self.assertFalse(replicas.pool.is_healthy('replica_a'))
+
+    def test_writes_pin_reads_to_the_primary(self):
+        with override_settings(DATABASE_REPLICAS=['replica_a']):
+            def write_then_read(request):
+                self.assertEqual(router.db_for_read(Hashtag), 'replica_a')
+                Hashtag.objects.create(tag='fresh')
+                self.assertEqual(router.db_for_read(Hashtag), 'default')
+                return HttpResponse()
+            response = self._request(write_then_read)
+            pin = response.cookies[settings.REPLICA_PIN_COOKIE]
+            self.assertEqual(pin['max-age'], settings.REPLICA_PIN_SECONDS)
+            self.assertEqual(self._reads(1, cookies={settings.REPLICA_PIN_COOKIE: pin.value}), ['default'])
+            self.assertEqual(self._reads(1, method='POST'), ['default'])
+            self.assertNotIn(settings.REPLICA_PIN_COOKIE, self._request(lambda request: HttpResponse()).cookies)
+
+    def test_async_requests_are_routed(self):
+        seen = []
+
+        async def view(request):
+            seen.append(replicas._routing.get().replicas)
+            return HttpResponse()
+        middleware = replicas.ReplicaRoutingMiddleware(view)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        with override_settings(DATABASE_REPLICAS=['replica_a']):
+            asyncio.run(middleware(RequestFactory().get('/')))
+            asyncio.run(middleware(RequestFactory().post('/')))
+        self.assertEqual(seen, [True, False])
+        self.assertIsNone(replicas._routing.get())
+
+    def test_sync_sqlite_replicas(self):
+        with override_settings(DATABASE_REPLICAS=['replica_a', 'replica_b']):
+            call_command('sync_sqlite_replicas', 'replica_b', stdout=StringIO())
+            with self.assertRaises(CommandError):
+                call_command('sync_sqlite_replicas', 'default', stdout=StringIO())
+        with sqlite3.connect(self.path / 'b.sqlite3') as replica:
+            self.assertTrue(replica.execute("SELECT 1 FROM sqlite_master WHERE name = 'api_tweet'").fetchone())
+        self.assertFalse((self.path / 'a.sqlite3').exists())
+
+class QueryPlanTestCase(TestCase):
+    def test_hot_queries_use_indexes(self):
+        call_command('generate_social_graph', users=30, tweets=300, hashtags=20, batch_size=100, stdout=StringIO())
+        report = query_plans.check()
+        self.assertEqual(set(report), set(query_plans.HOT_PATHS))
+        self.assertTrue(all(report.values()))
+        scans = {name: [found for _, _, found in statements if found] for name, statements in report.items()}
+        self.assertEqual(scans, {name: [] for name in report})
+        out = StringIO()
+        call_command('explain_hot_queries', 'deletion_statistics', verbosity=2, stdout=out)
+        self.assertIn('tweet_deleted_idx', out.getvalue())
+
+    def test_full_scans_are_detected(self):
+        sql = 'SELECT id FROM api_tweet WHERE content = %s'
+        self.assertEqual(len(query_plans.full_scans(sql, query_plans.explain(sql, ['x']))), 1)
+        sql = 'WITH RECURSIVE n(i) AS (SELECT 1 UNION SELECT i + 1 FROM n m WHERE i < 3) SELECT i FROM n'
+        self.assertEqual(query_plans.full_scans(sql, query_plans.explain(sql, [])), [])
+        with self.assertRaises(CommandError):
+            call_command('explain_hot_queries', stdout=StringIO())
+
+class DeletionRollupTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='moderator', password='secret', is_staff=True)
+        self.profile = UserProfile.objects.create(user=self.user, bio='bio')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.start = datetime(2026, 3, 1, tzinfo=dt_timezone.utc)
+        self.tweets = []
+        for index in range(12):
+            tweet = Tweet.objects.create(content=f'Tweet {index}', author=self.profile, parent_tweet=self.tweets[-1] if index % 3 else None)
+            Tweet.objects.filter(pk=tweet.pk).update(created_at=self.start + timedelta(hours=9 * index))
+            self.tweets.append(tweet)
+        for tweet in self.tweets:
+            tweet.refresh_from_db()
+
+    def live(self, since, until):
+        rows = Tweet.objects.filter(is_deleted=True, created_at__range=[since, until]).values('delete_reason')
+        return {row['delete_reason']: row['n'] for row in rows.annotate(n=Count('pk'))}
+
+    def rollup(self):
+        return {(row.day, row.delete_reason): row.count for row in DeletionCount.objects.filter(count__gt=0)}
+
+    def test_rollup_follows_deletions(self):
+        self.tweets[2].mark_as_deleted('Spam')
+        self.tweets[0].mark_as_deleted('Abuse')
+        self.tweets[10].mark_as_deleted('')
+        Tweet.objects.create(content='Born deleted', author=self.profile, is_deleted=True, delete_reason='Import')
+        self.tweets[5].delete()
+        self.assertEqual(self.rollup(), dict(deletions.deleted_days(Tweet.objects.all())))
+        self.assertEqual(self.rollup()[(date(2026, 3, 1), 'Parent tweet deleted')], 2)
+
+        end = self.start + timedelta(days=5)
+        for since, until in [
+            (self.start, end), (self.start + timedelta(hours=7), end - timedelta(minutes=1)),
+            (self.start + timedelta(hours=20), self.start + timedelta(hours=30)), (self.start + timedelta(days=1), self.start + timedelta(days=2)),
+        ]:
+            self.assertEqual(calculate_deletion_statistics(since, until), self.live(since, until))
+        with self.assertNumQueries(3):
+            calculate_deletion_statistics(self.start + timedelta(hours=1), end)
+
+    def test_backfill_task_rebuilds_the_rollup(self):
+        self.tweets[0].mark_as_deleted('Spam')
+        expected = self.rollup()
+        Tweet.objects.filter(pk=self.tweets[1].pk).update(delete_reason='Drifted')
+        DeletionCount.objects.filter(day=date(2026, 3, 1)).update(count=99)
+        backfill_deletion_counts()
+        self.assertEqual(self.rollup(), dict(deletions.deleted_days(Tweet.objects.all())))
+        self.assertNotEqual(self.rollup(), expected)
+        DeletionCount.objects.all().delete()
+        backfill_deletion_counts(days=2)
+        self.assertEqual(self.rollup(), dict(deletions.deleted_days(Tweet.objects.all())))
+
+    def test_reconcile_rebuilds_days_of_old_tweets_deleted_recently(self):
+        self.tweets[3].mark_as_deleted('Spam')
+        self.tweets[6].mark_as_deleted('Abuse')
+        Tweet.objects.filter(pk__in=[tweet.pk for tweet in self.tweets[6:9]]).update(deleted_at=timezone.now() - timedelta(days=5))
+        DeletionCount.objects.update(count=99)
+        backfill_deletion_counts(days=2)
+        self.assertEqual(self.rollup()[(date(2026, 3, 2), 'Spam')], 1)
+        self.assertEqual(self.rollup()[(date(2026, 3, 3), 'Abuse')], 99)
+
+    def test_statistics_accept_plain_dates(self):
+        self.tweets[0].mark_as_deleted('Spam')
+        self.assertEqual(calculate_deletion_statistics(date(2026, 3, 1), date(2026, 3, 6)), {'Parent tweet deleted': 2, 'Spam': 1})
+        self.assertEqual(deletions.day_of(date(2026, 3, 1)), date(2026, 3, 1))
+
+    def test_patching_is_deleted_marks_the_tweet_deleted(self):
+        response = self.client.patch(f'/tweets/{self.tweets[0].pk}/', {'is_deleted': True, 'delete_reason': 'Spam'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.rollup(), {(date(2026, 3, 1), 'Spam'): 1, (date(2026, 3, 1), 'Parent tweet deleted'): 2})
+        self.assertTrue(Tweet.objects.get(pk=self.tweets[2].pk).is_deleted)
+        response = self.client.patch(f'/tweets/{self.tweets[0].pk}/', {'is_deleted': False}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @assertMaxQueries(4)
+    def test_endpoint(self):
+        self.tweets[0].mark_as_deleted('Spam')
+        response = self.client.get('/stats/deletions/', {'since': '2026-03-01', 'until': '2026-03-06'})
+        self.assertEqual(response.json()['reasons'], {'Parent tweet deleted': 2, 'Spam': 1})
+        self.assertEqual(response.json()['total'], 3)
+        self.assertEqual(self.client.get('/stats/deletions/', {'since': 'yesterday'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get('/stats/deletions/', {'since': '2026-03-02', 'until': '2026-03-01'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.user.is_staff = False
+        self.user.save()
+        self.assertEqual(self.client.get('/stats/deletions/').status_code, status.HTTP_403_FORBIDDEN)
+
+class SyntheticDataTestCase(TestCase):
+    @assertMaxQueries(15)
+    def test_generate_and_benchmark(self):
+        call_command('generate_social_graph', users=30, tweets=300, hashtags=20, batch_size=100, stdout=StringIO())
+        self.assertEqual(Tweet.objects.count(), 300)
+        self.assertTrue(Tweet.objects.filter(parent_tweet__isnull=False).exists())
+        self.assertTrue(Follow.objects.exists() and Like.objects.exists() and Notification.objects.exists())
+        out = StringIO()
+        call_command('reconcile_counters', stdout=out)
+        self.assertIn('Repaired counters on 0 tweets', out.getvalue())
+        rollup = {(row.hashtag_id, row.bucket): row.count for row in HashtagCount.objects.all()}
+        self.assertEqual(rollup, dict(tagged_buckets(Tweet.objects.all())))
+        placed = Tweet.objects.filter(parent_tweet__isnull=False).values_list(
+            'path', 'depth', 'parent_tweet_id', 'parent_tweet__path', 'parent_tweet__depth',
+        )
+        self.assertTrue(all((path, depth) == thread_place(parent) for path, depth, *parent in placed))
+        with self.assertRaises(CommandError):
+            call_command('generate_social_graph', users=2, tweets=0, stdout=StringIO())
+
+        with TemporaryDirectory() as directory:
+            path = Path(directory) / 'run.json'
+            call_command('benchmark_endpoints', requests=3, warmup=1, actors=5, output=str(path), stdout=StringIO())
+            report = json.loads(path.read_text())
+            out = StringIO()
+            call_command('benchmark_endpoints', requests=2, warmup=0, actors=5, scenarios='feed', compare=str(path), stdout=out)
+        self.assertEqual(set(report['scenarios']), {'feed', 'notifications', 'popular_hashtags', 'like', 'follow', 'delete_cascade'})
+        self.assertEqual(set(report['scenarios']['feed']), {
+            'requests', 'p50_ms', 'p95_ms', 'p99_ms', 'mean_ms', 'queries_per_request', 'max_queries', 'throughput_rps', 'errors',
+        })
+        self.assertEqual(report['rows']['tweets'], 300)
+        self.assertIn('p50_ms', out.getvalue())
+        self.assertFalse(Tweet.objects.filter(is_deleted=True).exists())
+
 class TweetDeletionTestCase(UserAuthenticationTestCase):
     def setUp(self):
         super().setUp()
@@ -96,6 +911,118 @@ class TweetDeletionTestCase(UserAuthenticationTestCase):
         self.assertEqual(self.reply_tweet.delete_reason, "Parent tweet deleted")
         self.assertEqual(self.nested_reply_tweet.delete_reason, "Parent tweet deleted")
 
+class TweetCascadeTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.user_profile = UserProfile.objects.create(user=self.user, bio="Test bio")
+        self.root = Tweet.objects.create(content="Root", author=self.user_profile)
+
+    def build_thread(self, depth, width=2):
+        level = [self.root]
+        for _ in range(depth):
+            level = [Tweet.objects.create(content="Reply", author=self.user_profile, parent_tweet=parent)
+                     for parent in level for _ in range(width)][:8]
+        return Tweet.objects.exclude(pk=self.root.pk)
+
+    def test_soft_delete_query_count_is_independent_of_depth(self):
+        shallow = Tweet.objects.create(content="Shallow", author=self.user_profile)
+        Tweet.objects.create(content="Reply", author=self.user_profile, parent_tweet=shallow)
+        with CaptureQueriesContext(connection) as shallow_queries:
+            shallow.mark_as_deleted("Testing deletion")
+        replies = self.build_thread(depth=30).exclude(pk__in=[shallow.pk]).exclude(parent_tweet=shallow)
+        with self.assertNumQueries(len(shallow_queries)):
+            self.root.mark_as_deleted("Testing deletion")
+        self.assertEqual(set(replies.values_list('is_deleted', 'delete_reason')), {(True, 'Parent tweet deleted')})
+        self.assertEqual(Tweet.objects.get(pk=self.root.pk).delete_reason, "Testing deletion")
+
+    def test_hard_delete_removes_whole_subtree(self):
+        replies = self.build_thread(depth=5)
+        Like.objects.create(user=self.user_profile, tweet=replies.last())
+        other = Tweet.objects.create(content="Unrelated", author=self.user_profile)
+        self.root.delete()
+        self.assertEqual(list(Tweet.objects.all()), [other])
+        self.assertFalse(Like.objects.exists())
+
+class TweetThreadTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.profile = UserProfile.objects.create(user=self.user, bio='Test bio')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.root = self.reply('Root')
+        self.a, self.b, self.c = (self.reply(name, self.root) for name in 'abc')
+        self.a1, self.a2 = self.reply('a1', self.a), self.reply('a2', self.a)
+        self.a1x = self.reply('a1x', self.a1)
+        self.a1x1 = self.reply('a1x1', self.a1x)
+
+    def reply(self, content, parent=None):
+        return Tweet.objects.create(content=content, author=self.profile, parent_tweet=parent)
+
+    def thread(self, tweet, **params):
+        return self.client.get(f'/tweets/{tweet.pk}/thread/', params)
+
+    def shape(self, node):
+        return [node['content'], [self.shape(child) for child in node['replies']], node['more_replies']]
+
+    def test_paths_are_set_on_create(self):
+        self.assertEqual((self.root.path, self.root.depth), ('', 0))
+        self.assertEqual(self.a1x.depth, 3)
+        self.assertEqual(self.a1x.path, ''.join(f'{tweet.pk:012d}' for tweet in (self.root, self.a, self.a1)))
+        low, high = self.a.subtree_paths()
+        below = Tweet.objects.filter(path__gte=low, path__lte=high).order_by('pk')
+        self.assertEqual(list(below), [self.a1, self.a2, self.a1x, self.a1x1])
+
+    @assertMaxQueries(3)
+    def test_thread_is_nested_and_limited_in_depth(self):
+        response = self.thread(self.root, depth=3)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.shape(response.data), ['Root', [
+            ['a', [['a1', [['a1x', [], 1]], 0], ['a2', [], 0]], 0], ['b', [], 0], ['c', [], 0],
+        ], 0])
+        a1x = response.data['replies'][0]['replies'][0]['replies'][0]
+        self.assertTrue(a1x['next'].endswith(f'/tweets/{self.a1x.pk}/thread/?breadth=10&depth=3'))
+        self.assertEqual(a1x['depth'], 3)
+        self.assertNotIn('path', a1x)
+
+    def test_more_replies_continue_after_a_cursor(self):
+        response = self.thread(self.root, depth=4, breadth=2)
+        self.assertEqual(self.shape(response.data), ['Root', [
+            ['a', [['a1', [['a1x', [['a1x1', [], 0]], 0]], 0], ['a2', [], 0]], 0], ['b', [], 0],
+        ], 1])
+        more = self.client.get(response.data['next'])
+        self.assertEqual(self.shape(more.data), ['Root', [['c', [], 0]], 0])
+        self.assertIsNone(more.data['next'])
+
+        self.b.mark_as_deleted('Testing deletion')
+        self.assertEqual([child['content'] for child in self.thread(self.root).data['replies']], ['a', 'c'])
+
+    def test_cut_replies_do_not_spend_the_node_limit(self):
+        branches = [self.reply(f'r{i}', self.c) for i in range(3)]
+        for index in range(3):
+            for branch in branches:
+                self.reply(f'{branch.content}.{index}', branch)
+        self.c.refresh_from_db()
+        rows = threads.replies(self.c, depth=2, breadth=2, limit=6)
+        self.assertEqual([row.content for row in rows], ['r0', 'r1', 'r0.0', 'r1.0', 'r0.1', 'r1.1'])
+        response = self.thread(self.c, depth=2, breadth=2)
+        self.assertEqual(self.shape(response.data), ['c', [['r0', [['r0.0', [], 0], ['r0.1', [], 0]], 1], ['r1', [['r1.0', [], 0], ['r1.1', [], 0]], 1]], 1])
+
+    def test_invalid_parameters_are_rejected(self):
+        self.assertEqual(self.thread(self.root, depth='deep').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.thread(self.root, cursor='bogus').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get('/tweets/999999/thread/').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_restored_replies_are_placed(self):
+        records = [
+            {'id': tweet.pk, 'content': tweet.content, 'created_at': tweet.created_at.isoformat(), 'author_id': self.profile.pk,
+             'parent_tweet_id': tweet.parent_tweet_id, 'hashtags': [], 'is_deleted': False, 'delete_reason': ''}
+            for tweet in (self.a1, self.a1x, self.a1x1)
+        ]
+        Tweet.objects.filter(pk=self.a1.pk).delete()
+        self.assertEqual(restore(records), [self.a1.pk, self.a1x.pk, self.a1x1.pk])
+        placed = {tweet.pk: (tweet.path, tweet.depth) for tweet in Tweet.objects.filter(pk__in=[self.a1x.pk, self.a1x1.pk])}
+        self.assertEqual(placed, {self.a1x.pk: (self.a1x.path, 3), self.a1x1.pk: (self.a1x1.path, 4)})
+
 class FollowTestCase(TestCase):
     def setUp(self):
         self.user1 = User.objects.create_user(username='user1', password='testpassword1')
@@ -105,10 +1032,12 @@ class FollowTestCase(TestCase):
         self.client = APIClient()
         self.client.force_authenticate(user=self.user1)
 
+    @assertMaxQueries(5)
     def test_follow_user(self):
         response = self.client.post(f'/follow/{self.user2.username}/')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
+    @assertMaxQueries(5)
     def test_unfollow_user(self):
         self.client.post(f'/follow/{self.user2.username}/')
         response = self.client.post(f'/unfollow/{self.user2.username}/')
@@ -130,12 +1059,114 @@ class FeedTestCase(TestCase):
         Tweet.objects.create(content="Hello from user2", author=self.user2.userprofile)
         Tweet.objects.create(content="Hello from user3", author=self.user3.userprofile)
 
+    @assertMaxQueries(14)
     def test_feed_contents(self):
         response = self.client.get('/feed/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIn("Hello from user2", response.content.decode())
         self.assertNotIn("Hello from user3", response.content.decode())
 
+class TimelineTestCase(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='user1', password='testpassword1')
+        self.profile1 = UserProfile.objects.create(user=self.user1, bio="Bio for user1")
+        self.user2 = User.objects.create_user(username='user2', password='testpassword2')
+        self.profile2 = UserProfile.objects.create(user=self.user2, bio="Bio for user2")
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user1)
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.create(follower=self.profile1, followed=self.profile2)
+        self.client.get('/feed/')
+
+    def feed_contents(self):
+        return [tweet['content'] for tweet in self.client.get('/feed/').data['results']]
+
+    @assertMaxQueries(4)
+    def test_new_tweet_is_fanned_out(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Tweet.objects.create(content="Fresh tweet", author=self.profile2)
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.profile1, tweet__content="Fresh tweet").exists())
+        self.assertEqual(self.feed_contents(), ["Fresh tweet"])
+
+    @assertMaxQueries(3)
+    def test_unfollow_and_soft_delete_prune_timeline(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            tweet = Tweet.objects.create(content="Going away", author=self.profile2)
+        tweet.mark_as_deleted("Spam")
+        self.assertEqual(self.feed_contents(), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Tweet.objects.create(content="Still here", author=self.profile2)
+            Follow.objects.filter(follower=self.profile1).delete()
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.profile1).exists())
+
+    def test_trim_caps_each_timeline(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            tweets = [Tweet.objects.create(content=f'Tweet {i}', author=self.profile2) for i in range(5)]
+        Tweet.objects.filter(pk=tweets[4].pk).update(created_at=tweets[0].created_at)
+        TimelineEntry.objects.filter(tweet=tweets[4]).update(created_at=tweets[0].created_at)
+        with override_settings(TIMELINE_MAX_LENGTH=3):
+            self.assertEqual(trim_timelines.apply().get(), 2)
+        kept = TimelineEntry.objects.filter(owner=self.profile1).values_list('tweet_id', flat=True)
+        self.assertEqual(sorted(kept), [tweets[1].pk, tweets[2].pk, tweets[3].pk])
+
+    @override_settings(TIMELINE_FANOUT_THRESHOLD=0)
+    @assertMaxQueries(5)
+    def test_high_follower_author_is_read_on_demand(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Tweet.objects.create(content="Popular tweet", author=self.profile2)
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(self.feed_contents(), ["Popular tweet"])
+
+class KeysetPaginationTestCase(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='user1', password='testpassword1')
+        self.profile1 = UserProfile.objects.create(user=self.user1)
+        self.user2 = User.objects.create_user(username='user2', password='testpassword2')
+        self.profile2 = UserProfile.objects.create(user=self.user2)
+        Follow.objects.create(follower=self.profile1, followed=self.profile2)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user1)
+        tweets = [Tweet.objects.create(content=f"Tweet {i}", author=self.profile2) for i in range(25)]
+        Tweet.objects.filter(id__in=[tweet.id for tweet in tweets[5:15]]).update(created_at=timezone.now())
+        self.expected = list(Tweet.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+    def walk(self, url):
+        ids, pages = [], []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append(response.data)
+            ids.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        return ids, pages
+
+    @assertMaxQueries(14)
+    def test_feed_pages_follow_next_links(self):
+        ids, pages = self.walk('/feed/?page_size=10')
+        self.assertEqual(ids, self.expected)
+        self.assertEqual([len(page['results']) for page in pages], [10, 10, 5])
+        self.assertIsNone(pages[0]['previous'])
+
+    @assertMaxQueries(2)
+    def test_previous_link_returns_preceding_page(self):
+        first = self.client.get('/tweets/?page_size=10').data
+        second = self.client.get(first['next']).data
+        back = self.client.get(second['previous']).data
+        self.assertEqual([t['id'] for t in back['results']], [t['id'] for t in first['results']])
+
+    @assertMaxQueries(2)
+    def test_tweet_and_profile_listings_are_paginated(self):
+        ids, _ = self.walk('/tweets/?page_size=7')
+        self.assertEqual(ids, self.expected)
+        response = self.client.get('/users/?page_size=1')
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNotNone(response.data['next'])
+
+    @assertMaxQueries(0)
+    def test_invalid_cursor(self):
+        response = self.client.get('/notifications/?cursor=garbage')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
 class NotificationTestCase(TestCase):
     def setUp(self):
         self.user1 = User.objects.create_user(username='user1', password='testpassword1')
@@ -145,12 +1176,131 @@ class NotificationTestCase(TestCase):
         self.client = APIClient()
         self.client.force_authenticate(user=self.user1)
 
+    @assertMaxQueries(5)
     def test_notification_on_follow(self):
         self.client.post(f'/follow/{self.user2.username}/')
         notifications = Notification.objects.filter(recipient=self.user2.userprofile)
         self.assertEqual(notifications.count(), 1)
         self.assertEqual(notifications.first().message, f"{self.user1.username} has started following you.")
 
+class NotificationCoalescingTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = UserProfile.objects.create(user=User.objects.create_user(username='author', password='pass'))
+        self.fans = [UserProfile.objects.create(user=User.objects.create_user(username=f'fan{i}', password='pass')) for i in range(4)]
+        self.tweet = Tweet.objects.create(content='Hello', author=self.author)
+        self.client = APIClient()
+
+    def act(self, fan, url):
+        self.client.force_authenticate(user=fan.user)
+        return self.client.post(url)
+
+    @assertMaxQueries(8)
+    def test_likes_within_window_coalesce(self):
+        for fan in self.fans[:3]:
+            self.act(fan, f'/like/{self.tweet.id}/')
+        self.act(self.fans[0], f'/retweet/{self.tweet.id}/')
+        rows = Notification.objects.filter(recipient=self.author)
+        like = rows.get(verb='like')
+        self.assertEqual((like.actor_count, like.sender, like.target_id), (3, self.fans[2], self.tweet.id))
+        self.assertEqual(like.message, 'fan2 and 2 others liked your tweet.')
+        self.assertEqual(rows.get(verb='retweet').message, 'fan0 retweeted your tweet.')
+
+    def test_batch_is_written_with_constant_queries(self):
+        events = [notifications.event(self.author.pk, 'like', fan.pk, fan.user.username, self.tweet.pk) for fan in self.fans]
+        events += [notifications.event(fan.pk, 'follow', self.author.pk, 'author') for fan in self.fans]
+        with self.assertNumQueries(3):
+            notifications.deliver(events[:2] + events[4:])
+        with self.assertNumQueries(3):
+            notifications.deliver(events[2:4])
+        self.assertEqual(Notification.objects.get(verb='like').message, 'fan3 and 3 others liked your tweet.')
+        self.assertEqual(Notification.objects.filter(verb='follow').count(), 4)
+
+    def test_repeated_actors_are_counted_once(self):
+        events = [notifications.event(self.author.pk, 'like', fan.pk, fan.user.username, self.tweet.pk) for fan in self.fans[:3]]
+        for event in events + events[:2]:
+            notifications.deliver([event])
+        like = Notification.objects.get(verb='like')
+        self.assertEqual((like.actor_count, like.sender), (3, self.fans[2]))
+        self.assertEqual(like.message, 'fan2 and 2 others liked your tweet.')
+        self.assertEqual(set(like.actors.all()), set(self.fans[:3]))
+
+    def test_window_and_read_rows_start_new_notifications(self):
+        event = notifications.event(self.author.pk, 'like', self.fans[0].pk, 'fan0', self.tweet.pk)
+        notifications.deliver([event])
+        later = timezone.now() + timedelta(seconds=settings.NOTIFICATION_WINDOW_SECONDS + 1)
+        notifications.deliver([dict(event, actor=self.fans[1].pk, actor_name='fan1')], now=later)
+        notifications.mark_read(self.author.pk)
+        notifications.deliver([dict(event, actor=self.fans[2].pk, actor_name='fan2')])
+        self.assertEqual(list(Notification.objects.order_by('pk').values_list('actor_count', flat=True)), [1, 1, 1])
+
+    @assertMaxQueries(8)
+    def test_unread_count_is_cached(self):
+        self.client.force_authenticate(user=self.author.user)
+        self.assertEqual(self.client.get('/notifications/unread/').data, {'unread_count': 0})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.act(self.fans[0], '/follow/author/')
+            self.act(self.fans[1], f'/like/{self.tweet.id}/')
+        self.client.force_authenticate(user=self.author.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/notifications/unread/').data, {'unread_count': 2})
+        first = Notification.objects.filter(recipient=self.author).first()
+        response = self.client.post('/notifications/read/', {'ids': [first.pk]}, format='json')
+        self.assertEqual(response.data, {'marked': 1, 'unread_count': 1})
+        self.assertEqual(self.client.post('/notifications/read/', {}, format='json').data, {'marked': 1, 'unread_count': 0})
+
+class EventStreamTestCase(TestCase):
+    def setUp(self):
+        streams.reset()
+        self.addCleanup(streams.reset)
+        self.user = User.objects.create_user(username='listener', password='pass')
+        self.profile = UserProfile.objects.create(user=self.user)
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+
+    def test_broker_replays_backlog_after_last_event_id(self):
+        first = streams.publish([1, 2], 'tweet', {'id': 1})
+        second = streams.publish([1], 'tweet', {'id': 2})
+        broker = streams.get_broker()
+        self.assertGreater(second.id, first.id)
+        self.assertEqual([event.id for event in broker.replay(1, first.id)], [second.id])
+        self.assertEqual([event.id for event in broker.replay(2, 0)], [first.id])
+
+    def test_notifications_and_fanned_out_tweets_are_published(self):
+        author = UserProfile.objects.create(user=User.objects.create_user(username='author', password='pass'))
+        Follow.objects.create(follower=self.profile, followed=author)
+        with self.captureOnCommitCallbacks(execute=True):
+            tweet = Tweet.objects.create(content='Hello', author=author)
+            notifications.deliver([notifications.event(self.profile.pk, 'follow', author.pk, 'author')])
+        events = streams.get_broker().replay(self.profile.pk, 0)
+        self.assertEqual([(event.type, event.data.get('id')) for event in events][0], ('tweet', tweet.pk))
+        self.assertEqual(events[1].data['message'], 'author has started following you.')
+
+    @assertMaxQueries(0)
+    def test_requires_authentication(self):
+        self.assertEqual(self.client.get('/stream/').status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.client.get('/stream/', {'access_token': 'nope'}).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    async def test_stream_resumes_from_last_event_id_then_goes_live(self):
+        first = streams.publish([self.profile.pk], 'notification', {'message': 'one'})
+        streams.publish([self.profile.pk], 'notification', {'message': 'two'})
+        response = await self.async_client.get('/stream/', {'access_token': self.token}, headers={'Last-Event-ID': str(first.id)})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        frames = aiter(response.streaming_content)
+        self.assertTrue((await anext(frames)).startswith(b'retry:'))
+        self.assertIn(b'"two"', await anext(frames))
+        live = asyncio.ensure_future(anext(frames))
+        await asyncio.sleep(0)
+        await sync_to_async(streams.publish)([self.profile.pk], 'tweet', {'id': 99})
+        frame = await asyncio.wait_for(live, 5)
+        self.assertIn(b'event: tweet', frame)
+        self.assertIn(b'"id": 99', frame)
+        disconnect = asyncio.ensure_future(anext(frames))
+        await asyncio.sleep(0)
+        disconnect.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await disconnect
+        self.assertEqual(len(streams.get_hub()), 0)
+
 class LikeRetweetTestCase(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='user', password='testpassword')
@@ -159,47 +1309,351 @@ class LikeRetweetTestCase(TestCase):
         self.client = APIClient()
         self.client.force_authenticate(user=self.user)
 
+    @assertMaxQueries(6)
     def test_like_tweet(self):
         response = self.client.post(f'/like/{self.tweet.id}/')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(Like.objects.count(), 1)
 
+    @assertMaxQueries(6)
     def test_retweet_tweet(self):
         response = self.client.post(f'/retweet/{self.tweet.id}/')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(Retweet.objects.count(), 1)
 
+class EngagementWriteTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='user', password='testpassword')
+        self.user_profile = UserProfile.objects.create(user=self.user)
+        self.author = UserProfile.objects.create(user=User.objects.create_user(username='author', password='testpassword'))
+        self.tweet = Tweet.objects.create(content="Hello world", author=self.author)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    @assertMaxQueries(7)
+    def test_like_is_idempotent_and_reversible(self):
+        self.assertEqual(self.client.post(f'/like/{self.tweet.id}/').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.client.post(f'/like/{self.tweet.id}/').status_code, status.HTTP_200_OK)
+        self.tweet.refresh_from_db()
+        self.assertEqual((Like.objects.count(), self.tweet.like_count), (1, 1))
+        self.assertEqual(Notification.objects.get(recipient=self.author).verb, 'like')
+        self.assertEqual(self.client.post(f'/unlike/{self.tweet.id}/').status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.post(f'/unlike/{self.tweet.id}/').status_code, status.HTTP_200_OK)
+        self.tweet.refresh_from_db()
+        self.assertEqual((Like.objects.count(), self.tweet.like_count), (0, 0))
+
+    def test_retweet_and_missing_targets(self):
+        self.client.get(f'/tweets/{self.tweet.id}/')
+        self.assertEqual(self.client.post(f'/retweet/{self.tweet.id}/').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.client.get(f'/tweets/{self.tweet.id}/').data['retweet_count'], 1)
+        self.assertEqual(self.client.post(f'/unretweet/{self.tweet.id}/').status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.get(f'/tweets/{self.tweet.id}/').data['retweet_count'], 0)
+        for url in ('/like/999999/', '/unlike/999999/', '/retweet/999999/', '/unretweet/999999/', '/follow/nobody/', '/unfollow/nobody/'):
+            self.assertEqual(self.client.post(url).status_code, status.HTTP_404_NOT_FOUND, url)
+        self.assertFalse(Like.objects.exists() or Retweet.objects.exists() or Follow.objects.exists())
+
+    def test_follow_is_idempotent_and_backfills(self):
+        self.client.get('/feed/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post('/follow/author/').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.client.post('/follow/author/').status_code, status.HTTP_200_OK)
+        self.assertEqual(Follow.objects.get().followed, self.author)
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.user_profile, tweet=self.tweet).exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post('/unfollow/author/').status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.post('/unfollow/author/').status_code, status.HTTP_200_OK)
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.user_profile).exists())
+
+class BatchEndpointTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='user', password='testpassword')
+        self.profile = UserProfile.objects.create(user=self.user)
+        self.others = [UserProfile.objects.create(user=User.objects.create_user(username=f'other{i}', password='testpassword')) for i in range(3)]
+        self.tweets = [Tweet.objects.create(content=f'Tweet {i}', author=self.others[i % 3]) for i in range(4)]
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    @assertMaxQueries(8)
+    def test_batch_like_and_retweet(self):
+        ids = [tweet.pk for tweet in self.tweets]
+        Like.objects.create(user=self.profile, tweet=self.tweets[0])
+        response = self.client.post('/batch/like/', {'ids': ids + [999999, ids[1]]}, format='json')
+        self.assertEqual(response.data, {'liked': ids[1:], 'missing': [999999]})
+        self.assertEqual(self.client.post('/batch/like/', {'ids': ids}, format='json').data['liked'], [])
+        self.assertEqual(self.client.post('/batch/retweet/', {'ids': ids[:2]}, format='json').data['retweeted'], ids[:2])
+        counts = list(Tweet.objects.order_by('pk').values_list('like_count', 'retweet_count'))
+        self.assertEqual(counts, [(0, 1), (1, 1), (1, 0), (1, 0)])
+        self.assertEqual(Notification.objects.filter(verb='like').count(), 3)
+        for body in ({'ids': 'all'}, {'ids': []}, {'ids': [True]}, {'ids': list(range(1, settings.API_MAX_PAGE_SIZE + 2))}):
+            self.assertEqual(self.client.post('/batch/like/', body, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_batch_counts_only_rows_it_inserted(self):
+        # A concurrent request's row, stamped while this batch runs, is not ours to count.
+        Like.objects.create(user=self.profile, tweet=self.tweets[0])
+        Like.objects.update(created_at=timezone.now() + timedelta(minutes=1))
+        added, missing = engagement.engage_many(Like, self.profile.pk, [self.tweets[0].pk, self.tweets[1].pk, 999999])
+        self.assertEqual((added, missing), ({self.tweets[1].pk: self.others[1].pk}, [999999]))
+        self.assertEqual(list(Tweet.objects.order_by('pk').values_list('like_count', flat=True)[:2]), [0, 1])
+
+    @assertMaxQueries(2)
+    def test_multi_get_keeps_the_requested_order(self):
+        ids = [self.tweets[2].pk, 999999, self.tweets[0].pk]
+        with self.assertNumQueries(2):
+            response = self.client.get('/tweets/', {'ids': ','.join(map(str, ids))})
+        self.assertEqual([tweet['id'] for tweet in response.data], [self.tweets[2].pk, self.tweets[0].pk])
+        for ids in ('1,x', '1,-2', '1,+2', '1_0'):
+            self.assertEqual(self.client.get('/tweets/', {'ids': ids}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_relationships_use_a_constant_number_of_queries(self):
+        Follow.objects.create(follower=self.profile, followed=self.others[0])
+        Follow.objects.create(follower=self.others[1], followed=self.profile)
+        Retweet.objects.create(user=self.profile, tweet=self.tweets[1])
+        with self.assertNumQueries(4):
+            response = self.client.get('/relationships/', {
+                'users': 'other0,other1,other2,nobody', 'tweets': f'{self.tweets[1].pk},{self.tweets[0].pk}',
+            })
+        self.assertEqual(response.data['users'], [
+            {'username': 'other0', 'following': True, 'followed_by': False},
+            {'username': 'other1', 'following': False, 'followed_by': True},
+            {'username': 'other2', 'following': False, 'followed_by': False},
+        ])
+        self.assertEqual(response.data['tweets'], [
+            {'id': self.tweets[1].pk, 'liked': False, 'retweeted': True},
+            {'id': self.tweets[0].pk, 'liked': False, 'retweeted': False},
+        ])
+        self.assertEqual(self.client.get('/relationships/', {'tweets': 'x'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+class ConcurrentEngagementTestCase(TransactionTestCase):
+    def test_concurrent_duplicates_do_not_fail(self):
+        # Threads share an in-memory SQLite test database through table locks that fail
+        # instead of waiting, so this needs a server database or a file-backed SQLite one.
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('needs a test database that takes concurrent writers')
+        author = UserProfile.objects.create(user=User.objects.create_user(username='author', password='testpassword'))
+        tweet = Tweet.objects.create(content="Hello world", author=author)
+        users = [User.objects.create_user(username=f'fan{i}', password='testpassword') for i in range(4)]
+        for user in users:
+            UserProfile.objects.create(user=user)
+
+        def tap(user, url):
+            client = APIClient()
+            client.force_authenticate(user=user)
+            try:
+                return client.post(url).status_code
+            finally:
+                connection.close()
+
+        taps = [(user, url) for user in users for url in (f'/like/{tweet.pk}/', f'/retweet/{tweet.pk}/', '/follow/author/') for _ in range(4)]
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            codes = Counter(pool.map(lambda args: tap(*args), taps))
+        self.assertEqual(codes, {status.HTTP_201_CREATED: 12, status.HTTP_200_OK: 36})
+        tweet.refresh_from_db()
+        self.assertEqual((tweet.like_count, tweet.retweet_count), (4, 4))
+        self.assertEqual((Like.objects.count(), Retweet.objects.count(), Follow.objects.count()), (4, 4, 4))
+
+class EngagementCounterTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='user', password='testpassword')
+        self.user_profile = UserProfile.objects.create(user=self.user)
+        self.tweet = Tweet.objects.create(content="Hello world", author=self.user_profile)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    @assertMaxQueries(6)
+    def test_counters_follow_likes_retweets_and_replies(self):
+        self.client.post(f'/like/{self.tweet.id}/')
+        self.client.post(f'/retweet/{self.tweet.id}/')
+        reply = Tweet.objects.create(content="Reply", author=self.user_profile, parent_tweet=self.tweet)
+        self.tweet.refresh_from_db()
+        self.assertEqual((self.tweet.like_count, self.tweet.retweet_count, self.tweet.reply_count), (1, 1, 1))
+        reply.mark_as_deleted("Spam")
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.reply_count, 0)
+        response = self.client.get(f'/tweets/{self.tweet.id}/')
+        self.assertEqual(response.data['like_count'], 1)
+
+    def test_reconcile_counters_repairs_drift(self):
+        Like.objects.create(user=self.user_profile, tweet=self.tweet)
+        Tweet.objects.filter(pk=self.tweet.pk).update(retweet_count=7)
+        call_command('reconcile_counters', stdout=StringIO())
+        self.tweet.refresh_from_db()
+        self.assertEqual((self.tweet.like_count, self.tweet.retweet_count, self.tweet.reply_count), (1, 0, 0))
+
 class CeleryTasksTestCase(TestCase):
     def setUp(self):
         self.user = User.objects.create_user('testuser', 'testuser@example.com', 'password123')
         self.user_profile = UserProfile.objects.create(user=self.user)
 
-    @patch('api.tasks.requests.get')
-    def test_fetch_and_update_tweets(self, mock_get):
-        mock_get.return_value.json.return_value = [
+    def serve_feed(self, payload, etag='"v1"'):
+        test = self
+
+        class FeedHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                test.requests_seen.append(dict(self.headers))
+                if self.headers.get('If-None-Match') == test.feed['etag']:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                body = json.dumps(test.feed['payload']).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', test.feed['etag'])
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.feed = {'payload': payload, 'etag': etag}
+        self.requests_seen = []
+        server = ThreadingHTTPServer(('127.0.0.1', 0), FeedHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.addCleanup(cache.clear)
+        return f'http://127.0.0.1:{server.server_address[1]}/posts'
+
+    def test_fetch_and_update_tweets(self):
+        url = self.serve_feed([
             {'userId': self.user.id, 'id': 1, 'body': 'Test tweet'}
-        ]
-        
-        fetch_and_update_tweets.apply()  
-        
+        ])
+
+        with override_settings(TWEET_FEED_URL=url):
+            fetch_and_update_tweets.apply()
+
         self.assertEqual(Tweet.objects.count(), 1)
         tweet = Tweet.objects.first()
         self.assertEqual(tweet.content, 'Test tweet')
         self.assertEqual(tweet.author, self.user_profile)
 
+    def test_fetch_is_conditional_and_batched(self):
+        other = User.objects.create_user('other', 'other@example.com', 'password123')
+        url = self.serve_feed([
+            {'userId': user_id, 'id': tweet_id, 'body': f'Tweet {tweet_id}'}
+            for tweet_id, user_id in enumerate([self.user.id, other.id, 10 ** 6] * 10, start=1)
+        ])
+        with override_settings(TWEET_FEED_URL=url):
+            with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(8):
+                self.assertEqual(fetch_and_update_tweets.apply().get(), 20)
+            with self.assertNumQueries(0):
+                self.assertEqual(fetch_and_update_tweets.apply().get(), 0)
+            self.assertEqual(self.requests_seen[-1]['If-None-Match'], '"v1"')
+            created_at = Tweet.objects.get(pk=2).created_at
+
+            self.feed.update(payload=[{'userId': other.id, 'id': 2, 'body': 'Edited'}], etag='"v2"')
+            with self.assertNumQueries(5):
+                fetch_and_update_tweets.apply()
+        self.assertEqual(Tweet.objects.get(pk=2).content, 'Edited')
+        self.assertEqual(Tweet.objects.get(pk=2).created_at, created_at)
+        self.assertEqual(Tweet.objects.count(), 20)
+
+    def test_failed_ingest_is_fetched_again(self):
+        url = self.serve_feed([{'userId': self.user.id, 'id': 1, 'body': 'Test tweet'}])
+        with override_settings(TWEET_FEED_URL=url):
+            with patch.object(ingest, 'ingest', side_effect=OperationalError('database is locked')):
+                with self.assertRaises(OperationalError):
+                    fetch_and_update_tweets.apply(throw=True)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(fetch_and_update_tweets.apply().get(), 1)
+        self.assertNotIn('If-None-Match', self.requests_seen[-1])
+        self.assertEqual(Tweet.objects.get(pk=1).content, 'Test tweet')
+
     def test_backup_and_delete_old_tweets(self):
         old_tweet = Tweet.objects.create(
             content='Old tweet',
-            created_at=timezone.now() - timedelta(days=settings.BACKUP_PERIOD_DAYS + 10),  
             author=self.user_profile
         )
-        backup_and_delete_old_tweets.apply()  
-        
-        self.assertFalse(Tweet.objects.filter(id=old_tweet.id).exists())
-        with open('backup_tweets.txt', 'r') as file:
-            print("hello")
-            content = file.read()
-            self.assertIn('Old tweet', content)
+        reply = Tweet.objects.create(content='Recent reply', author=self.user_profile, parent_tweet=old_tweet)
+        hashtag = Hashtag.objects.create(tag='archived')
+        old_tweet.hashtags.add(hashtag)
+        Tweet.objects.filter(pk=old_tweet.pk).update(created_at=timezone.now() - timedelta(days=settings.BACKUP_PERIOD_DAYS + 10))
+        recent_tweet = Tweet.objects.create(content='Recent tweet', author=self.user_profile)
+        with TemporaryDirectory() as archive_dir, override_settings(TWEET_ARCHIVE_DIR=archive_dir):
+            backup_and_delete_old_tweets.apply()
+
+            self.assertFalse(Tweet.objects.filter(id__in=[old_tweet.id, reply.id]).exists())
+            self.assertTrue(Tweet.objects.filter(id=recent_tweet.id).exists())
+            records = {record['id']: record for record in iter_archive(archive_dir)}
+        self.assertEqual(set(records), {old_tweet.id, reply.id})
+        self.assertEqual(records[old_tweet.id]['content'], 'Old tweet')
+        self.assertEqual(records[old_tweet.id]['hashtags'], ['archived'])
+        self.assertEqual(records[old_tweet.id]['author'], 'testuser')
+        self.assertEqual(records[reply.id]['parent_tweet_id'], old_tweet.id)
+
+    def test_archiver_resumes_interrupted_run(self):
+        tweets = [Tweet.objects.create(content=f'Old {i}', author=self.user_profile) for i in range(5)]
+        Tweet.objects.update(created_at=timezone.now() - timedelta(days=settings.BACKUP_PERIOD_DAYS + 10))
+        cutoff = timezone.now() - timedelta(days=settings.BACKUP_PERIOD_DAYS)
+        with TemporaryDirectory() as archive_dir:
+            archiver = TweetArchiver(archive_dir, chunk_size=2, frame_size=1)
+            with patch.object(TweetArchiver, '_delete', side_effect=RuntimeError('crash')):
+                with self.assertRaises(RuntimeError):
+                    archiver.run(cutoff)
+            self.assertEqual(Tweet.objects.count(), 5)
+            self.assertEqual(archiver.load_manifest()['pending'], [tweets[0].id, tweets[1].id])
+
+            self.assertEqual(archiver.run(cutoff), 3)
+            self.assertFalse(Tweet.objects.exists())
+            self.assertEqual(sorted(record['id'] for record in iter_archive(archive_dir)), [tweet.id for tweet in tweets])
+
+class TweetArchiveIndexTestCase(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(username='admin', password='adminpassword', is_staff=True)
+        self.user = User.objects.create_user(username='testuser', password='password123')
+        self.author = UserProfile.objects.create(user=self.user)
+        self.other = UserProfile.objects.create(user=self.admin)
+        self.tweets = [Tweet.objects.create(content=f'Old {i}', author=self.author if i % 2 else self.other) for i in range(12)]
+        self.tweets[0].hashtags.add(Hashtag.objects.create(tag='history'))
+        Tweet.objects.update(created_at=timezone.now() - timedelta(days=60))
+        self.archive_dir = TemporaryDirectory()
+        self.addCleanup(self.archive_dir.cleanup)
+        TweetArchiver(self.archive_dir.name, chunk_size=5, frame_size=2).run(timezone.now() - timedelta(days=30))
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.admin)
+
+    def test_reader_finds_tweets_by_id_and_author(self):
+        with ArchiveReader(self.archive_dir.name) as reader:
+            self.assertEqual(reader.get(self.tweets[7].id)['content'], 'Old 7')
+            self.assertIsNone(reader.get(10 ** 9))
+            authored = [record['content'] for record in reader.by_author(self.author.id)]
+        self.assertEqual(authored, [f'Old {i}' for i in range(1, 12, 2)])
+
+    @assertMaxQueries(9)
+    def test_restore_endpoint_is_admin_only_and_idempotent(self):
+        url = f'/archive/tweets/{self.tweets[0].id}/'
+        with override_settings(TWEET_ARCHIVE_DIR=self.archive_dir.name):
+            self.assertEqual(self.client.get(url).data['hashtags'], ['history'])
+            self.assertEqual(self.client.post(url).status_code, status.HTTP_201_CREATED)
+            self.assertEqual(self.client.post(url).data['restored'], [])
+            response = self.client.post(f'/archive/authors/{self.author.id}/')
+            self.assertEqual(len(response.data['restored']), 6)
+            self.client.force_authenticate(user=self.user)
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+        restored = Tweet.objects.get(pk=self.tweets[0].id)
+        self.assertLess(restored.created_at, timezone.now() - timedelta(days=59))
+        self.assertEqual(list(restored.hashtags.values_list('tag', flat=True)), ['history'])
+
+    def test_restored_tweets_archive_again_without_per_row_signals(self):
+        restore(iter_archive(self.archive_dir.name))
+        self.tweets[3].mark_as_deleted('Spam')
+        Like.objects.create(user=self.author, tweet=self.tweets[5])
+        archiver = TweetArchiver(self.archive_dir.name, chunk_size=5, frame_size=2)
+        with patch.object(deletions, 'record_tweet') as per_row:
+            self.assertEqual(archiver.run(timezone.now() - timedelta(days=30)), 12)
+        per_row.assert_not_called()
+        self.assertFalse(Tweet.objects.exists() or Like.objects.exists())
+        self.assertFalse(DeletionCount.objects.filter(count__gt=0).exists())
+        names = [segment['name'] for segment in archiver.load_manifest()['segments']]
+        self.assertEqual(len(set(names)), 6)
+        self.assertEqual(len(list(iter_archive(self.archive_dir.name))), 24)
+
+    def test_missing_index_is_rebuilt(self):
+        for path in Path(self.archive_dir.name).glob('*.idx'):
+            path.unlink()
+        out = StringIO()
+        call_command('archived_tweets', 'get', '--id', str(self.tweets[3].id), '--archive-dir', self.archive_dir.name, stdout=out)
+        self.assertIn('Old 3', out.getvalue())
 
 class TweetModelTestCase(TestCase):
     def setUp(self):
@@ -0,0 +1,100 @@
+import base64
+import json
+
+from django.db import connection
+from django.db.models import Count, F, Q, Window
+from django.db.models.functions import RowNumber
+from django.urls import reverse
+from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import replace_query_param
+
+from .models import Tweet, thread_place
+from .serializers import tweet_reader
+
+INVALID_CURSOR = 'Invalid cursor'
+
+
+def encode_cursor(after):
+    return base64.urlsafe_b64encode(json.dumps([after]).encode('ascii')).decode('ascii')
+
+
+def decode_cursor(encoded):
+    """The reply id a ``more`` link continues after, or ``None`` without a cursor."""
+    if not encoded:
+        return None
+    try:
+        (after,) = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+        return int(after)
+    except (TypeError, ValueError, UnicodeError):
+        raise NotFound(INVALID_CURSOR)
+
+
+def _link(request, pk, depth, breadth, after):
+    url = request.build_absolute_uri(reverse('tweet-thread', args=[pk]))
+    url = replace_query_param(replace_query_param(url, 'depth', depth), 'breadth', breadth)
+    return url if after is None else replace_query_param(url, 'cursor', encode_cursor(after))
+
+
+def replies(tweet, depth, breadth, after=None, limit=None):
+    """Live replies down to ``depth`` levels below ``tweet``, the first ``breadth`` of each parent, in one query.
+
+    Siblings are ranked over the subtree's range of paths, then a recursive walk from
+    ``tweet`` keeps only the ranked-in replies of replies it kept, so nothing below a
+    reply cut by ``breadth`` is read or counts against ``limit``. With ``after``, direct
+    replies up to that id are skipped along with everything below them. Rows come
+    shallowest first, siblings in id order, each annotated with ``siblings``, the
+    number of its parent's replies matching before ``breadth`` applies.
+    """
+    low, high = tweet.subtree_paths()
+    rows = Tweet.objects.filter(path__gte=low, path__lte=high, depth__lte=tweet.depth + depth, is_deleted=False)
+    if after is not None:
+        rows = rows.filter(Q(path=low, pk__gt=after) | Q(path__gte=thread_place((after + 1, low, 0))[0]))
+    rows = rows.annotate(
+        position=Window(RowNumber(), partition_by=[F('parent_tweet')], order_by=F('id').asc()),
+        siblings=Window(Count('id'), partition_by=[F('parent_tweet')]),
+    )
+    ranked, params = rows.query.sql_with_params()
+    qn = connection.ops.quote_name
+    pk, parent, position = qn('id'), qn(Tweet._meta.get_field('parent_tweet').column), qn('position')
+    sql = (
+        f'WITH RECURSIVE ranked AS ({ranked}), kept AS ('
+        f'SELECT * FROM ranked WHERE {parent} = %s AND {position} <= %s '
+        f'UNION ALL SELECT r.* FROM ranked r INNER JOIN kept k ON r.{parent} = k.{pk} WHERE r.{position} <= %s'
+        f') SELECT * FROM kept ORDER BY {qn("depth")}, {pk}'
+    )
+    params = [*params, tweet.pk, breadth, breadth]
+    if limit is not None:
+        sql += ' LIMIT %s'
+        params.append(limit)
+    return list(Tweet.objects.raw(sql, params))
+
+
+def tree(tweet, request, depth, breadth, after=None, limit=None):
+    """``tweet`` serialized with its replies nested under ``replies``.
+
+    Every node also carries ``more_replies``, the number of its replies left out by the
+    limits, and ``next``, a link expanding them: the same endpoint on that node, with a
+    cursor after its last reply shown.
+    """
+    rows = replies(tweet, depth, breadth, after, limit)
+    nodes = {}
+    for row, data in zip([tweet] + rows, tweet_reader([tweet] + rows)):
+        nodes[row.pk] = (row, data)
+        data['replies'] = []
+        if row is not tweet:
+            nodes[row.parent_tweet_id][1]['replies'].append(data)
+
+    by_parent = {row.parent_tweet_id: row.siblings for row in rows}
+    for row, data in nodes.values():
+        if row.pk in by_parent:
+            total = by_parent[row.pk]
+        elif row is tweet and after is not None:
+            total = 0
+        else:
+            total = row.reply_count
+        shown = data['replies']
+        data['more_replies'] = max(0, total - len(shown))
+        data['next'] = None
+        if data['more_replies']:
+            data['next'] = _link(request, row.pk, depth, breadth, shown[-1]['id'] if shown else None)
+    return nodes[tweet.pk][1]
@@ -0,0 +1,237 @@
+import bisect
+import threading
+
+from django.conf import settings
+from django.db.models import Count, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import streams
+from .models import Follow, TimelineEntry, TimelineState, Tweet
+
+
+class BaseTimelineBackend:
+    """Stores materialized home timelines as ``(created_at, tweet_id, author_id)`` entries.
+
+    ``entries`` returns entries past the ``(created_at, tweet_id)`` ``position``
+    nearest first: newest first, or oldest first when ``reverse`` is set.
+    """
+
+    def push(self, owner_ids, entry):
+        raise NotImplementedError
+
+    def extend(self, owner_id, entries):
+        raise NotImplementedError
+
+    def entries(self, owner_id, limit, position=None, reverse=False):
+        raise NotImplementedError
+
+    def remove_author(self, owner_id, author_id):
+        raise NotImplementedError
+
+    def remove_tweets(self, tweet_ids):
+        raise NotImplementedError
+
+    def is_materialized(self, owner_id):
+        raise NotImplementedError
+
+    def mark_materialized(self, owner_id):
+        raise NotImplementedError
+
+    def trim(self):
+        """Cut every timeline down to ``TIMELINE_MAX_LENGTH`` entries; returns the number removed."""
+        raise NotImplementedError
+
+
+class DatabaseTimelineBackend(BaseTimelineBackend):
+    batch_size = 1000
+
+    def _rows(self, owner_id, entries):
+        return [
+            TimelineEntry(owner_id=owner_id, created_at=created_at, tweet_id=tweet_id, author_id=author_id)
+            for created_at, tweet_id, author_id in entries
+        ]
+
+    def push(self, owner_ids, entry):
+        rows = [row for owner_id in owner_ids for row in self._rows(owner_id, [entry])]
+        TimelineEntry.objects.bulk_create(rows, batch_size=self.batch_size, ignore_conflicts=True)
+
+    def extend(self, owner_id, entries):
+        TimelineEntry.objects.bulk_create(self._rows(owner_id, entries), batch_size=self.batch_size, ignore_conflicts=True)
+
+    def entries(self, owner_id, limit, position=None, reverse=False):
+        rows = _after(TimelineEntry.objects.filter(owner_id=owner_id), 'tweet_id', position, reverse)
+        return list(rows.values_list('created_at', 'tweet_id', 'author_id')[:limit])
+
+    def remove_author(self, owner_id, author_id):
+        TimelineEntry.objects.filter(owner_id=owner_id, author_id=author_id).delete()
+
+    def remove_tweets(self, tweet_ids):
+        TimelineEntry.objects.filter(tweet_id__in=tweet_ids).delete()
+
+    def is_materialized(self, owner_id):
+        return TimelineState.objects.filter(profile_id=owner_id, materialized_at__isnull=False).exists()
+
+    def mark_materialized(self, owner_id):
+        TimelineState.objects.update_or_create(profile_id=owner_id, defaults={'materialized_at': timezone.now()})
+
+    def trim(self):
+        # Fan-out writes one entry to many owners, so timelines are cut back here, on a
+        # schedule, instead of once per owner on every push.
+        owners = TimelineEntry.objects.values('owner_id').annotate(n=Count('pk')).filter(n__gt=settings.TIMELINE_MAX_LENGTH)
+        return sum(self._trim_owner(owner_id) for owner_id in owners.values_list('owner_id', flat=True))
+
+    def _trim_owner(self, owner_id):
+        rows = TimelineEntry.objects.filter(owner_id=owner_id)
+        length = settings.TIMELINE_MAX_LENGTH
+        last = list(rows.order_by('-created_at', '-tweet_id').values_list('created_at', 'tweet_id')[length - 1:length])
+        return _after(rows, 'tweet_id', last[0], False).delete()[0] if last else 0
+
+
+class LocalTimelineBackend(BaseTimelineBackend):
+    """In-process stand-in for a Redis sorted-set store. Timelines are capped at ``TIMELINE_MAX_LENGTH``."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timelines = {}
+        self._materialized = set()
+
+    def _insert(self, owner_id, entry):
+        timeline = self._timelines.setdefault(owner_id, [])
+        index = bisect.bisect_left(timeline, entry)
+        if index < len(timeline) and timeline[index][1] == entry[1]:
+            return
+        timeline.insert(index, entry)
+        if len(timeline) > settings.TIMELINE_MAX_LENGTH:
+            del timeline[0]
+
+    def push(self, owner_ids, entry):
+        with self._lock:
+            for owner_id in owner_ids:
+                self._insert(owner_id, tuple(entry))
+
+    def extend(self, owner_id, entries):
+        with self._lock:
+            for entry in entries:
+                self._insert(owner_id, tuple(entry))
+
+    def entries(self, owner_id, limit, position=None, reverse=False):
+        with self._lock:
+            timeline = self._timelines.get(owner_id, [])
+            if reverse:
+                start = bisect.bisect_right(timeline, (position[0], position[1], float('inf'))) if position else 0
+                return timeline[start:start + limit]
+            end = bisect.bisect_left(timeline, tuple(position)) if position else len(timeline)
+            return timeline[max(0, end - limit):end][::-1]
+
+    def remove_author(self, owner_id, author_id):
+        with self._lock:
+            if owner_id in self._timelines:
+                self._timelines[owner_id] = [e for e in self._timelines[owner_id] if e[2] != author_id]
+
+    def remove_tweets(self, tweet_ids):
+        tweet_ids = set(tweet_ids)
+        with self._lock:
+            for owner_id, timeline in self._timelines.items():
+                self._timelines[owner_id] = [e for e in timeline if e[1] not in tweet_ids]
+
+    def is_materialized(self, owner_id):
+        return owner_id in self._materialized
+
+    def mark_materialized(self, owner_id):
+        with self._lock:
+            self._materialized.add(owner_id)
+            self._timelines.setdefault(owner_id, [])
+
+    def trim(self):
+        return 0
+
+    def clear(self):
+        with self._lock:
+            self._timelines.clear()
+            self._materialized.clear()
+
+
+_backends = {}
+
+
+def get_backend():
+    path = settings.TIMELINE_BACKEND
+    if path not in _backends:
+        _backends[path] = import_string(path)()
+    return _backends[path]
+
+
+def _after(queryset, pk_field, position, reverse):
+    if position is not None:
+        created_at, pk = position
+        if reverse:
+            queryset = queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, **{pk_field + '__gt': pk}))
+        else:
+            queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, **{pk_field + '__lt': pk}))
+    if reverse:
+        return queryset.order_by('created_at', pk_field)
+    return queryset.order_by('-created_at', '-' + pk_field)
+
+
+def _tweet_entries(queryset, limit, position=None, reverse=False):
+    queryset = _after(queryset.filter(is_deleted=False), 'id', position, reverse)
+    return list(queryset.values_list('created_at', 'id', 'author_id')[:limit])
+
+
+def fan_out(tweet):
+    """Push ``tweet`` into its author's followers' timelines and streams, unless the author is read on demand."""
+    threshold = settings.TIMELINE_FANOUT_THRESHOLD
+    follower_ids = list(Follow.objects.filter(followed_id=tweet.author_id).values_list('follower_id', flat=True)[:threshold + 1])
+    if len(follower_ids) > threshold:
+        TimelineState.objects.update_or_create(profile_id=tweet.author_id, defaults={'fanout_on_read': True})
+        return 0
+    get_backend().push(follower_ids, (tweet.created_at, tweet.pk, tweet.author_id))
+    streams.publish(follower_ids, 'tweet', {'id': tweet.pk, 'author_id': tweet.author_id})
+    return len(follower_ids)
+
+
+def backfill(owner_id, author_id):
+    backend = get_backend()
+    if not backend.is_materialized(owner_id):
+        return
+    if TimelineState.objects.filter(profile_id=author_id, fanout_on_read=True).exists():
+        return
+    backend.extend(owner_id, _tweet_entries(Tweet.objects.filter(author_id=author_id), settings.TIMELINE_MAX_LENGTH))
+
+
+def prune(owner_id, author_id):
+    get_backend().remove_author(owner_id, author_id)
+
+
+def trim():
+    return get_backend().trim()
+
+
+def rebuild(owner_id):
+    followed = Follow.objects.filter(follower_id=owner_id).exclude(followed__timeline_state__fanout_on_read=True)
+    tweets = Tweet.objects.filter(author_id__in=followed.values('followed_id'))
+    backend = get_backend()
+    backend.extend(owner_id, _tweet_entries(tweets, settings.TIMELINE_MAX_LENGTH))
+    backend.mark_materialized(owner_id)
+
+
+def read(owner_id, limit, position=None, reverse=False):
+    """Return up to ``limit`` ``(created_at, tweet_id, author_id)`` entries past ``position``.
+
+    Timelines that were never materialized are built on first read. Tweets by authors
+    flagged ``fanout_on_read`` are never pushed and get merged in here instead.
+    """
+    backend = get_backend()
+    entries = backend.entries(owner_id, limit, position, reverse)
+    if not entries and not backend.is_materialized(owner_id):
+        rebuild(owner_id)
+        entries = backend.entries(owner_id, limit, position, reverse)
+
+    on_read = Follow.objects.filter(follower_id=owner_id, followed__timeline_state__fanout_on_read=True)
+    pulled = _tweet_entries(Tweet.objects.filter(author_id__in=on_read.values('followed_id')), limit, position, reverse)
+    if pulled:
+        merged = {entry[1]: tuple(entry) for entry in entries}
+        merged.update((entry[1], tuple(entry)) for entry in pulled)
+        entries = sorted(merged.values(), key=lambda entry: (entry[0], entry[1]), reverse=not reverse)[:limit]
+    return entries
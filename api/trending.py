@@ -0,0 +1,387 @@
+import atexit
+import logging
+import os
+import socket
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_MIX1 = np.uint64(0xbf58476d1ce4e5b9)
+_MIX2 = np.uint64(0x94d049bb133111eb)
+
+
+def _mix(values):
+    """splitmix64 finalizer over a uint64 array."""
+    values = values ^ (values >> np.uint64(30))
+    values = values * _MIX1
+    values = values ^ (values >> np.uint64(27))
+    values = values * _MIX2
+    return values ^ (values >> np.uint64(31))
+
+
+class CountMinSketch:
+    """Count-Min Sketch over integer keys, stored as a ``(depth, width)`` array."""
+
+    def __init__(self, width=2 ** 14, depth=4, seed=0x5eed, dtype=np.uint32):
+        self.width = width
+        self.depth = depth
+        self.seeds = _mix(np.arange(1, depth + 1, dtype=np.uint64) * np.uint64(seed))
+        self.table = np.zeros((depth, width), dtype=dtype)
+
+    def columns(self, keys):
+        keys = np.asarray(keys, dtype=np.uint64)
+        return (_mix(keys[np.newaxis, :] ^ self.seeds[:, np.newaxis]) % np.uint64(self.width)).astype(np.intp)
+
+    def add(self, keys, counts=1):
+        columns = self.columns(keys)
+        rows = np.arange(self.depth)[:, np.newaxis]
+        np.add.at(self.table, (np.broadcast_to(rows, columns.shape), columns), counts)
+
+    def query(self, keys):
+        columns = self.columns(keys)
+        return self.table[np.arange(self.depth)[:, np.newaxis], columns].min(axis=0)
+
+    def merge(self, other):
+        if self.table.shape != other.table.shape or not np.array_equal(self.seeds, other.seeds):
+            raise ValueError('Only sketches with the same shape and seeds can be merged.')
+        self.table += other.table.astype(self.table.dtype)
+
+
+class SpaceSaving:
+    """Space-Saving heavy hitters over integer keys, backed by fixed-size arrays."""
+
+    def __init__(self, capacity=512):
+        self.capacity = capacity
+        self.keys = np.full(capacity, -1, dtype=np.int64)
+        self.counts = np.zeros(capacity, dtype=np.int64)
+        self.errors = np.zeros(capacity, dtype=np.int64)
+        self.slots = {}
+
+    def add(self, key, count=1):
+        slot = self.slots.get(key)
+        if slot is None:
+            if len(self.slots) < self.capacity:
+                slot = len(self.slots)
+                self.counts[slot] = 0
+                self.errors[slot] = 0
+            else:
+                slot = int(np.argmin(self.counts))
+                del self.slots[int(self.keys[slot])]
+                self.errors[slot] = self.counts[slot]
+            self.keys[slot] = key
+            self.slots[key] = slot
+        self.counts[slot] += count
+
+    def items(self):
+        used = len(self.slots)
+        return list(zip(self.keys[:used].tolist(), self.counts[:used].tolist(), self.errors[:used].tolist()))
+
+    def merge(self, other):
+        combined = {}
+        for key, count, error in self.items() + other.items():
+            total = combined.get(key, (0, 0))
+            combined[key] = (total[0] + count, total[1] + error)
+        top = sorted(combined.items(), key=lambda item: item[1][0], reverse=True)[:self.capacity]
+        self.keys[:] = -1
+        self.counts[:] = 0
+        self.errors[:] = 0
+        self.slots = {}
+        for slot, (key, (count, error)) in enumerate(top):
+            self.keys[slot], self.counts[slot], self.errors[slot] = key, count, error
+            self.slots[key] = slot
+
+    def clear(self):
+        self.keys[:] = -1
+        self.counts[:] = 0
+        self.errors[:] = 0
+        self.slots = {}
+
+
+class TrendingEngine:
+    """Windowed hashtag velocity from sketches, without scanning the database.
+
+    Counts land in a ring of ``window_buckets`` Count-Min Sketches of
+    ``bucket_seconds`` each, with a Space-Saving summary per bucket for candidate
+    keys. Buckets leaving the window are folded into an exponentially weighted
+    baseline sketch holding the usual per-bucket rate. Velocity is the current
+    per-bucket rate over that baseline. Engines built with the same parameters
+    merge by addition, so per-worker engines can be combined.
+    """
+
+    def __init__(self, bucket_seconds=300, window_buckets=12, half_life_buckets=144, width=2 ** 14, depth=4, capacity=512):
+        self.bucket_seconds = bucket_seconds
+        self.window_buckets = window_buckets
+        self.decay = 0.5 ** (1 / half_life_buckets)
+        self.sketch = CountMinSketch(width, depth)
+        self.window = np.zeros((window_buckets, depth, width), dtype=np.uint32)
+        self.epochs = np.full(window_buckets, -1, dtype=np.int64)
+        self.heavy = [SpaceSaving(capacity) for _ in range(window_buckets)]
+        self.baseline = np.zeros((depth, width), dtype=np.float32)
+        self.baseline_epoch = -1
+        self.lock = threading.RLock()
+
+    def epoch(self, now=None):
+        return int((time.time() if now is None else now) // self.bucket_seconds)
+
+    def _fold(self, slot):
+        epoch = int(self.epochs[slot])
+        if self.baseline_epoch >= 0:
+            self.baseline *= self.decay ** (epoch - self.baseline_epoch)
+        self.baseline += (1 - self.decay) * self.window[slot]
+        self.baseline_epoch = epoch
+        self.window[slot] = 0
+        self.epochs[slot] = -1
+        self.heavy[slot].clear()
+
+    def advance(self, epoch):
+        """Fold every bucket that fell out of the window ending at ``epoch``."""
+        expired = [slot for slot in np.argsort(self.epochs) if 0 <= self.epochs[slot] <= epoch - self.window_buckets]
+        for slot in expired:
+            self._fold(slot)
+        slot = epoch % self.window_buckets
+        if self.epochs[slot] != epoch:
+            if self.epochs[slot] >= 0:
+                self._fold(slot)
+            self.epochs[slot] = epoch
+        return slot
+
+    def record(self, keys, now=None):
+        keys = list(keys)
+        if not keys:
+            return
+        with self.lock:
+            slot = self.advance(self.epoch(now))
+            columns = self.sketch.columns(keys)
+            rows = np.broadcast_to(np.arange(self.sketch.depth)[:, np.newaxis], columns.shape)
+            np.add.at(self.window[slot], (rows, columns), 1)
+            for key in keys:
+                self.heavy[slot].add(int(key))
+
+    def top(self, limit=10, now=None, min_rate=1.0):
+        """``[(key, current_count, baseline_rate, velocity)]`` ordered by velocity."""
+        with self.lock:
+            self.advance(self.epoch(now))
+            live = self.epochs >= 0
+            candidates = sorted({key for slot in np.flatnonzero(live) for key, _, _ in self.heavy[slot].items()})
+            if not candidates:
+                return []
+            columns = self.sketch.columns(candidates)
+            rows = np.arange(self.sketch.depth)[:, np.newaxis]
+            current = self.window[live].sum(axis=0, dtype=np.int64)[rows, columns].min(axis=0)
+            baseline = self.baseline[rows, columns].min(axis=0)
+            if self.baseline_epoch >= 0:
+                baseline = baseline * self.decay ** max(0, self.epoch(now) - self.window_buckets - self.baseline_epoch)
+        velocity = (current / self.window_buckets) / np.maximum(baseline, min_rate)
+        order = np.lexsort((-current, -velocity))[:limit]
+        return [(candidates[i], int(current[i]), float(baseline[i]), float(velocity[i])) for i in order]
+
+    def merge(self, other, now=None):
+        with self.lock:
+            epoch = self.epoch(now)
+            self.advance(epoch)
+            with other.lock:
+                other.advance(epoch)
+            if self.window.shape != other.window.shape or self.bucket_seconds != other.bucket_seconds:
+                raise ValueError('Only engines with the same shape can be merged.')
+            for slot in range(self.window_buckets):
+                if other.epochs[slot] < 0:
+                    continue
+                if self.epochs[slot] < 0:
+                    self.epochs[slot] = other.epochs[slot]
+                self.window[slot] += other.window[slot]
+                self.heavy[slot].merge(other.heavy[slot])
+            if other.baseline_epoch >= 0:
+                latest = max(self.baseline_epoch, other.baseline_epoch)
+                mine = self.baseline * self.decay ** (latest - self.baseline_epoch) if self.baseline_epoch >= 0 else 0
+                self.baseline = (mine + other.baseline * self.decay ** (latest - other.baseline_epoch)).astype(np.float32)
+                self.baseline_epoch = latest
+
+    def save(self, path):
+        with self.lock:
+            heavy_keys = np.stack([summary.keys for summary in self.heavy])
+            heavy_counts = np.stack([summary.counts for summary in self.heavy])
+            heavy_errors = np.stack([summary.errors for summary in self.heavy])
+            tmp = Path(f'{path}.tmp.npz')
+            np.savez(
+                tmp, window=self.window, epochs=self.epochs, baseline=self.baseline,
+                baseline_epoch=np.int64(self.baseline_epoch), heavy_keys=heavy_keys,
+                heavy_counts=heavy_counts, heavy_errors=heavy_errors,
+                params=np.array([self.bucket_seconds, self.window_buckets], dtype=np.int64),
+                decay=np.float64(self.decay),
+            )
+            os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            bucket_seconds, window_buckets = (int(value) for value in data['params'])
+            _, depth, width = data['window'].shape
+            engine = cls(bucket_seconds, window_buckets, width=width, depth=depth, capacity=data['heavy_keys'].shape[1])
+            engine.decay = float(data['decay'])
+            engine.window[:] = data['window']
+            engine.epochs[:] = data['epochs']
+            engine.baseline[:] = data['baseline']
+            engine.baseline_epoch = int(data['baseline_epoch'])
+            for summary, keys, counts, errors in zip(engine.heavy, data['heavy_keys'], data['heavy_counts'], data['heavy_errors']):
+                used = keys >= 0
+                summary.keys[:used.sum()], summary.counts[:used.sum()], summary.errors[:used.sum()] = keys[used], counts[used], errors[used]
+                summary.slots = {int(key): slot for slot, key in enumerate(keys[used])}
+        return engine
+
+
+def _new_engine():
+    return TrendingEngine(
+        bucket_seconds=settings.TRENDING_BUCKET_SECONDS,
+        window_buckets=settings.TRENDING_WINDOW_BUCKETS,
+        half_life_buckets=settings.TRENDING_BASELINE_HALF_LIFE_BUCKETS,
+        width=settings.TRENDING_SKETCH_WIDTH,
+        depth=settings.TRENDING_SKETCH_DEPTH,
+        capacity=settings.TRENDING_HEAVY_HITTERS,
+    )
+
+
+_engine = None
+_engine_lock = threading.Lock()
+_checkpointer = None
+_merged = None
+
+
+def get_engine():
+    """The engine fed by this process, seeded with the checkpoints of processes that exited."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                engine = _new_engine()
+                if settings.TRENDING_CHECKPOINT_DIR:
+                    _adopt_checkpoints(engine, startup=True)
+                    if settings.TRENDING_CHECKPOINT_THREAD:
+                        _start_checkpointer()
+                _engine = engine
+    return _engine
+
+
+def checkpoint_path():
+    return Path(settings.TRENDING_CHECKPOINT_DIR) / f'{socket.gethostname()}-{os.getpid()}.npz'
+
+
+def _adopt_checkpoints(engine, startup=False):
+    """Merge checkpoints no process has saved for a while into ``engine`` and take them over.
+
+    A checkpoint is renamed before it is read, so only one process adopts it, and removed
+    once ``engine`` has been saved under this process's name. At ``startup`` a checkpoint
+    under that name is adopted too: a process on the same host with the same pid left
+    it, as a restarted container does. Returns how many were adopted.
+    """
+    directory = Path(settings.TRENDING_CHECKPOINT_DIR)
+    own = checkpoint_path()
+    stale = time.time() - 3 * settings.TRENDING_CHECKPOINT_SECONDS
+    adopted = []
+    for path in directory.glob('*.npz'):
+        try:
+            if path == own:
+                if not startup:
+                    continue
+            elif path.stat().st_mtime >= stale:
+                continue
+            claimed = path.with_name(f'{path.name}.{os.getpid()}.adopted')
+            path.rename(claimed)
+        except OSError:
+            continue
+        try:
+            engine.merge(TrendingEngine.load(claimed))
+        except (OSError, ValueError, KeyError):
+            pass
+        adopted.append(claimed)
+    if adopted:
+        own.parent.mkdir(parents=True, exist_ok=True)
+        engine.save(own)
+        for claimed in adopted:
+            claimed.unlink(missing_ok=True)
+    return len(adopted)
+
+
+def checkpoint():
+    """Persist this process's engine; a no-op when ``TRENDING_CHECKPOINT_DIR`` is empty."""
+    if not settings.TRENDING_CHECKPOINT_DIR:
+        return False
+    path = checkpoint_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    get_engine().save(path)
+    return True
+
+
+def _start_checkpointer():
+    """Save this process's engine on a timer, off the request path that feeds it."""
+    global _checkpointer
+    if _checkpointer is None:
+        _checkpointer = threading.Thread(target=_checkpoint_periodically, name='trending-checkpoint', daemon=True)
+        _checkpointer.start()
+
+
+def _checkpoint_periodically():
+    while True:
+        time.sleep(settings.TRENDING_CHECKPOINT_SECONDS)
+        try:
+            _adopt_checkpoints(get_engine())
+            checkpoint()
+        except Exception:
+            logger.exception('Checkpointing the trending engine failed')
+
+
+@atexit.register
+def _checkpoint_at_exit():
+    if _engine is not None:
+        try:
+            checkpoint()
+        except Exception:
+            logger.exception('Checkpointing the trending engine failed')
+
+
+def record(hashtag_ids):
+    get_engine().record(hashtag_ids)
+
+
+def _merge_checkpoints(engine):
+    if not settings.TRENDING_CHECKPOINT_DIR:
+        return
+    own = checkpoint_path()
+    horizon = time.time() - settings.TRENDING_CHECKPOINT_MAX_AGE_SECONDS
+    for path in Path(settings.TRENDING_CHECKPOINT_DIR).glob('*.npz'):
+        if path == own:
+            continue
+        try:
+            if path.stat().st_mtime < horizon:
+                path.unlink(missing_ok=True)
+                continue
+            engine.merge(TrendingEngine.load(path))
+        except (OSError, ValueError, KeyError):
+            continue
+
+
+def trending(limit):
+    """Top ``limit`` ``(hashtag_id, count, baseline, velocity)`` across all workers.
+
+    This process's engine is merged with every other checkpoint and ranked once every
+    ``TRENDING_REFRESH_SECONDS``; reads in between are a slice of that ranking.
+    Checkpoints left by exited processes keep contributing until a live process
+    adopts them into its own, which is what lets counts survive restarts.
+    """
+    global _merged
+    now = time.monotonic()
+    if _merged is None or now - _merged[0] >= settings.TRENDING_REFRESH_SECONDS:
+        engine = _new_engine()
+        engine.merge(get_engine())
+        _merge_checkpoints(engine)
+        _merged = (now, engine.top(settings.API_MAX_PAGE_SIZE, min_rate=settings.TRENDING_MIN_BASELINE_RATE))
+    return _merged[1][:limit]
+
+
+def reset():
+    global _engine, _merged
+    _engine, _merged = None, None
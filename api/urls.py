@@ -1,8 +1,8 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import UserProfileViewSet, TweetViewSet, UserRegistrationAPIView, UserProfileAPIView, ActiveUsersAPIView, follow_user, unfollow_user, FeedAPIView, NotificationAPIView, like_tweet, retweet_tweet
+from .metrics import metrics_view
+from .views import UserProfileViewSet, TweetViewSet, UserRegistrationAPIView, UserProfileAPIView, ActiveUsersAPIView, follow_user, unfollow_user, FeedAPIView, NotificationAPIView, like_tweet, unlike_tweet, retweet_tweet, unretweet_tweet, batch_like, batch_retweet, relationships, ArchivedTweetsAPIView, SearchAPIView, LoginTokenObtainPairView, unread_notifications, mark_notifications_read, event_stream, DeletionStatisticsAPIView
 from rest_framework_simplejwt.views import (
-    TokenObtainPairView,
     TokenRefreshView,
 )
 
@@ -12,7 +12,7 @@ router.register(r'tweets', TweetViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
-    path('auth/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('auth/token/', LoginTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('auth/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('auth/register/', UserRegistrationAPIView.as_view(), name='auth_register'),
     path('auth/profile/', UserProfileAPIView.as_view(), name='auth_profile'),
@@ -20,7 +20,20 @@ urlpatterns = [
     path('follow/<str:username>/', follow_user, name='follow_user'),
     path('unfollow/<str:username>/', unfollow_user, name='unfollow_user'),
     path('feed/', FeedAPIView.as_view(), name='user_feed'),
+    path('search/', SearchAPIView.as_view(), name='search'),
+    path('stream/', event_stream, name='event_stream'),
     path('notifications/', NotificationAPIView.as_view(), name='notifications'),
+    path('notifications/unread/', unread_notifications, name='unread_notifications'),
+    path('notifications/read/', mark_notifications_read, name='mark_notifications_read'),
     path('like/<int:tweet_id>/', like_tweet, name='like_tweet'),
+    path('unlike/<int:tweet_id>/', unlike_tweet, name='unlike_tweet'),
     path('retweet/<int:tweet_id>/', retweet_tweet, name='retweet_tweet'),
+    path('unretweet/<int:tweet_id>/', unretweet_tweet, name='unretweet_tweet'),
+    path('batch/like/', batch_like, name='batch_like'),
+    path('batch/retweet/', batch_retweet, name='batch_retweet'),
+    path('relationships/', relationships, name='relationships'),
+    path('metrics', metrics_view, name='metrics'),
+    path('stats/deletions/', DeletionStatisticsAPIView.as_view(), name='deletion_statistics'),
+    path('archive/tweets/<int:tweet_id>/', ArchivedTweetsAPIView.as_view(), name='archived_tweet'),
+    path('archive/authors/<int:author_id>/', ArchivedTweetsAPIView.as_view(), name='archived_author_tweets'),
 ]
\ No newline at end of file
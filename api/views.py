@@ -2,40 +2,55 @@ from rest_framework import viewsets, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from django.utils import timezone
-from datetime import timedelta
-from django.db.models import Count
-from .models import UserProfile, Tweet, Hashtag, Follow, Notification, Like, Retweet
-from .serializers import UserProfileSerializer, TweetSerializer, NotificationSerializer
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from django.db import transaction
+from .models import UserProfile, Tweet, Hashtag, Notification, Like, Retweet
+from .serializers import (
+    UserProfileSerializer, TweetSerializer, ClaimsTokenObtainPairSerializer,
+    notification_reader, profile_reader, tweet_reader,
+)
 from django.contrib.auth.models import User
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.permissions import AllowAny
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 from rest_framework.decorators import api_view
 from django.shortcuts import get_object_or_404
+from django.conf import settings
+from django.utils.dateparse import parse_date, parse_datetime
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from asgiref.sync import sync_to_async
+from .authentication import CachedJWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.views import TokenObtainPairView
+from django.contrib.auth.signals import user_logged_in
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
+from . import deletions, engagement, entities, hashtags, notifications, presence, search, streams, threads, timelines, trending
+from .pagination import KeysetPagination, SearchPagination
+from .response_cache import cache_response
+from .archive import ArchiveReader, restore
 
 
 @api_view(['POST'])
 def follow_user(request, username):
-    user_to_follow = get_object_or_404(UserProfile, user__username=username)
-    if Follow.objects.filter(follower=request.user.userprofile, followed=user_to_follow).exists():
-        return Response({'error': 'You are already following this user'}, status=status.HTTP_400_BAD_REQUEST)
-    Follow.objects.create(follower=request.user.userprofile, followed=user_to_follow)
-    Notification.objects.create(
-        recipient=user_to_follow,
-        sender=request.user.userprofile,
-        message=f"{request.user.username} has started following you."
-    )
+    try:
+        followed_id = engagement.follow(request.user.userprofile.pk, username)
+    except UserProfile.DoesNotExist:
+        raise Http404
+    if followed_id is None:
+        return Response({'message': 'You are already following this user'}, status=status.HTTP_200_OK)
+    notifications.notify([notifications.event(followed_id, 'follow', request.user.userprofile.pk, request.user.username)])
     return Response({'message': 'User followed successfully'}, status=status.HTTP_201_CREATED)
 
 @api_view(['POST'])
 def unfollow_user(request, username):
-    user_to_unfollow = get_object_or_404(UserProfile, user__username=username)
-    follow_relation = Follow.objects.filter(follower=request.user.userprofile, followed=user_to_unfollow)
-    if not follow_relation.exists():
-        return Response({'error': 'You are not following this user'}, status=status.HTTP_400_BAD_REQUEST)
-    follow_relation.delete()
+    try:
+        removed = engagement.unfollow(request.user.userprofile.pk, username)
+    except UserProfile.DoesNotExist:
+        raise Http404
+    if not removed:
+        return Response({'message': 'You are not following this user'}, status=status.HTTP_200_OK)
     return Response({'message': 'User unfollowed successfully'}, status=status.HTTP_204_NO_CONTENT)
 
 
@@ -43,39 +58,121 @@ class FeedAPIView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        following_users = Follow.objects.filter(follower=request.user.userprofile).values_list('followed_id', flat=True)
-        
-        tweets = Tweet.objects.filter(author_id__in=following_users, is_deleted=False).order_by('-created_at')
-        
-        serializer = TweetSerializer(tweets, many=True)
-        return Response(serializer.data)
+        owner_id = request.user.userprofile.pk
+        paginator = KeysetPagination()
+        entries = paginator.paginate(
+            lambda position, reverse, limit: timelines.read(owner_id, limit, position, reverse),
+            request, key=lambda entry: (entry[0], entry[1]),
+        )
+        found = Tweet.objects.filter(is_deleted=False).in_bulk([entry[1] for entry in entries])
+        tweets = [found[entry[1]] for entry in entries if entry[1] in found]
+        return paginator.get_paginated_response(tweet_reader(tweets))
+
+def parse_ids(value):
+    """Parse a comma-separated list of ids, in order and without repeats."""
+    parts = [part.strip() for part in value.split(',') if part.strip()]
+    if not all(part.isascii() and part.isdigit() for part in parts):
+        raise ValueError(value)
+    ids = list(dict.fromkeys(int(part) for part in parts))
+    if len(ids) > settings.API_MAX_PAGE_SIZE:
+        raise ValueError(value)
+    return ids
+
+
+def is_id_list(value):
+    """Whether a JSON value is a list of ids; ``True`` and ``False`` are ints to Python but not ids."""
+    return isinstance(value, list) and all(type(pk) is int for pk in value)
+
+def parse_moment(value):
+    """Parse an ISO date or datetime query parameter; naive values are taken as UTC."""
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        moment = datetime.combine(day, time.min)
+    return moment if timezone.is_aware(moment) else timezone.make_aware(moment, dt_timezone.utc)
+
+class SearchAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        query = request.query_params.get('q', '')
+        if not search.terms(query):
+            return Response({'error': 'A search query must be provided.'}, status=status.HTTP_400_BAD_REQUEST)
+        filters = {}
+        if request.query_params.get('author'):
+            filters['author_id'] = get_object_or_404(UserProfile, user__username=request.query_params['author']).pk
+        if request.query_params.get('hashtag'):
+            filters['hashtag'] = request.query_params['hashtag'].lstrip('#')
+        try:
+            for name in ('since', 'until'):
+                if request.query_params.get(name):
+                    filters[name] = parse_moment(request.query_params[name])
+        except ValueError:
+            return Response({'error': 'since and until must be ISO dates or datetimes.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        paginator = SearchPagination()
+        hits = paginator.paginate(
+            lambda position, reverse, limit: search.get_backend().search(query, limit, position, reverse, **filters),
+            request, key=lambda hit: (hit[0], hit[1]),
+        )
+        found = Tweet.objects.in_bulk([hit[1] for hit in hits])
+        tweets = [found[hit[1]] for hit in hits if hit[1] in found]
+        return paginator.get_paginated_response(tweet_reader(tweets))
+
+class LoginTokenObtainPairView(TokenObtainPairView):
+    """Issues a token pair and reports the login through ``user_logged_in``, like a session login would."""
+    serializer_class = ClaimsTokenObtainPairSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        try:
+            serializer.is_valid(raise_exception=True)
+        except TokenError as e:
+            raise InvalidToken(e.args[0])
+        user_logged_in.send(sender=serializer.user.__class__, request=request, user=serializer.user)
+        return Response(serializer.validated_data, status=status.HTTP_200_OK)
 
 class ActiveUsersAPIView(APIView):
 
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        users = User.objects.filter(last_login__isnull=False).order_by('-last_login')[:10]
-        data = [{'username': user.username, 'last_login': user.last_login} for user in users]
+        try:
+            limit = int(request.query_params.get('limit', settings.ACTIVE_USERS_LIMIT))
+            hours = int(request.query_params.get('hours', settings.ACTIVE_USERS_WINDOW_HOURS))
+        except ValueError:
+            return Response({'error': 'limit and hours must be integers.'}, status=status.HTTP_400_BAD_REQUEST)
+        limit = max(1, min(limit, settings.API_MAX_PAGE_SIZE))
+        hours = max(1, min(hours, settings.ACTIVE_USERS_WINDOW_HOURS))
+        users = presence.active_users(limit, timezone.now() - timedelta(hours=hours))
+        data = [{'username': username, 'last_login': moment} for _, username, moment in users]
         return Response(data)
     
 
 def calculate_deletion_statistics(start_date, end_date):
-    deleted_tweets = Tweet.objects.filter(
-        is_deleted=True,
-        created_at__range=[start_date, end_date]
-    )
+    return deletions.statistics(start_date, end_date)
 
-    deletion_reasons_count = deleted_tweets.values('delete_reason').annotate(
-        count=Count('delete_reason')
-    ).order_by('-count')
 
-    deletion_statistics = {item['delete_reason']: item['count'] for item in deletion_reasons_count}
+class DeletionStatisticsAPIView(APIView):
+    """Deleted tweets per reason, for tweets created between ``since`` and ``until`` (default: the last 30 days)."""
+    permission_classes = [IsAdminUser]
 
-    return deletion_statistics
+    def get(self, request):
+        try:
+            until = parse_moment(request.query_params['until']) if request.query_params.get('until') else timezone.now()
+            since = parse_moment(request.query_params['since']) if request.query_params.get('since') else until - timedelta(days=30)
+        except ValueError:
+            return Response({'error': 'since and until must be ISO dates or datetimes.'}, status=status.HTTP_400_BAD_REQUEST)
+        if since > until:
+            return Response({'error': 'since must not be after until.'}, status=status.HTTP_400_BAD_REQUEST)
+        reasons = calculate_deletion_statistics(since, until)
+        return Response({'since': since, 'until': until, 'total': sum(reasons.values()), 'reasons': reasons})
 
 
 class UserProfileAPIView(APIView):
+       @cache_response('user:{user}', per_user=True)
        def get(self, request):
            user_profile = {
                'username': request.user.username,
@@ -96,23 +193,106 @@ class UserRegistrationAPIView(APIView):
            return Response({'message': 'User created successfully'}, status=status.HTTP_201_CREATED)
 
 
-class UserProfileViewSet(viewsets.ModelViewSet):
+class ReadListMixin:
+    """Serves ``list`` through ``read_serializer``, a ``CompiledSerializer`` of the viewset's serializer."""
+    read_serializer = None
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return Response(self.read_serializer(queryset))
+        return self.get_paginated_response(self.read_serializer(page))
+
+class UserProfileViewSet(ReadListMixin, viewsets.ModelViewSet):
     queryset = UserProfile.objects.all()
     serializer_class = UserProfileSerializer
+    read_serializer = profile_reader
+    pagination_class = KeysetPagination
+
+    @cache_response('profiles')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cache_response('profile:{pk}')
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
 
-class TweetViewSet(viewsets.ModelViewSet):
+class TweetViewSet(ReadListMixin, viewsets.ModelViewSet):
     queryset = Tweet.objects.all()
     serializer_class = TweetSerializer
+    read_serializer = tweet_reader
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+
+    def list(self, request, *args, **kwargs):
+        """The tweets page, or with ``ids`` those tweets in that order: one query for them and one for their hashtags."""
+        if 'ids' not in request.query_params:
+            return super().list(request, *args, **kwargs)
+        try:
+            ids = parse_ids(request.query_params['ids'])
+        except ValueError:
+            return Response({'error': f'ids must be at most {settings.API_MAX_PAGE_SIZE} comma-separated tweet ids.'}, status=status.HTTP_400_BAD_REQUEST)
+        found = self.get_queryset().in_bulk(ids)
+        return Response(self.read_serializer([found[pk] for pk in ids if pk in found]))
+
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            entities.process([serializer.save()])
+
+    def perform_update(self, serializer):
+        """Save the update; deleting the tweet this way goes through ``mark_as_deleted``, like ``destroy``."""
+        tweet, data = serializer.instance, serializer.validated_data
+        deleted = data.pop('is_deleted', tweet.is_deleted)
+        if tweet.is_deleted and not deleted:
+            raise ValidationError({'is_deleted': 'Deleted tweets cannot be restored.'})
+        reason = data.pop('delete_reason', tweet.delete_reason) if deleted else None
+        with transaction.atomic():
+            serializer.save()
+            if deleted and (not tweet.is_deleted or reason != tweet.delete_reason):
+                tweet.mark_as_deleted(reason)
+
+    @cache_response('tweet:{pk}')
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @action(detail=True, methods=['get'])
+    def thread(self, request, pk=None):
+        try:
+            depth = int(request.query_params.get('depth', settings.THREAD_DEPTH))
+            breadth = int(request.query_params.get('breadth', settings.THREAD_BREADTH))
+        except ValueError:
+            return Response({'error': 'depth and breadth must be integers.'}, status=status.HTTP_400_BAD_REQUEST)
+        after = threads.decode_cursor(request.query_params.get('cursor'))
+        tweet = self.get_object()
+        depth = max(1, min(depth, settings.THREAD_MAX_DEPTH))
+        breadth = max(1, min(breadth, settings.API_MAX_PAGE_SIZE))
+        return Response(threads.tree(tweet, request, depth, breadth, after, settings.THREAD_MAX_NODES))
+
     @action(detail=False, methods=['get'])
+    @cache_response('hashtags')
     def popular_hashtags(self, request):
-        seven_days_ago = timezone.now() - timedelta(days=7)
-        recent_tweets = self.queryset.filter(created_at__gte=seven_days_ago)
-        hashtag_counts = Hashtag.objects.filter(tweets__in=recent_tweets)\
-                                        .annotate(num_tweets=Count('tweets'))\
-                                        .order_by('-num_tweets')
-        data = [{'hashtag': hashtag.tag, 'count': hashtag.num_tweets} for hashtag in hashtag_counts]
-        return Response(data)
+        try:
+            hours = int(request.query_params.get('hours', settings.POPULAR_HASHTAGS_WINDOW_HOURS))
+            limit = int(request.query_params.get('limit', settings.POPULAR_HASHTAGS_LIMIT))
+        except ValueError:
+            return Response({'error': 'hours and limit must be integers.'}, status=status.HTTP_400_BAD_REQUEST)
+        hours = max(1, min(hours, settings.POPULAR_HASHTAGS_WINDOW_HOURS))
+        limit = max(1, min(limit, settings.API_MAX_PAGE_SIZE))
+        return Response(hashtags.popular(hours, limit))
+
+    @action(detail=False, methods=['get'])
+    def trending_hashtags(self, request):
+        try:
+            limit = int(request.query_params.get('limit', settings.POPULAR_HASHTAGS_LIMIT))
+        except ValueError:
+            return Response({'error': 'limit must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+        ranked = trending.trending(max(1, min(limit, settings.API_MAX_PAGE_SIZE)))
+        tags = dict(Hashtag.objects.filter(pk__in=[row[0] for row in ranked]).values_list('pk', 'tag'))
+        return Response([
+            {'hashtag': tags[pk], 'count': count, 'baseline': round(baseline, 3), 'velocity': round(velocity, 3)}
+            for pk, count, baseline, velocity in ranked if pk in tags
+        ])
 
     def destroy(self, request, *args, **kwargs):
         tweet = self.get_object()
@@ -130,22 +310,144 @@ class NotificationAPIView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        notifications = Notification.objects.filter(recipient=request.user.userprofile).order_by('-created_at')
-        serializer = NotificationSerializer(notifications, many=True)
-        return Response(serializer.data)
+        notifications = Notification.objects.filter(recipient=request.user.userprofile)
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(notifications, request, view=self)
+        return paginator.get_paginated_response(notification_reader(page))
+
+@api_view(['GET'])
+def unread_notifications(request):
+    return Response({'unread_count': notifications.unread_count(request.user.userprofile.pk)})
+
+@api_view(['POST'])
+def mark_notifications_read(request):
+    ids = request.data.get('ids')
+    if ids is not None and not is_id_list(ids):
+        return Response({'error': 'ids must be a list of notification ids.'}, status=status.HTTP_400_BAD_REQUEST)
+    marked = notifications.mark_read(request.user.userprofile.pk, ids)
+    return Response({'marked': marked, 'unread_count': notifications.unread_count(request.user.userprofile.pk)})
+
+def _engage(request, model, tweet_id, verb, done, already):
+    try:
+        author_id = engagement.engage(model, request.user.userprofile.pk, tweet_id)
+    except Tweet.DoesNotExist:
+        raise Http404
+    if author_id is None:
+        return Response({'message': already}, status=status.HTTP_200_OK)
+    notifications.notify([notifications.event(author_id, verb, request.user.userprofile.pk, request.user.username, tweet_id)])
+    return Response({'message': done}, status=status.HTTP_201_CREATED)
+
+def _disengage(request, model, tweet_id, done, already):
+    try:
+        removed = engagement.disengage(model, request.user.userprofile.pk, tweet_id)
+    except Tweet.DoesNotExist:
+        raise Http404
+    if not removed:
+        return Response({'message': already}, status=status.HTTP_200_OK)
+    return Response({'message': done}, status=status.HTTP_204_NO_CONTENT)
+
+def _engage_many(request, model, verb, key):
+    ids = request.data.get('ids')
+    if not is_id_list(ids) or not 0 < len(ids) <= settings.API_MAX_PAGE_SIZE:
+        return Response({'error': f'ids must be a list of at most {settings.API_MAX_PAGE_SIZE} tweet ids.'}, status=status.HTTP_400_BAD_REQUEST)
+    profile_id = request.user.userprofile.pk
+    added, missing = engagement.engage_many(model, profile_id, list(dict.fromkeys(ids)))
+    notifications.notify([notifications.event(author_id, verb, profile_id, request.user.username, pk) for pk, author_id in added.items()])
+    return Response({key: sorted(added), 'missing': missing})
+
+@api_view(['POST'])
+def batch_like(request):
+    return _engage_many(request, Like, 'like', 'liked')
+
+@api_view(['POST'])
+def batch_retweet(request):
+    return _engage_many(request, Retweet, 'retweet', 'retweeted')
+
+@api_view(['GET'])
+def relationships(request):
+    usernames = list(dict.fromkeys(name for name in request.query_params.get('users', '').split(',') if name))
+    try:
+        tweet_ids = parse_ids(request.query_params.get('tweets', ''))
+    except ValueError:
+        tweet_ids = None
+    if tweet_ids is None or len(usernames) > settings.API_MAX_PAGE_SIZE:
+        return Response(
+            {'error': f'users and tweets must each be at most {settings.API_MAX_PAGE_SIZE} comma-separated usernames or tweet ids.'},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    users, tweets = engagement.relationships(request.user.userprofile.pk, usernames, tweet_ids)
+    return Response({
+        'users': [{'username': name, **users[name]} for name in usernames if name in users],
+        'tweets': [{'id': pk, **tweets[pk]} for pk in tweet_ids],
+    })
 
 @api_view(['POST'])
 def like_tweet(request, tweet_id):
-    tweet = get_object_or_404(Tweet, id=tweet_id)
-    if Like.objects.filter(user=request.user.userprofile, tweet=tweet).exists():
-        return Response({'error': 'You have already liked this tweet'}, status=status.HTTP_400_BAD_REQUEST)
-    Like.objects.create(user=request.user.userprofile, tweet=tweet)
-    return Response({'message': 'Tweet liked successfully'}, status=status.HTTP_201_CREATED)
+    return _engage(request, Like, tweet_id, 'like', 'Tweet liked successfully', 'You have already liked this tweet')
+
+@api_view(['POST'])
+def unlike_tweet(request, tweet_id):
+    return _disengage(request, Like, tweet_id, 'Tweet unliked successfully', 'You have not liked this tweet')
 
 @api_view(['POST'])
 def retweet_tweet(request, tweet_id):
-    tweet = get_object_or_404(Tweet, id=tweet_id)
-    if Retweet.objects.filter(user=request.user.userprofile, tweet=tweet).exists():
-        return Response({'error': 'You have already retweeted this tweet'}, status=status.HTTP_400_BAD_REQUEST)
-    Retweet.objects.create(user=request.user.userprofile, tweet=tweet)
-    return Response({'message': 'Tweet retweeted successfully'}, status=status.HTTP_201_CREATED)
+    return _engage(request, Retweet, tweet_id, 'retweet', 'Tweet retweeted successfully', 'You have already retweeted this tweet')
+
+@api_view(['POST'])
+def unretweet_tweet(request, tweet_id):
+    return _disengage(request, Retweet, tweet_id, 'Retweet removed successfully', 'You have not retweeted this tweet')
+
+
+class ArchivedTweetsAPIView(APIView):
+    """Fetch (GET) or restore (POST) archived tweets by tweet id or by author profile id."""
+    permission_classes = [IsAdminUser]
+
+    def get_records(self, tweet_id=None, author_id=None):
+        with ArchiveReader(settings.TWEET_ARCHIVE_DIR) as reader:
+            if tweet_id is not None:
+                record = reader.get(tweet_id)
+                return [record] if record else []
+            return reader.by_author(author_id)
+
+    def get(self, request, tweet_id=None, author_id=None):
+        records = self.get_records(tweet_id, author_id)
+        if not records:
+            return Response({'error': 'No archived tweets found.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(records[0] if tweet_id is not None else records)
+
+    def post(self, request, tweet_id=None, author_id=None):
+        records = self.get_records(tweet_id, author_id)
+        if not records:
+            return Response({'error': 'No archived tweets found.'}, status=status.HTTP_404_NOT_FOUND)
+        restored = restore(records)
+        return Response({'restored': restored}, status=status.HTTP_201_CREATED if restored else status.HTTP_200_OK)
+
+
+def stream_profile_id(request):
+    """Authenticate a stream by its bearer header or, for ``EventSource`` clients, ``?access_token=``."""
+    authentication = CachedJWTAuthentication()
+    try:
+        if request.GET.get('access_token'):
+            user = authentication.get_user(authentication.get_validated_token(request.GET['access_token']))
+        else:
+            result = authentication.authenticate(request)
+            if result is None:
+                return None
+            user = result[0]
+    except (InvalidToken, TokenError, AuthenticationFailed):
+        return None
+    return UserProfile.objects.filter(user=user, user__is_active=True).values_list('pk', flat=True).first()
+
+async def event_stream(request):
+    profile_id = await sync_to_async(stream_profile_id)(request)
+    if profile_id is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=status.HTTP_401_UNAUTHORIZED)
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+    response = StreamingHttpResponse(streams.stream(profile_id, last_event_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
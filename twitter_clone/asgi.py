@@ -1,12 +1,17 @@
-from __future__ import absolute_import, unicode_literals
-import os
-from celery import Celery
+"""
+ASGI config for twitter_clone project.
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'twitter_clone.settings')
+It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with an ASGI server to get the /stream/ endpoint's long-lived connections.
 
-app = Celery('twitter_clone')
+For more information on this file, see
+https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
+"""
 
+import os
 
-app.config_from_object('django.conf:settings', namespace='CELERY')
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'twitter_clone.settings')
 
-app.autodiscover_tasks()
\ No newline at end of file
+application = get_asgi_application()
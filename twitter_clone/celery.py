@@ -14,6 +14,23 @@ app.conf.beat_schedule = {
         'task': 'api.tasks.fetch_and_update_tweets',
         'schedule': crontab(minute='*/5'),
     },
+    'trim-timelines-hourly': {
+        'task': 'api.tasks.trim_timelines',
+        'schedule': crontab(minute=15),
+    },
+    'prune-hashtag-counts-hourly': {
+        'task': 'api.tasks.prune_hashtag_counts',
+        'schedule': crontab(minute=45),
+    },
+    'flush-presence-every-minute': {
+        'task': 'api.tasks.flush_presence',
+        'schedule': crontab(),
+    },
+    'reconcile-recent-deletion-counts-daily': {
+        'task': 'api.tasks.backfill_deletion_counts',
+        'schedule': crontab(hour=3, minute=30),
+        'kwargs': {'days': 2},
+    },
     'backup-and-delete-old-tweets': {
         'task': 'api.tasks.backup_and_delete_old_tweets',
         'schedule': crontab(day_of_month=f'*/{int(os.getenv("BACKUP_PERIOD_DAYS", "30"))}'),
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,6 +42,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.RequestMetricsMiddleware',
+    'api.replicas.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -69,6 +72,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'twitter_clone.wsgi.application'
+ASGI_APPLICATION = 'twitter_clone.asgi.application'
 
 
 # Database
@@ -78,6 +82,8 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # On disk rather than in memory, so tests with concurrent writers can run.
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -125,7 +131,11 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CachedJWTAuthentication',
+    ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ),
 }
 
@@ -138,4 +148,87 @@ import environ
 env = environ.Env()
 environ.Env.read_env()
 
-BACKUP_PERIOD_DAYS = env.int('BACKUP_PERIOD_DAYS', default=30)
\ No newline at end of file
+BACKUP_PERIOD_DAYS = env.int('BACKUP_PERIOD_DAYS', default=30)
+TWEET_FEED_URL = env.str('TWEET_FEED_URL', default='https://jsonplaceholder.typicode.com/posts')
+TWEET_FEED_TIMEOUT = env.float('TWEET_FEED_TIMEOUT', default=10)
+TWEET_ARCHIVE_DIR = env.str('TWEET_ARCHIVE_DIR', default=str(BASE_DIR / 'archive'))
+TWEET_ARCHIVE_CHUNK_SIZE = env.int('TWEET_ARCHIVE_CHUNK_SIZE', default=500)
+TWEET_ARCHIVE_FRAME_SIZE = env.int('TWEET_ARCHIVE_FRAME_SIZE', default=256)
+
+API_PAGE_SIZE = env.int('API_PAGE_SIZE', default=20)
+API_MAX_PAGE_SIZE = env.int('API_MAX_PAGE_SIZE', default=100)
+
+THREAD_DEPTH = env.int('THREAD_DEPTH', default=3)
+THREAD_MAX_DEPTH = env.int('THREAD_MAX_DEPTH', default=20)
+THREAD_BREADTH = env.int('THREAD_BREADTH', default=10)
+THREAD_MAX_NODES = env.int('THREAD_MAX_NODES', default=500)
+
+POPULAR_HASHTAGS_WINDOW_HOURS = env.int('POPULAR_HASHTAGS_WINDOW_HOURS', default=168)
+POPULAR_HASHTAGS_LIMIT = env.int('POPULAR_HASHTAGS_LIMIT', default=10)
+HASHTAG_ID_CACHE_SIZE = env.int('HASHTAG_ID_CACHE_SIZE', default=10000)
+HASHTAG_ID_CACHE_TTL = env.int('HASHTAG_ID_CACHE_TTL', default=3600)
+
+TESTING = len(sys.argv) > 1 and sys.argv[1] == 'test'
+CELERY_TASK_ALWAYS_EAGER = env.bool('CELERY_TASK_ALWAYS_EAGER', default=TESTING)
+
+# Tests always get a private in-memory cache; deployments point CACHE_URL at a shared one, e.g. redis://redis:6379/1.
+CACHES = {'default': env.cache_url_config('locmemcache://') if TESTING else env.cache('CACHE_URL', default='locmemcache://')}
+RESPONSE_CACHE_ALIAS = env.str('RESPONSE_CACHE_ALIAS', default='default')
+RESPONSE_CACHE_TIMEOUT = env.int('RESPONSE_CACHE_TIMEOUT', default=300)
+
+REQUEST_METRICS_ENABLED = env.bool('REQUEST_METRICS_ENABLED', default=True)
+REQUEST_SLOW_MS = env.float('REQUEST_SLOW_MS', default=500)
+REQUEST_SLOW_TOP_SQL = env.int('REQUEST_SLOW_TOP_SQL', default=5)
+METRICS_ALLOWED_IPS = env.list('METRICS_ALLOWED_IPS', default=['127.0.0.1', '::1'])
+
+# Read replicas, e.g. DATABASE_REPLICA_URLS=sqlite:////tmp/replica1.sqlite3,sqlite:////tmp/replica2.sqlite3
+for index, url in enumerate(env.list('DATABASE_REPLICA_URLS', default=[]), start=1):
+    DATABASES[f'replica{index}'] = {**env.db_url_config(url), 'TEST': {'MIRROR': 'default'}}
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['api.replicas.PrimaryReplicaRouter']
+REPLICA_PIN_SECONDS = env.int('REPLICA_PIN_SECONDS', default=5)
+REPLICA_PIN_COOKIE = env.str('REPLICA_PIN_COOKIE', default='read_primary')
+REPLICA_HEALTH_INTERVAL = env.float('REPLICA_HEALTH_INTERVAL', default=10)
+
+TIMELINE_BACKEND = env.str('TIMELINE_BACKEND', default='api.timelines.DatabaseTimelineBackend')
+TIMELINE_MAX_LENGTH = env.int('TIMELINE_MAX_LENGTH', default=800)
+TIMELINE_FANOUT_THRESHOLD = env.int('TIMELINE_FANOUT_THRESHOLD', default=10000)
+
+NOTIFICATION_WINDOW_SECONDS = env.int('NOTIFICATION_WINDOW_SECONDS', default=900)
+NOTIFICATION_UNREAD_TTL = env.int('NOTIFICATION_UNREAD_TTL', default=300)
+
+AUTH_USER_CACHE_SIZE = env.int('AUTH_USER_CACHE_SIZE', default=10000)
+AUTH_USER_CACHE_TTL = env.int('AUTH_USER_CACHE_TTL', default=30)
+AUTH_TRUST_TOKEN_CLAIMS = env.bool('AUTH_TRUST_TOKEN_CLAIMS', default=False)
+
+PRESENCE_STORE = env.str('PRESENCE_STORE', default='api.presence.LocalPresenceStore')
+PRESENCE_REDIS_URL = env.str('PRESENCE_REDIS_URL', default='redis://localhost:6379/0')
+PRESENCE_MAX_USERS = env.int('PRESENCE_MAX_USERS', default=100000)
+PRESENCE_FLUSH_SECONDS = env.int('PRESENCE_FLUSH_SECONDS', default=60)
+PRESENCE_FLUSH_THREAD = env.bool('PRESENCE_FLUSH_THREAD', default=not TESTING)
+ACTIVE_USERS_LIMIT = env.int('ACTIVE_USERS_LIMIT', default=10)
+ACTIVE_USERS_WINDOW_HOURS = env.int('ACTIVE_USERS_WINDOW_HOURS', default=24 * 7)
+
+STREAM_BROKER = env.str('STREAM_BROKER', default='api.streams.LocalBroker')
+STREAM_REDIS_URL = env.str('STREAM_REDIS_URL', default='redis://localhost:6379/0')
+STREAM_BACKLOG = env.int('STREAM_BACKLOG', default=100)
+STREAM_BACKLOG_CHANNELS = env.int('STREAM_BACKLOG_CHANNELS', default=100000)
+STREAM_BACKLOG_SECONDS = env.int('STREAM_BACKLOG_SECONDS', default=3600)
+STREAM_QUEUE_SIZE = env.int('STREAM_QUEUE_SIZE', default=256)
+STREAM_KEEPALIVE_SECONDS = env.float('STREAM_KEEPALIVE_SECONDS', default=15)
+STREAM_RETRY_MS = env.int('STREAM_RETRY_MS', default=3000)
+
+SEARCH_BACKEND = env.str('SEARCH_BACKEND', default='api.search.SqliteSearchBackend')
+
+TRENDING_BUCKET_SECONDS = env.int('TRENDING_BUCKET_SECONDS', default=300)
+TRENDING_WINDOW_BUCKETS = env.int('TRENDING_WINDOW_BUCKETS', default=12)
+TRENDING_BASELINE_HALF_LIFE_BUCKETS = env.int('TRENDING_BASELINE_HALF_LIFE_BUCKETS', default=144)
+TRENDING_MIN_BASELINE_RATE = env.float('TRENDING_MIN_BASELINE_RATE', default=1.0)
+TRENDING_SKETCH_WIDTH = env.int('TRENDING_SKETCH_WIDTH', default=2 ** 14)
+TRENDING_SKETCH_DEPTH = env.int('TRENDING_SKETCH_DEPTH', default=4)
+TRENDING_HEAVY_HITTERS = env.int('TRENDING_HEAVY_HITTERS', default=512)
+TRENDING_CHECKPOINT_DIR = env.str('TRENDING_CHECKPOINT_DIR', default='' if TESTING else str(BASE_DIR / 'trending'))
+TRENDING_CHECKPOINT_SECONDS = env.int('TRENDING_CHECKPOINT_SECONDS', default=60)
+TRENDING_CHECKPOINT_THREAD = env.bool('TRENDING_CHECKPOINT_THREAD', default=not TESTING)
+TRENDING_CHECKPOINT_MAX_AGE_SECONDS = env.int('TRENDING_CHECKPOINT_MAX_AGE_SECONDS', default=2 * 24 * 3600)
+TRENDING_REFRESH_SECONDS = env.float('TRENDING_REFRESH_SECONDS', default=5)